@@ -9,6 +9,11 @@ from . import creation
 from . import subscription
 from . import announcement
 from . import network
+from . import versions
+from . import engine
+from . import rewiring
+from . import rebalance
+from . import writer
 
 __all__ = [
     "follower",
@@ -20,4 +25,9 @@ __all__ = [
     "subscription",
     "announcement",
     "network",
+    "versions",
+    "engine",
+    "rewiring",
+    "rebalance",
+    "writer",
 ]
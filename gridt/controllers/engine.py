@@ -0,0 +1,639 @@
+"""Controller keeping the graphs of the movements in memory."""
+import heapq
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import closing
+from datetime import datetime
+from itertools import chain
+
+from sqlalchemy import event
+from sqlalchemy.orm.session import Session
+
+from gridt.db import Session as DBSession
+from gridt.models import Signal, Subscription, UserToUserLink
+from gridt.controllers import follower as Follower
+from gridt.controllers import versions as Versions
+from .helpers import before_commit, hold_movement, on_commit, on_rollback
+
+RANDOM = "random"
+BALANCED = "balanced"
+ACTIVE = "active"
+
+# Signals count half after this many seconds for activity weighting.
+ACTIVITY_HALF_LIFE = 7 * 24 * 3600
+# Weight of a leader without signals relative to one signal sent just now.
+ACTIVITY_BASE_WEIGHT = 1.0
+
+__graphs = {}
+__lock = threading.RLock()
+
+
+class MovementGraph:
+    """
+    Adjacency of the network of a movement, kept in memory.
+
+    The graph is a cache of the database. It is valid as long as its version
+    equals the graph version of the movement.
+
+    :attribute version: The graph version this graph reflects.
+    :attribute members: Ids of the users subscribed to the movement.
+    :attribute leaders: Map of follower id to the ids of its leaders.
+    :attribute followers: Map of leader id to the ids of its followers.
+    :attribute underled: Ids of the members with fewer than MAX_LEADERS
+        leaders.
+    :attribute buckets: The underled members by their amount of leaders,
+        bucket i holds the members with i leaders.
+    :attribute loads: Min-heap of follower count and id of the members.
+        Entries are pushed on every change and outdated ones are skipped.
+    :attribute activity: Map of user id to the signals it sent, each
+        weighted by 2 ** (seconds after epoch / ACTIVITY_HALF_LIFE). As all
+        weights decay at the same rate they never need to be updated.
+    :attribute epoch: Time in seconds the activity is relative to.
+    :attribute lock: Lock to hold while reading or changing the graph.
+    """
+
+    def __init__(self, version: int):
+        """Construct an empty graph."""
+        self.version = version
+        self.members = set()
+        self.leaders = defaultdict(set)
+        self.followers = defaultdict(set)
+        self.underled = set()
+        self.buckets = [set() for _ in range(Follower.MAX_LEADERS)]
+        self.loads = []
+        self.activity = defaultdict(float)
+        self.epoch = time.time()
+        self._max_activity = 0.0
+        self.lock = threading.RLock()
+        # The members in a list as well, so one can be drawn in O(1).
+        self._member_list = []
+        self._member_positions = {}
+
+    def __repr__(self):
+        """Represent the graph as a string."""
+        links = sum(len(leaders) for leaders in self.leaders.values())
+        return (
+            f"<MovementGraph version={self.version} "
+            f"members={len(self.members)} links={links}>"
+        )
+
+    def load(self, movement_id: int, session: Session) -> None:
+        """Load the subscribers, active links and recent signals."""
+        subscribers = session.query(Subscription.user_id).filter(
+            Subscription.movement_id == movement_id,
+            Subscription.time_removed.is_(None),
+        )
+        links = session.query(
+            UserToUserLink.follower_id, UserToUserLink.leader_id
+        ).filter(
+            UserToUserLink.movement_id == movement_id,
+            UserToUserLink.destroyed.is_(None),
+        )
+        # Older signals weigh less than 2 ** -10 and are left out.
+        since = datetime.fromtimestamp(self.epoch - 10 * ACTIVITY_HALF_LIFE)
+        signals = session.query(Signal.leader_id, Signal.time_stamp).filter(
+            Signal.movement_id == movement_id,
+            Signal.time_stamp >= since,
+        )
+
+        with self.lock:
+            for user_id, in subscribers:
+                self.add_member(user_id)
+            for follower_id, leader_id in links:
+                self.add_link(follower_id, leader_id)
+            for leader_id, time_stamp in signals:
+                self.add_signal(leader_id, time_stamp)
+
+    def add_signal(self, user_id: int, time_stamp: datetime) -> None:
+        """Add a signal sent by a user to its activity."""
+        exponent = (time_stamp.timestamp() - self.epoch) / ACTIVITY_HALF_LIFE
+        with self.lock:
+            self.activity[user_id] += 2 ** exponent
+            self._max_activity = max(
+                self._max_activity, self.activity[user_id]
+            )
+
+    def activity_of(self, user_id: int, now: float = None) -> float:
+        """
+        Get the activity of a user.
+
+        Args:
+            user_id (int): The id of the user.
+            now (float): The time in seconds, the current time if None.
+
+        Returns:
+            float: The signals of the user, each counting half after every
+            ACTIVITY_HALF_LIFE.
+        """
+        now = time.time() if now is None else now
+        decay = 2 ** ((self.epoch - now) / ACTIVITY_HALF_LIFE)
+        with self.lock:
+            return self.activity.get(user_id, 0.0) * decay
+
+    def add_member(self, user_id: int) -> None:
+        """Add a subscriber to the graph."""
+        with self.lock:
+            if user_id not in self.members:
+                self._member_positions[user_id] = len(self._member_list)
+                self._member_list.append(user_id)
+            self.members.add(user_id)
+            self._update(user_id)
+            self._push_load(user_id)
+
+    def remove_member(self, user_id: int) -> None:
+        """Remove a subscriber from the graph, its links are kept."""
+        with self.lock:
+            if user_id in self.members:
+                # Move the last member into the gap to keep the list dense.
+                position = self._member_positions.pop(user_id)
+                last = self._member_list.pop()
+                if last != user_id:
+                    self._member_list[position] = last
+                    self._member_positions[last] = position
+            self.members.discard(user_id)
+            self._update(user_id)
+
+    def add_link(self, follower_id: int, leader_id: int) -> None:
+        """Add a link from a follower to a leader."""
+        with self.lock:
+            self.leaders[follower_id].add(leader_id)
+            self.followers[leader_id].add(follower_id)
+            self._update(follower_id)
+            self._push_load(leader_id)
+
+    def remove_link(self, follower_id: int, leader_id: int) -> None:
+        """Remove the link from a follower to a leader."""
+        with self.lock:
+            self.leaders[follower_id].discard(leader_id)
+            self.followers[leader_id].discard(follower_id)
+            self._update(follower_id)
+            self._push_load(leader_id)
+
+    def leader_count(self, user_id: int) -> int:
+        """Get the amount of leaders of a user."""
+        with self.lock:
+            return len(self.leaders.get(user_id, ()))
+
+    def follower_count(self, user_id: int) -> int:
+        """Get the amount of followers of a user."""
+        with self.lock:
+            return len(self.followers.get(user_id, ()))
+
+    def possible_leaders(self, user_id: int, exclude=()) -> list:
+        """
+        Find the members a user could follow.
+
+        Args:
+            user_id (int): The user that needs a leader.
+            exclude (iterable): Ids of users that may not be chosen.
+
+        Returns:
+            list: Ids of the members the user does not follow yet.
+        """
+        with self.lock:
+            return list(
+                self.members
+                - self.leaders.get(user_id, set())
+                - {user_id}
+                - set(exclude)
+            )
+
+    def sample_leaders(self, user_id: int, k: int, exclude=()) -> list:
+        """
+        Draw members a user could follow uniformly at random.
+
+        Members are drawn until k suitable ones are found, so the cost does
+        not depend on the size of the movement as long as most members are
+        suitable. Otherwise :meth:`possible_leaders` is sampled instead.
+
+        Args:
+            user_id (int): The user that needs leaders.
+            k (int): The amount of leaders to draw.
+            exclude (iterable): Ids of users that may not be chosen.
+
+        Returns:
+            list: Ids of at most k distinct members the user does not follow
+            yet.
+        """
+        with self.lock:
+            excluded = self.leaders.get(user_id, set()) | {user_id}
+            excluded = (excluded | set(exclude)) & self.members
+            available = len(self.members) - len(excluded)
+            k = min(k, available)
+            if k <= 0:
+                return []
+            if 2 * available < len(self.members):
+                return random.sample(
+                    self.possible_leaders(user_id, exclude), k
+                )
+
+            chosen = set()
+            while len(chosen) < k:
+                candidate = random.choice(self._member_list)
+                if candidate not in excluded:
+                    chosen.add(candidate)
+            return list(chosen)
+
+    def least_loaded_leaders(self, user_id: int, k: int, exclude=()) -> list:
+        """
+        Find the members a user could follow with the fewest followers.
+
+        The members are taken from :meth:`iter_least_loaded`, so this costs
+        O(k log n) as long as most members are suitable.
+
+        Args:
+            user_id (int): The user that needs leaders.
+            k (int): The amount of leaders to find.
+            exclude (iterable): Ids of users that may not be chosen.
+
+        Returns:
+            list: Ids of at most k distinct members the user does not follow
+            yet, with the fewest followers first.
+        """
+        with self.lock:
+            excluded = self.leaders.get(user_id, set()) | {user_id}
+            excluded |= set(exclude)
+            found = []
+            with closing(self.iter_least_loaded(excluded)) as members:
+                for _, leader_id in members:
+                    if len(found) >= k:
+                        break
+                    found.append(leader_id)
+            return found
+
+    def iter_least_loaded(self, exclude=()):
+        """
+        Iterate over the members with the fewest followers first.
+
+        Entries are popped from the heap of loads while iterating and pushed
+        back once the iteration is closed, so taking the first few members
+        costs O(log n) each. Hold the lock and do not change the graph while
+        iterating, and close the iterator when done.
+
+        Args:
+            exclude (iterable): Ids of users that are skipped.
+
+        Yields:
+            tuple: The follower count and id of a member.
+        """
+        excluded = set(exclude)
+        popped = []
+        seen = set()
+        try:
+            while self.loads:
+                load, leader_id = heapq.heappop(self.loads)
+                if (
+                    leader_id not in self.members
+                    or load != len(self.followers.get(leader_id, ()))
+                    or leader_id in seen
+                ):
+                    continue
+                popped.append((load, leader_id))
+                seen.add(leader_id)
+                if leader_id not in excluded:
+                    yield load, leader_id
+        finally:
+            for entry in popped:
+                heapq.heappush(self.loads, entry)
+
+    def active_leaders(self, user_id: int, k: int, exclude=()) -> list:
+        """
+        Draw members a user could follow, weighted by their activity.
+
+        A member is drawn with a weight of ACTIVITY_BASE_WEIGHT plus its
+        activity at the current time. Members are drawn uniformly and
+        accepted with their weight relative to the largest weight, so no
+        weights are summed and the expected cost is O(k) while activity is
+        spread over many members.
+        After too many rejections the candidates are weighted one by one.
+
+        Args:
+            user_id (int): The user that needs leaders.
+            k (int): The amount of leaders to draw.
+            exclude (iterable): Ids of users that may not be chosen.
+
+        Returns:
+            list: Ids of at most k distinct members the user does not follow
+            yet.
+        """
+        with self.lock:
+            excluded = self.leaders.get(user_id, set()) | {user_id}
+            excluded = (excluded | set(exclude)) & self.members
+            k = min(k, len(self.members) - len(excluded))
+            if k <= 0:
+                return []
+
+            # Activity is relative to the epoch, scale it to the current time
+            # before adding the base weight.
+            decay = 2 ** ((self.epoch - time.time()) / ACTIVITY_HALF_LIFE)
+
+            def weight(member):
+                activity = self.activity.get(member, 0.0) * decay
+                return ACTIVITY_BASE_WEIGHT + activity
+
+            largest = ACTIVITY_BASE_WEIGHT + self._max_activity * decay
+            chosen = []
+            for _ in range(64 * k):
+                if len(chosen) == k:
+                    return chosen
+                candidate = random.choice(self._member_list)
+                if candidate in excluded or candidate in chosen:
+                    continue
+                if random.random() * largest < weight(candidate):
+                    chosen.append(candidate)
+
+            # Weighted sampling without replacement over all candidates.
+            candidates = set(self.possible_leaders(user_id, exclude))
+            candidates -= set(chosen)
+            keys = [
+                (random.random() ** (1 / weight(member)), member)
+                for member in candidates
+            ]
+            rest = heapq.nlargest(k - len(chosen), keys)
+            return chosen + [member for _, member in rest]
+
+    def select_leaders(
+        self, user_id: int, k: int, strategy: str = RANDOM, exclude=()
+    ) -> list:
+        """
+        Select members a user could follow with a strategy.
+
+        Args:
+            user_id (int): The user that needs leaders.
+            k (int): The amount of leaders to select.
+            strategy (str): RANDOM to draw leaders uniformly at random,
+                BALANCED to prefer the leaders with the fewest followers or
+                ACTIVE to prefer the leaders that signaled recently.
+            exclude (iterable): Ids of users that may not be chosen.
+
+        Returns:
+            list: Ids of at most k distinct members the user does not follow
+            yet.
+        """
+        if strategy == BALANCED:
+            return self.least_loaded_leaders(user_id, k, exclude)
+        if strategy == ACTIVE:
+            return self.active_leaders(user_id, k, exclude)
+        if strategy == RANDOM:
+            return self.sample_leaders(user_id, k, exclude)
+        raise ValueError(f"Unknown leader selection strategy '{strategy}'.")
+
+    def possible_followers(self, user_id: int, exclude=()) -> list:
+        """
+        Find the members that could follow a user.
+
+        Args:
+            user_id (int): The user that would be the leader.
+            exclude (iterable): Ids of users that may not be chosen.
+
+        Returns:
+            list: Ids of the members with fewer than MAX_LEADERS leaders
+            that do not follow the user yet.
+        """
+        with self.lock:
+            return list(
+                self.underled
+                - self.followers.get(user_id, set())
+                - {user_id}
+                - set(exclude)
+            )
+
+    def neediest_followers(self, user_id: int, k: int, exclude=()) -> list:
+        """
+        Find the members that could follow a user with the fewest leaders.
+
+        The buckets are walked from the members without leaders upwards, so
+        only about k members are looked at.
+
+        Args:
+            user_id (int): The user that would be the leader.
+            k (int): The maximum amount of members to find.
+            exclude (iterable): Ids of users that may not be chosen.
+
+        Returns:
+            list: Ids of at most k members that do not follow the user yet,
+            with the fewest leaders first.
+        """
+        with self.lock:
+            excluded = self.followers.get(user_id, set()) | {user_id}
+            excluded |= set(exclude)
+            found = []
+            for bucket in self.buckets:
+                for follower_id in bucket:
+                    if len(found) >= k:
+                        return found
+                    if follower_id not in excluded:
+                        found.append(follower_id)
+            return found
+
+    def _push_load(self, user_id: int) -> None:
+        """Push the follower count of a member on the heap of loads."""
+        if user_id not in self.members:
+            return
+        heapq.heappush(
+            self.loads, (len(self.followers.get(user_id, ())), user_id)
+        )
+        # Rebuild the heap once it is mostly outdated entries.
+        if len(self.loads) > 4 * len(self.members) + 64:
+            self.loads = [
+                (len(self.followers.get(member, ())), member)
+                for member in self.members
+            ]
+            heapq.heapify(self.loads)
+
+    def _update(self, user_id: int) -> None:
+        """Update the indexes of a user after its links have changed."""
+        count = len(self.leaders.get(user_id, ()))
+        for bucket in self.buckets:
+            bucket.discard(user_id)
+        if user_id in self.members and count < Follower.MAX_LEADERS:
+            self.underled.add(user_id)
+            self.buckets[count].add(user_id)
+        else:
+            self.underled.discard(user_id)
+
+
+def get_graph(movement_id: int, session: Session) -> MovementGraph:
+    """
+    Get the graph of a movement, loading it from the database when needed.
+
+    The graph in memory is used while its version equals the graph version
+    of the movement in the database, so changes written by other processes
+    are picked up. Within a transaction the same graph is returned every
+    time, call this after locking the movement to see the latest version.
+
+    Changes are applied to the graph before they are committed, so the lock
+    stripe of the movement is held until the transaction ends. The graph
+    then only shows committed changes and those of the transaction itself.
+
+    Args:
+        movement_id (int): The id of the movement.
+        session (Session): The session to load the graph with.
+
+    Returns:
+        MovementGraph: The graph, which must only be changed through
+        :func:`record`.
+
+    Raises:
+        GridtExceptions.MovementNotFoundError: If the movement does not
+            exist.
+    """
+    tracked = __tracked(session)
+    graph = tracked["graphs"].get(movement_id)
+    if graph:
+        return graph
+
+    hold_movement(movement_id, session)
+    version = Versions.get_graph_version(movement_id, session)
+    with __lock:
+        graph = __graphs.get(movement_id)
+    if not graph or graph.version != version:
+        graph = MovementGraph(version)
+        graph.load(movement_id, session)
+        with __lock:
+            # A graph read in an older snapshot does not replace a newer one.
+            current = __graphs.get(movement_id)
+            if not current or current.version <= version:
+                __graphs[movement_id] = graph
+        # The session may hold changes that are not committed yet.
+        on_rollback(session, lambda: invalidate(movement_id))
+    tracked["graphs"][movement_id] = graph
+    return graph
+
+
+def record(
+    session: Session,
+    movement_id: int,
+    created=(),
+    destroyed=(),
+    joined=(),
+    left=(),
+) -> None:
+    """
+    Record changes to the graph of a movement made in a session.
+
+    The changes are applied right away to the graph returned by
+    :func:`get_graph` in the session, so the rest of the transaction sees
+    them. Once the session commits the graph takes the graph version the
+    database ended up with, and the graph is dropped if the session rolls
+    back.
+
+    Args:
+        session (Session): The session in which the changes are made.
+        movement_id (int): The id of the movement that is changed.
+        created (iterable): Follower and leader id pairs of new links.
+        destroyed (iterable): Follower and leader id pairs of ended links.
+        joined (iterable): Ids of the users that subscribed.
+        left (iterable): Ids of the users that unsubscribed.
+    """
+    tracked = __tracked(session)
+    graph = tracked["graphs"].get(movement_id)
+    if graph:
+        with graph.lock:
+            for user_id in joined:
+                graph.add_member(user_id)
+            for follower_id, leader_id in destroyed:
+                graph.remove_link(follower_id, leader_id)
+            for follower_id, leader_id in created:
+                graph.add_link(follower_id, leader_id)
+            for user_id in left:
+                graph.remove_member(user_id)
+
+    if movement_id not in tracked["recorded"]:
+        tracked["recorded"].add(movement_id)
+        before_commit(
+            session, lambda: __committing(movement_id, graph, session)
+        )
+        on_rollback(session, lambda: invalidate(movement_id))
+
+
+def record_signal(
+    session: Session, movement_id: int, leader_id: int, time_stamp: datetime
+) -> None:
+    """
+    Add a signal to the activity of a leader once the session commits.
+
+    Signals do not change the graph, so its version is kept.
+
+    Args:
+        session (Session): The session in which the signal is sent.
+        movement_id (int): The id of the movement the signal is sent in.
+        leader_id (int): The id of the leader that sent the signal.
+        time_stamp (datetime): The time the signal was sent.
+    """
+    def committed():
+        with __lock:
+            graph = __graphs.get(movement_id)
+        if graph:
+            graph.add_signal(leader_id, time_stamp)
+
+    on_commit(session, committed)
+
+
+def invalidate(movement_id: int) -> None:
+    """Drop the graph of a movement, it is loaded again when needed."""
+    with __lock:
+        __graphs.pop(movement_id, None)
+
+
+def invalidate_on_commit(movement_id: int, session: Session) -> None:
+    """
+    Drop the graph of a movement once a session commits.
+
+    Use this for changes that are made without :func:`record`, like bulk
+    updates.
+
+    Args:
+        movement_id (int): The id of the movement that is changed.
+        session (Session): The session in which the changes are made.
+    """
+    on_commit(session, lambda: invalidate(movement_id))
+
+
+def __committing(
+    movement_id: int, graph: MovementGraph, session: Session
+) -> None:
+    """Read the graph version a transaction commits and keep the graph."""
+    session.flush()
+    version = Versions.get_graph_version(movement_id, session)
+    on_commit(session, lambda: __committed(movement_id, graph, version))
+
+
+def __committed(movement_id: int, graph: MovementGraph, version: int) -> None:
+    """Keep the graph valid for the new version if it is still current."""
+    with __lock:
+        current = __graphs.get(movement_id)
+        if graph and current is graph:
+            graph.version = version
+        else:
+            __graphs.pop(movement_id, None)
+
+
+def __tracked(session: Session) -> dict:
+    """Get the graphs and movements used in the current transaction."""
+    transaction = session.get_transaction() or session.begin()
+    tracked = session.info.get("engine")
+    if not tracked or tracked["transaction"] is not transaction:
+        tracked = session.info["engine"] = {
+            "transaction": transaction,
+            "graphs": {},
+            "recorded": set(),
+            "flushed": set(),
+        }
+    return tracked
+
+
+@event.listens_for(DBSession, "after_flush")
+def _track_flush(session: Session, context) -> None:
+    """Drop the graphs of movements changed without :func:`record`."""
+    tracked = __tracked(session)
+    for instance in chain(session.new, session.dirty, session.deleted):
+        if not isinstance(instance, (Subscription, UserToUserLink)):
+            continue
+        movement_id = instance.movement_id
+        if movement_id in tracked["recorded"] | tracked["flushed"]:
+            continue
+        tracked["flushed"].add(movement_id)
+        invalidate_on_commit(movement_id, session)
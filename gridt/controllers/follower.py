@@ -1,44 +1,75 @@
 """Controller for followers."""
 import random
+from datetime import datetime
 from operator import and_
 
-from sqlalchemy import desc
+from sqlalchemy import desc, select, update
 from sqlalchemy import not_, func
+from sqlalchemy.exc import NoResultFound
 from sqlalchemy.orm.session import Session
 
 from .helpers import (
     session_scope,
+    movement_scope,
     load_movement,
     load_user,
+    insert_links,
 )
 
-from gridt.controllers import leader as Leader
+from gridt.controllers import engine as Engine
 from gridt.models import User, UserToUserLink, Signal, Movement, Subscription
 
 # Move variable to config
 MESSAGE_HISTORY_MAX_DEPTH = 3
+MAX_LEADERS = 4
+# One of "random", "balanced" or "active", see MovementGraph.select_leaders.
+LEADER_SELECTION = "random"
 
 
-def add_initial_leaders(follower_id: int, movement_id: int) -> None:
+def add_initial_leaders(
+    follower_id: int, movement_id: int, strategy: str = None
+) -> None:
     """
     Add the initial leaders for a follower upon joining a movement.
 
     Args:
         follower_id (int): The id of the follower in the movement
         movement_id (int): The id of the movement to get leaders from.
+        strategy (str): How to select the leaders, LEADER_SELECTION if None.
     """
-    with session_scope() as session:
+    with movement_scope(movement_id) as session:
         user = load_user(follower_id, session)
         movement = load_movement(movement_id, session)
+        _add_initial_leaders(user, movement, session, strategy)
+
+
+def _add_initial_leaders(
+    user: User, movement: Movement, session: Session, strategy: str = None
+) -> list:
+    """
+    Link a follower to new leaders until it has MAX_LEADERS leaders.
+
+    Args:
+        user (User): The follower that needs leaders.
+        movement (Movement): The movement to find leaders in.
+        session (Session): The session in which the links are added.
+        strategy (str): How to select the leaders, LEADER_SELECTION if None.
 
-        while len(get_leaders(user, movement, session)) < 4:
-            available = Leader.possible_leaders(user, movement, session)
-            if not available:
-                break
+    Returns:
+        list: The ids of the new leaders of the follower.
+    """
+    graph = Engine.get_graph(movement.id, session)
 
-            random_leader = random.choice(available)
-            user_to_user_link = UserToUserLink(movement, user, random_leader)
-            session.add(user_to_user_link)
+    missing = MAX_LEADERS - graph.leader_count(user.id)
+    links = [
+        (user.id, leader_id)
+        for leader_id in graph.select_leaders(
+            user.id, missing, strategy or LEADER_SELECTION
+        )
+    ]
+    insert_links(movement.id, links, session)
+    Engine.record(session, movement.id, created=links)
+    return [leader_id for _, leader_id in links]
 
 
 def remove_all_leaders(follower_id: int, movement_id: int) -> None:
@@ -49,39 +80,55 @@ def remove_all_leaders(follower_id: int, movement_id: int) -> None:
         follower_id (int): The id of the follower in the movement.
         movement_id (int): The id of the movement itself.
     """
-    with session_scope() as session:
-        movement = load_movement(movement_id, session)
-
-        follower_user_to_user_links_to_destroy = session.query(
-            UserToUserLink
-        ).filter(
-            UserToUserLink.movement_id == movement_id,
-            UserToUserLink.destroyed.is_(None),
-            UserToUserLink.follower_id == follower_id,
-        ).all()
-
-        for user_to_user_link in follower_user_to_user_links_to_destroy:
-            user_to_user_link.destroy()
-
-        session.commit()
-
-        # For each leader removed try to find a new follower
-        for user_to_user_link in follower_user_to_user_links_to_destroy:
-            if not user_to_user_link.leader:
-                continue
-
-            poss_followers = possible_followers(
-                user=user_to_user_link.leader,
-                movement=user_to_user_link.movement,
-                session=session
+    with movement_scope(movement_id) as session:
+        _remove_all_leaders(follower_id, movement_id, session)
+
+
+def _remove_all_leaders(
+    follower_id: int, movement_id: int, session: Session
+) -> None:
+    """Remove all leaders from a follower within a session."""
+    movement = load_movement(movement_id, session)
+    graph = Engine.get_graph(movement_id, session)
+
+    follower_user_to_user_links_to_destroy = session.query(
+        UserToUserLink
+    ).filter(
+        UserToUserLink.movement_id == movement_id,
+        UserToUserLink.destroyed.is_(None),
+        UserToUserLink.follower_id == follower_id,
+    ).all()
+
+    for user_to_user_link in follower_user_to_user_links_to_destroy:
+        user_to_user_link.destroy()
+    Engine.record(session, movement_id, destroyed=[
+        (follower_id, user_to_user_link.leader_id)
+        for user_to_user_link in follower_user_to_user_links_to_destroy
+    ])
+
+    # For each leader removed try to find a new follower
+    for user_to_user_link in follower_user_to_user_links_to_destroy:
+        if not user_to_user_link.leader:
+            continue
+
+        leader_id = user_to_user_link.leader_id
+        poss_follower_ids = graph.possible_followers(
+            leader_id, exclude=[follower_id]
+        )
+        # Add new UserToUserLinks for each former leader.
+        if poss_follower_ids:
+            new_follower_id = random.choice(poss_follower_ids)
+            new_user_to_user_link = UserToUserLink(
+                movement,
+                load_user(new_follower_id, session),
+                user_to_user_link.leader
+            )
+            session.add(new_user_to_user_link)
+            Engine.record(
+                session, movement_id, created=[
+                    (new_follower_id, leader_id)
+                ]
             )
-            # Add new UserToUserLinks for each former leader.
-            if poss_followers:
-                new_follower = random.choice(poss_followers)
-                new_user_to_user_link = UserToUserLink(
-                    movement, new_follower, user_to_user_link.leader
-                )
-                session.add(new_user_to_user_link)
 
 
 def get_leaders(user: User, movement: Movement, session: Session) -> list:
@@ -148,59 +195,99 @@ def follows_leader(follower_id: int, movement_id: int, leader_id: int):
         return False
 
 
-def swap_leader(follower_id: int, movement_id: int, leader_id: int) -> dict:
+def swap_leader(
+    follower_id: int, movement_id: int, leader_id: int, strategy: str = None
+) -> dict:
     """
     Swap out the presented leader in the users leaders.
 
     :param follower_id: Id of the user who's leader will be swapped.
     :param movement_id: Movement in which the swap is supposed to happen
     :param leader_id: Id of the leader that will be swapped.
+    :param strategy: How to select the new leader, LEADER_SELECTION if None.
     :return: New leader dictionary or None
     """
-    with session_scope() as session:
-        leader = load_user(leader_id, session)
-        follower = load_user(follower_id, session)
-        movement = load_movement(movement_id, session)
+    with movement_scope(movement_id) as session:
+        return _swap_leader(
+            follower_id, movement_id, leader_id, session, strategy
+        )
 
-        # If there are no other possible leaders than we can't perform the
-        # swap.
-        poss_leaders = Leader.possible_leaders(follower, movement, session)
-        if not poss_leaders:
-            return None
 
-        user_to_user_link = (
-            session.query(UserToUserLink)
-            .filter(
-                UserToUserLink.follower_id == follower.id,
-                UserToUserLink.leader_id == leader.id,
-                UserToUserLink.movement_id == movement.id,
-                UserToUserLink.destroyed.is_(None),
-            )
-            .one()
-        )
+def _swap_leader(
+    follower_id: int,
+    movement_id: int,
+    leader_id: int,
+    session: Session,
+    strategy: str = None,
+) -> dict:
+    """
+    Swap out a leader of a follower within a session.
 
-        user_to_user_link.destroy()
+    The new leader is drawn from the graph of the movement. The old link is
+    destroyed, the new one inserted and the new leader loaded with its last
+    signal in one statement each, so the cost does not depend on the size
+    of the movement.
+    """
+    # If there are no other possible leaders than we can't perform the
+    # swap.
+    graph = Engine.get_graph(movement_id, session)
+    new_leader_ids = graph.select_leaders(
+        follower_id, 1, strategy or LEADER_SELECTION
+    )
+    if not new_leader_ids:
+        return None
+    new_leader_id = new_leader_ids[0]
 
-        new_leader = random.choice(poss_leaders)
-        new_assoc = UserToUserLink(movement, follower, new_leader)
-        session.add(new_assoc)
+    destroyed = session.execute(
+        update(UserToUserLink)
+        .where(
+            UserToUserLink.movement_id == movement_id,
+            UserToUserLink.follower_id == follower_id,
+            UserToUserLink.leader_id == leader_id,
+            UserToUserLink.destroyed.is_(None),
+        )
+        .values(destroyed=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    if destroyed.rowcount != 1:
+        raise NoResultFound(
+            f"User '{follower_id}' does not follow User '{leader_id}' in "
+            f"Movement '{movement_id}'."
+        )
 
-        leader_dict = new_leader.to_json()
+    insert_links(movement_id, [(follower_id, new_leader_id)], session)
+    Engine.record(
+        session,
+        movement_id,
+        destroyed=[(follower_id, leader_id)],
+        created=[(follower_id, new_leader_id)],
+    )
 
-        last_signal = (
-            session.query(Signal)
-            .filter_by(leader=new_leader, movement=movement)
-            .order_by(desc("time_stamp"))
-            .first()
+    last_signal_id = (
+        select(Signal.id)
+        .where(
+            Signal.leader_id == new_leader_id,
+            Signal.movement_id == movement_id,
         )
+        .order_by(Signal.time_stamp.desc(), Signal.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    new_leader, last_signal = (
+        session.query(User, Signal)
+        .outerjoin(Signal, Signal.id == last_signal_id)
+        .filter(User.id == new_leader_id)
+        .one()
+    )
 
-        if last_signal:
-            leader_dict["last_signal"] = {
-                "time_stamp": str(last_signal.time_stamp.astimezone()),
-                "message": last_signal.message
-            }
+    leader_dict = new_leader.to_json()
+    if last_signal:
+        leader_dict["last_signal"] = {
+            "time_stamp": str(last_signal.time_stamp.astimezone()),
+            "message": last_signal.message
+        }
 
-        return leader_dict
+    return leader_dict
 
 
 def possible_followers(
@@ -243,5 +330,5 @@ def possible_followers(
 
     return [
         subscription.user for subscription, counts
-        in potential_available_followers if counts < 4
+        in potential_available_followers if counts < MAX_LEADERS
     ]
@@ -1,9 +1,17 @@
 """Helpers for controllers."""
+import threading
 from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event, insert, or_, update
 from gridt.db import Session
-from gridt.models import User, Movement
+from gridt.models import User, Movement, UserToUserLink
 from gridt import exc as GridtExceptions
 
+# Changes to the networks of movements that map to the same stripe are
+# serialized within this process.
+LOCK_STRIPES = 64
+_stripes = [threading.RLock() for _ in range(LOCK_STRIPES)]
+
 
 @contextmanager
 def session_scope():
@@ -24,6 +32,125 @@ def session_scope():
         session.close()
 
 
+@contextmanager
+def movement_scope(movement_id: int):
+    """
+    Context for changing the network of a movement.
+
+    Like :func:`session_scope`, but no other change to the network of the
+    same movement runs until this one is committed. Within the process this
+    is guaranteed by a lock stripe, across processes by locking the row of
+    the movement with ``SELECT ... FOR UPDATE``. Graphs loaded after the lock
+    are checked against the graph version in the database, so they include
+    the changes other processes committed before. Changes to other
+    movements run in parallel unless they share the stripe.
+
+    Args:
+        movement_id (int): The id of the movement that will be changed.
+
+    Raises:
+        GridtExceptions.MovementNotFoundError: If the movement does not
+            exist.
+    """
+    with _stripes[hash(movement_id) % LOCK_STRIPES]:
+        with session_scope() as session:
+            lock_movement(movement_id, session)
+            yield session
+
+
+def hold_movement(movement_id: int, session: Session) -> None:
+    """
+    Hold the lock stripe of a movement until the transaction of a session ends.
+
+    Changes to the network of the movement in this process wait until the
+    transaction ends, and the transaction waits for the ones in progress.
+    The lock is taken again if the thread already holds it, like within
+    :func:`movement_scope`.
+
+    Args:
+        movement_id (int): The id of the movement.
+        session (Session): The session with the pending transaction.
+    """
+    stripe = _stripes[hash(movement_id) % LOCK_STRIPES]
+    stripe.acquire()
+    session.info.setdefault("stripes", []).append(stripe)
+
+
+def before_commit(session: Session, callback) -> None:
+    """
+    Call a function right before the current transaction of a session commits.
+
+    The function may still use the session, for example to read what the
+    transaction is about to commit.
+
+    Args:
+        session (Session): The session with the pending transaction.
+        callback (function): Function without arguments to call.
+    """
+    session.info.setdefault("before_commit", []).append(callback)
+
+
+def on_commit(session: Session, callback) -> None:
+    """
+    Call a function once the current transaction of a session is committed.
+
+    The function is dropped when the transaction is rolled back instead. Use
+    this to update in memory state only after the database has changed.
+
+    Args:
+        session (Session): The session with the pending transaction.
+        callback (function): Function without arguments to call.
+    """
+    session.info.setdefault("on_commit", []).append(callback)
+
+
+def on_rollback(session: Session, callback) -> None:
+    """
+    Call a function once the current transaction of a session is rolled back.
+
+    The function is dropped when the transaction is committed instead. Use
+    this to undo in memory state that was changed along with the database.
+
+    Args:
+        session (Session): The session with the pending transaction.
+        callback (function): Function without arguments to call.
+    """
+    session.info.setdefault("on_rollback", []).append(callback)
+
+
+@event.listens_for(Session, "before_commit")
+def _run_before_commit(session: Session) -> None:
+    """Call the functions registered with before_commit."""
+    for callback in session.info.pop("before_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_commit")
+def _run_on_commit(session: Session) -> None:
+    """Call the functions registered with on_commit."""
+    session.info.pop("on_rollback", None)
+    for callback in session.info.pop("on_commit", []):
+        callback()
+
+
+@event.listens_for(Session, "after_rollback")
+def _run_on_rollback(session: Session) -> None:
+    """Call the functions registered with on_rollback."""
+    session.info.pop("before_commit", None)
+    session.info.pop("on_commit", None)
+    for callback in session.info.pop("on_rollback", []):
+        callback()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _release_stripes(session: Session, transaction) -> None:
+    """Release the lock stripes held by a transaction that ended."""
+    if transaction.parent is not None:
+        return
+    for stripe in reversed(session.info.pop("stripes", [])):
+        stripe.release()
+
+
 def assert_user_is_admin(user_id: int, session: Session) -> None:
     """
     Raise an exception if the user is not an admin.
@@ -50,6 +177,39 @@ def load_user(user_id: int, session: Session) -> User:
     return user
 
 
+def load_users(user_ids: list, session: Session) -> list:
+    """Load many users from the database in the order of their ids."""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return []
+
+    users = {
+        user.id: user
+        for user in session.query(User).filter(User.id.in_(user_ids))
+    }
+    missing = [user_id for user_id in user_ids if user_id not in users]
+    if missing:
+        raise GridtExceptions.UserNotFoundError(
+            f"No IDs '{missing}' not found."
+        )
+    return [users[user_id] for user_id in user_ids]
+
+
+def lock_movement(movement_id: int, session: Session) -> Movement:
+    """Load a movement from the database, locking its row."""
+    movement = (
+        session.query(Movement)
+        .filter(Movement.id == movement_id)
+        .with_for_update()
+        .one_or_none()
+    )
+    if not movement:
+        raise GridtExceptions.MovementNotFoundError(
+            f"No ID '{movement_id}' not found."
+        )
+    return movement
+
+
 def load_movement(movement_id: int, session: Session) -> Movement:
     """Load a movement from the database."""
     movement = session.get(Movement, movement_id)
@@ -58,3 +218,57 @@ def load_movement(movement_id: int, session: Session) -> Movement:
             f"No ID '{movement_id}' not found."
         )
     return movement
+
+
+def insert_links(movement_id: int, links: list, session: Session) -> None:
+    """
+    Insert new links in a movement with a single statement.
+
+    Args:
+        movement_id (int): The id of the movement to add the links to.
+        links (list): Follower and leader id pairs of the new links.
+        session (Session): The session in which the links are added.
+    """
+    if not links:
+        return
+
+    created = datetime.now()
+    session.execute(insert(UserToUserLink), [
+        {
+            "movement_id": movement_id,
+            "follower_id": follower_id,
+            "leader_id": leader_id,
+            "created": created,
+            "destroyed": None,
+        }
+        for follower_id, leader_id in links
+    ])
+
+
+def destroy_links(movement_id: int, user_ids: list, session: Session) -> None:
+    """
+    Destroy the links of users in a movement with a single statement.
+
+    Args:
+        movement_id (int): The id of the movement to destroy the links in.
+        user_ids (list): The ids of the users whose links are destroyed, both
+            as follower and as leader.
+        session (Session): The session in which the links are destroyed.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+
+    session.execute(
+        update(UserToUserLink)
+        .where(
+            UserToUserLink.movement_id == movement_id,
+            UserToUserLink.destroyed.is_(None),
+            or_(
+                UserToUserLink.follower_id.in_(user_ids),
+                UserToUserLink.leader_id.in_(user_ids),
+            ),
+        )
+        .values(destroyed=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
@@ -1,36 +1,80 @@
 """Controller for the leaders."""
-from .helpers import session_scope, load_movement, load_user
+from .helpers import (
+    session_scope,
+    movement_scope,
+    load_movement,
+    load_user,
+    load_users,
+    insert_links,
+)
 from gridt.models import Signal, User, Movement
 from gridt.models import UserToUserLink
 
-from gridt.controllers import follower as Follower
 from gridt.controllers import subscription as Subscription
+from gridt.controllers import engine as Engine
+from gridt.controllers import rewiring as Rewiring
 from gridt.models import Subscription as SUB
 
-import random
-
 from sqlalchemy.orm.query import Query
-from sqlalchemy import not_, desc
+from sqlalchemy import not_, desc, func
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import Subquery
 
 
-def add_initial_followers(leader_id: int, movement_id: int) -> None:
+def add_initial_followers(
+    leader_id: int, movement_id: int, max_adoptions: int = None
+) -> None:
     """
     Add the initial followers for a leader upon joining a movement.
 
     Args:
         leader_id (int): The id of the leader who just joined the movement
         movement_id (int): The id of the movement itself
+        max_adoptions (int): The maximum amount of followers to adopt right
+            away, the others are queued for the rewiring controller. All
+            followers are adopted right away if None.
     """
-    with session_scope() as session:
+    with movement_scope(movement_id) as session:
         user = load_user(leader_id, session)
         movement = load_movement(movement_id, session)
+        _add_initial_followers(user, movement, session, max_adoptions)
+
+
+def _add_initial_followers(
+    user: User, movement: Movement, session: Session, max_adoptions=None
+) -> list:
+    """
+    Link the members that need a leader to a new leader.
+
+    Args:
+        user (User): The leader that just joined the movement.
+        movement (Movement): The movement the leader joined.
+        session (Session): The session in which the links are added.
+        max_adoptions (int): The maximum amount of followers to adopt right
+            away, the others are queued. All are adopted if None.
+
+    Returns:
+        list: The ids of the new followers of the leader.
+    """
+    graph = Engine.get_graph(movement.id, session)
+
+    # Give that new subscriber other followers to follow in the movement
+    follower_ids = graph.possible_followers(user.id)
+    if max_adoptions is not None and len(follower_ids) > max_adoptions:
+        # Adopt the followers with the fewest leaders right away.
+        adopted = graph.neediest_followers(user.id, max_adoptions)
+        Rewiring.enqueue_adoptions(
+            movement.id,
+            user.id,
+            list(set(follower_ids) - set(adopted)),
+            session,
+        )
+        follower_ids = adopted
 
-        # Give that new subscriber other followers to follow in the movement
-        new_followers = Follower.possible_followers(user, movement, session)
-        for new_follower in new_followers:
-            user_to_user_link = UserToUserLink(movement, new_follower, user)
-            session.add(user_to_user_link)
+    links = [(follower_id, user.id) for follower_id in follower_ids]
+    insert_links(movement.id, links, session)
+    Engine.record(session, movement.id, created=links)
+    return [follower_id for follower_id, _ in links]
 
 
 def remove_all_followers(leader_id: int, movement_id: int) -> None:
@@ -43,40 +87,39 @@ def remove_all_followers(leader_id: int, movement_id: int) -> None:
         leader_id (int): The id of the leader who just left the movement
         movement_id (int): The id of the movement itself
     """
-    with session_scope() as session:
-        movement = load_movement(movement_id, session)
-
-        # Remove all links to the removed subscriber
-        leader_links_to_destroy = session.query(UserToUserLink).filter(
-            UserToUserLink.movement_id == movement_id,
-            UserToUserLink.destroyed.is_(None),
-            UserToUserLink.leader_id == leader_id,
-        ).all()
+    with movement_scope(movement_id) as session:
+        _remove_all_followers(leader_id, movement_id, session)
 
-        for user_to_user_link in leader_links_to_destroy:
-            user_to_user_link.destroy()
-
-        session.commit()
 
-        # For each follower removed try to find a new leader
-        for user_to_user_link in leader_links_to_destroy:
-            poss_new_leaders = possible_leaders(
-                user_to_user_link.follower,
-                user_to_user_link.movement,
-                session
-            )
-
-            poss_new_leaders = [
-                leader for leader in poss_new_leaders if leader.id != leader_id
-            ]
-
-            # Add new UserToUserLinks for each former follower.
-            if poss_new_leaders:
-                new_leader = random.choice(poss_new_leaders)
-                new_user_to_user_link = UserToUserLink(
-                    movement, user_to_user_link.follower, new_leader
-                )
-                session.add(new_user_to_user_link)
+def _remove_all_followers(
+    leader_id: int, movement_id: int, session: Session
+) -> None:
+    """Remove all followers of a leader within a session."""
+    # Load the graph first, so the removed links are recorded in it
+    Engine.get_graph(movement_id, session)
+
+    # Remove all links to the removed subscriber
+    leader_links_to_destroy = session.query(UserToUserLink).filter(
+        UserToUserLink.movement_id == movement_id,
+        UserToUserLink.destroyed.is_(None),
+        UserToUserLink.leader_id == leader_id,
+    ).all()
+
+    for user_to_user_link in leader_links_to_destroy:
+        user_to_user_link.destroy()
+    Engine.record(session, movement_id, destroyed=[
+        (user_to_user_link.follower_id, leader_id)
+        for user_to_user_link in leader_links_to_destroy
+    ])
+
+    # Give every follower removed a new leader
+    Rewiring.reassign_leaders(
+        movement_id,
+        [link.follower_id for link in leader_links_to_destroy],
+        None,
+        session,
+        exclude=[leader_id],
+    )
 
 
 def get_last_signal(
@@ -91,6 +134,38 @@ def get_last_signal(
     )
 
 
+def _last_signals_subquery(
+    movement_ids: list, session: Session, *criteria
+) -> Subquery:
+    """
+    Rank the signals of every leader in the movements from new to old.
+
+    Joining on this subquery with ``rank == 1`` finds the last signal of many
+    leaders at once, instead of running :func:`get_last_signal` per leader.
+
+    Args:
+        movement_ids (list): The ids of the movements to rank signals in.
+        session (Session): The session to build the subquery with.
+        criteria: Extra filters on the signals, for example to only rank the
+            signals of a few leaders.
+
+    Returns:
+        Subquery: Columns signal_id, leader_id, movement_id and rank.
+    """
+    return session.query(
+        Signal.id.label("signal_id"),
+        Signal.leader_id,
+        Signal.movement_id,
+        func.row_number().over(
+            partition_by=(Signal.leader_id, Signal.movement_id),
+            order_by=(Signal.time_stamp.desc(), Signal.id.desc()),
+        ).label("rank"),
+    ).filter(
+        Signal.movement_id.in_(movement_ids),
+        *criteria
+    ).subquery()
+
+
 def send_signal(leader_id: int, movement_id: int, message: str = None):
     """Send signal as a leader in a movement, optionally with a message."""
     with session_scope() as session:
@@ -103,6 +178,9 @@ def send_signal(leader_id: int, movement_id: int, message: str = None):
 
         signal = Signal(leader, movement, message)
         session.add(signal)
+        Engine.record_signal(
+            session, movement_id, leader_id, signal.time_stamp
+        )
         session.commit()
 
 
@@ -131,3 +209,25 @@ def possible_leaders(
     # IDK why but if I don't add them to the session it crashes
     session.add_all(possible_leaders)
     return possible_leaders
+
+
+def sample_possible_leaders(
+    user: User, movement: Movement, k: int, session: Session
+) -> list:
+    """
+    Draw up to k random possible leaders for a user in a movement.
+
+    Unlike :func:`possible_leaders` only the drawn users are loaded, the
+    candidates are drawn from the graph of the movement in memory.
+
+    Args:
+        user (User): The user that needs leaders.
+        movement (Movement): The movement to find leaders in.
+        k (int): The amount of leaders to draw.
+        session (Session): The session to load the leaders with.
+
+    Returns:
+        list: At most k distinct users, drawn uniformly at random.
+    """
+    graph = Engine.get_graph(movement.id, session)
+    return load_users(graph.sample_leaders(user.id, k), session)
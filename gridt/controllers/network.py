@@ -1,22 +1,50 @@
 """Controller to retrieve network information."""
 
-from .helpers import session_scope
+import threading
+from array import array
+from datetime import datetime, timedelta
+from itertools import islice
+
+from .helpers import session_scope, load_user
+from gridt.util.npy import save_npz
+from gridt.util import graph as Graph
 
 from gridt.models import (
     UserToUserLink,
     Subscription,
-    User,
+    Signal,
 )
 
-from gridt.controllers.leader import get_last_signal
+from gridt.controllers.leader import _last_signals_subquery
+from gridt.controllers.follower import MAX_LEADERS
+from gridt.controllers import versions as Versions
 
+from sqlalchemy import and_, or_
+from sqlalchemy.orm.query import Query
 from sqlalchemy.orm.session import Session
+from sqlalchemy.sql.expression import Subquery
+
+# Move variable to config
+NETWORK_CHUNK_SIZE = 1000
+LAYOUT_ITERATIONS = 100
+LAYOUT_WARM_ITERATIONS = 10
+
+# Epoch used in network arrays for nodes that have never sent a signal.
+NO_SIGNAL = -1
+
+__snapshots = {}
+__snapshots_lock = threading.Lock()
+__layouts = {}
+__layouts_lock = threading.Lock()
 
 
 def get_network_data(movement_id: int) -> dict:
     """
     Get network data from a movement.
 
+    The network is retrieved with a fixed number of queries, independent of
+    the amount of subscribers in the movement.
+
     Args:
         movement_id (int): The id of the movement to retrieve the data for.
 
@@ -29,33 +57,766 @@ def get_network_data(movement_id: int) -> dict:
     return dict(edges=network_edges, nodes=network_nodes)
 
 
-def __get_edges(movement_id: int, session: Session) -> list:
-    """Get the edges from a movement network."""
+def get_network_changes(movement_id: int, since: datetime) -> dict:
+    """
+    Get the changes to the network of a movement since a moment in time.
+
+    Only rows that changed after since are read, so the cost depends on the
+    size of the changes rather than the size of the movement. A link or
+    subscription that was both ended and restarted after since shows up as
+    removed and as added, so removals should be applied before additions.
+
+    Args:
+        movement_id (int): The id of the movement to retrieve the changes of.
+        since (datetime): The moment after which changes are returned.
+
+    Returns:
+        dict: With the lists
+            - edges_added, edges_removed: Edges as in
+              :func:`get_network_data`.
+            - nodes_added: Nodes of users who subscribed.
+            - nodes_removed: Ids of users who unsubscribed.
+            - nodes_changed: Nodes of existing users who sent a signal.
+    """
+    with session_scope() as session:
+        edges_added = __edges_query([movement_id], session).filter(
+            UserToUserLink.created > since
+        )
+        edges_removed = session.query(
+            UserToUserLink.follower_id,
+            UserToUserLink.leader_id,
+        ).filter(
+            UserToUserLink.movement_id == movement_id,
+            UserToUserLink.destroyed > since,
+            UserToUserLink.created <= since,
+        ).order_by(UserToUserLink.id)
+
+        joined_ids = session.query(Subscription.user_id).filter(
+            Subscription.movement_id == movement_id,
+            Subscription.time_added > since,
+        )
+        nodes_added = __nodes_query(
+            [movement_id],
+            session,
+            last_signals=_last_signals_subquery(
+                [movement_id], session, Signal.leader_id.in_(joined_ids)
+            ),
+        ).filter(Subscription.time_added > since)
+
+        nodes_removed = session.query(Subscription.user_id).filter(
+            Subscription.movement_id == movement_id,
+            Subscription.time_removed > since,
+            Subscription.time_added <= since,
+        ).order_by(Subscription.user_id)
+
+        # A leader whose last signal is newer than since has sent a signal
+        # after since, so ranking only the new signals is enough.
+        nodes_changed = __nodes_query(
+            [movement_id],
+            session,
+            last_signals=_last_signals_subquery(
+                [movement_id], session, Signal.time_stamp > since
+            ),
+            isouter=False,
+        ).filter(Subscription.time_added <= since)
+
+        return dict(
+            edges_added=[__link_to_edge(*row) for row in edges_added],
+            edges_removed=[__link_to_edge(*row) for row in edges_removed],
+            nodes_added=[__user_to_node(*row) for row in nodes_added],
+            nodes_removed=[user_id for user_id, in nodes_removed],
+            nodes_changed=[__user_to_node(*row) for row in nodes_changed],
+        )
+
+
+def get_network_data_at(movement_id: int, at: datetime) -> dict:
+    """
+    Reconstruct the network of a movement as it was at a moment in time.
+
+    Args:
+        movement_id (int): The id of the movement to retrieve the data for.
+        at (datetime): The moment to reconstruct the network at.
+
+    Returns:
+        dict: NetworkX compatible lists of edges and nodes as tuples, like
+        :func:`get_network_data`.
+    """
+    with session_scope() as session:
+        edges = __edges_query([movement_id], session, at=at)
+        nodes = __nodes_query([movement_id], session, at=at)
+        return dict(
+            edges=[__link_to_edge(*row) for row in edges],
+            nodes=[__user_to_node(*row) for row in nodes],
+        )
+
+
+def iter_network_data_between(
+    movement_id: int, start: datetime, end: datetime, step: timedelta
+):
+    """
+    Reconstruct the network of a movement at fixed steps in a time range.
+
+    The network is reconstructed once at start. After that the changes in
+    the range are read once and replayed in memory, so the amount of queries
+    does not depend on the amount of steps.
+
+    Args:
+        movement_id (int): The id of the movement to retrieve the data for.
+        start (datetime): The first moment to reconstruct the network at.
+        end (datetime): No moments after end are reconstructed.
+        step (timedelta): The time between two reconstructed moments.
+
+    Yields:
+        tuple: The moment and the network data at that moment, like
+        :func:`get_network_data_at`.
+    """
+    if step <= timedelta(0):
+        raise ValueError("The step must be a positive amount of time.")
+
+    with session_scope() as session:
+        links = {
+            link_id: (follower_id, leader_id)
+            for link_id, follower_id, leader_id in session.query(
+                UserToUserLink.id,
+                UserToUserLink.follower_id,
+                UserToUserLink.leader_id,
+            ).filter(
+                UserToUserLink.movement_id == movement_id,
+                UserToUserLink.created <= start,
+                or_(
+                    UserToUserLink.destroyed.is_(None),
+                    UserToUserLink.destroyed > start,
+                ),
+            )
+        }
+        subscribers = set(
+            user_id for user_id, in session.query(
+                Subscription.user_id
+            ).filter(
+                Subscription.movement_id == movement_id,
+                Subscription.time_added <= start,
+                or_(
+                    Subscription.time_removed.is_(None),
+                    Subscription.time_removed > start,
+                ),
+            )
+        )
+        # Users who join later may have signaled before start as well.
+        last_signals = _last_signals_subquery(
+            [movement_id], session, Signal.time_stamp <= start
+        )
+        node_data = {
+            signal.leader_id: signal.to_json()
+            for signal in session.query(Signal).join(
+                last_signals, and_(
+                    last_signals.c.signal_id == Signal.id,
+                    last_signals.c.rank == 1,
+                )
+            )
+        }
+
+        events = __events_between(movement_id, start, end, session)
+
+    def apply(event):
+        kind, _, key, value = event
+        if kind == "link_created":
+            links[key] = value
+        elif kind == "link_destroyed":
+            links.pop(key, None)
+        elif kind == "subscribed":
+            subscribers.add(key)
+        elif kind == "unsubscribed":
+            subscribers.discard(key)
+        elif kind == "signal":
+            node_data[key] = value
+
+    events = iter(events)
+    event = next(events, None)
+    moment = start
+    while moment <= end:
+        while event and event[1] <= moment:
+            apply(event)
+            event = next(events, None)
+
+        yield moment, dict(
+            edges=[links[link_id] for link_id in sorted(links)],
+            nodes=[
+                (user_id, node_data.get(user_id))
+                for user_id in sorted(subscribers)
+            ],
+        )
+        moment += step
+
+
+def __events_between(
+    movement_id: int, start: datetime, end: datetime, session: Session
+) -> list:
+    """
+    Read the changes to a movement network in a time range.
+
+    Returns:
+        list: Events as (kind, time, key, value) tuples sorted by time.
+    """
+    def between(column):
+        return and_(column > start, column <= end)
+
+    events = []
     links = session.query(UserToUserLink).filter(
         UserToUserLink.movement_id == movement_id,
-        UserToUserLink.destroyed.is_(None)
-    ).all()
+        or_(
+            between(UserToUserLink.created),
+            between(UserToUserLink.destroyed),
+        ),
+    )
+    for link in links:
+        edge = (link.follower_id, link.leader_id)
+        if start < link.created <= end:
+            events.append(("link_created", link.created, link.id, edge))
+        if link.destroyed and start < link.destroyed <= end:
+            events.append(("link_destroyed", link.destroyed, link.id, edge))
+
+    subscriptions = session.query(Subscription).filter(
+        Subscription.movement_id == movement_id,
+        or_(
+            between(Subscription.time_added),
+            between(Subscription.time_removed),
+        ),
+    )
+    for sub in subscriptions:
+        if start < sub.time_added <= end:
+            events.append(("subscribed", sub.time_added, sub.user_id, None))
+        if sub.time_removed and start < sub.time_removed <= end:
+            events.append(
+                ("unsubscribed", sub.time_removed, sub.user_id, None)
+            )
+
+    signals = session.query(Signal).filter(
+        Signal.movement_id == movement_id,
+        between(Signal.time_stamp),
+    ).order_by(Signal.time_stamp, Signal.id)
+    for signal in signals:
+        events.append(
+            ("signal", signal.time_stamp, signal.leader_id, signal.to_json())
+        )
+
+    return sorted(events, key=lambda event: event[1])
+
+
+def get_ego_network(user_id: int, depth: int = 1) -> dict:
+    """
+    Get the neighbourhood of a user in every movement they are subscribed to.
+
+    The neighbourhood is found with a breadth first search over the links of
+    all movements at once. Every step is a single query, so the amount of
+    queries depends on the depth and not on the amount of movements.
+
+    Args:
+        user_id (int): The id of the user in the center of the network.
+        depth (int): The maximum amount of links between the user and the
+            users in the network. 1 gives the leaders and followers of the
+            user, 2 adds their leaders and followers as well.
+
+    Returns:
+        dict: Map of movement id to the NetworkX compatible edges and nodes
+        of the neighbourhood in that movement, like :func:`get_network_data`.
+        Edges between any two users in the neighbourhood are included.
+    """
+    with session_scope() as session:
+        load_user(user_id, session)
+
+        movement_ids = [
+            movement_id for movement_id, in session.query(
+                Subscription.movement_id
+            ).filter(
+                Subscription.user_id == user_id,
+                Subscription.time_removed.is_(None),
+            )
+        ]
+        visited = {movement_id: {user_id} for movement_id in movement_ids}
+        frontier = {movement_id: {user_id} for movement_id in movement_ids}
+        links = {movement_id: {} for movement_id in movement_ids}
+
+        # The last step only collects the links between visited users.
+        for step in range(depth + 1):
+            frontier_ids = set().union(*frontier.values())
+            if not frontier_ids:
+                break
+
+            incident = session.query(
+                UserToUserLink.id,
+                UserToUserLink.movement_id,
+                UserToUserLink.follower_id,
+                UserToUserLink.leader_id,
+            ).filter(
+                UserToUserLink.movement_id.in_(list(frontier)),
+                UserToUserLink.destroyed.is_(None),
+                or_(
+                    UserToUserLink.follower_id.in_(frontier_ids),
+                    UserToUserLink.leader_id.in_(frontier_ids),
+                ),
+            )
+
+            next_frontier = {movement_id: set() for movement_id in frontier}
+            for link_id, movement_id, follower_id, leader_id in incident:
+                current = frontier[movement_id]
+                if follower_id not in current and leader_id not in current:
+                    continue
+
+                for neighbour_id in (follower_id, leader_id):
+                    if neighbour_id not in visited[movement_id]:
+                        if step == depth:
+                            break
+                        next_frontier[movement_id].add(neighbour_id)
+                else:
+                    links[movement_id][link_id] = (follower_id, leader_id)
+
+            for movement_id, new_ids in next_frontier.items():
+                visited[movement_id] |= new_ids
+            frontier = {
+                movement_id: new_ids
+                for movement_id, new_ids in next_frontier.items() if new_ids
+            }
+
+        last_signals = _last_signals_subquery(
+            movement_ids,
+            session,
+            Signal.leader_id.in_(set().union(*visited.values())),
+        )
+        node_data = {
+            (signal.leader_id, signal.movement_id): signal.to_json()
+            for signal in session.query(Signal).join(
+                last_signals, and_(
+                    last_signals.c.signal_id == Signal.id,
+                    last_signals.c.rank == 1,
+                )
+            )
+        }
 
-    return [(link.follower.id, link.leader.id) for link in links]
+    return {
+        movement_id: dict(
+            edges=[
+                links[movement_id][link_id]
+                for link_id in sorted(links[movement_id])
+            ],
+            nodes=[
+                (node_id, node_data.get((node_id, movement_id)))
+                for node_id in sorted(visited[movement_id])
+            ],
+        )
+        for movement_id in movement_ids
+    }
+
+
+def get_network_data_many(movement_ids: list) -> dict:
+    """
+    Get the network data of many movements at once.
+
+    The networks of all movements are retrieved together in one session with
+    the same fixed number of queries as :func:`get_network_data`.
+
+    Args:
+        movement_ids (list): The ids of the movements to retrieve data for.
+
+    Returns:
+        dict: Map of movement id to the data as returned by
+        :func:`get_network_data`.
+    """
+    movement_ids = list(movement_ids)
+    networks = {
+        movement_id: dict(edges=[], nodes=[]) for movement_id in movement_ids
+    }
+    if not movement_ids:
+        return networks
+
+    with session_scope() as session:
+        edges = __edges_query(movement_ids, session).add_columns(
+            UserToUserLink.movement_id
+        )
+        for follower_id, leader_id, movement_id in edges:
+            networks[movement_id]["edges"].append(
+                __link_to_edge(follower_id, leader_id)
+            )
+
+        nodes = __nodes_query(movement_ids, session).add_columns(
+            Subscription.movement_id
+        )
+        for user_id, signal, movement_id in nodes:
+            networks[movement_id]["nodes"].append(
+                __user_to_node(user_id, signal)
+            )
+
+    return networks
+
+
+def get_network_version(movement_id: int) -> str:
+    """
+    Get the version of the network of a movement with two indexed reads.
+
+    The version is the graph version of the movement with the id of its
+    last signal. It changes whenever a subscription, link or signal in the
+    movement is written, by any process. This makes it suitable as an ETag.
+
+    Args:
+        movement_id (int): The id of the movement.
+
+    Returns:
+        str: The current version of the network.
+
+    Raises:
+        GridtExceptions.MovementNotFoundError: If the movement does not
+            exist.
+    """
+    return Versions.get_version(movement_id)
+
+
+def get_network_snapshot(movement_id: int) -> tuple:
+    """
+    Get the network data of a movement, served from memory when unchanged.
+
+    The data is only retrieved from the database when the version of the
+    network in the database has changed since it was last retrieved. The
+    returned data is shared between callers and must not be modified.
+
+    Args:
+        movement_id (int): The id of the movement to retrieve the data for.
+
+    Returns:
+        tuple: The version and the data as returned by
+        :func:`get_network_data`.
+    """
+    version = Versions.get_version(movement_id)
+    with __snapshots_lock:
+        snapshot = __snapshots.get(movement_id)
+    if snapshot and snapshot[0] == version:
+        return snapshot
+
+    # The version is read before the data, so a change while reading only
+    # makes the next call fetch the data again.
+    snapshot = (version, get_network_data(movement_id))
+    with __snapshots_lock:
+        __snapshots[movement_id] = snapshot
+    return snapshot
+
+
+def get_network_layout(movement_id: int) -> tuple:
+    """
+    Get coordinates to draw the network of a movement with.
+
+    The layout is computed on the server with :func:`spectral_layout`, and
+    cached until the graph version of the network changes. Signals do not
+    change the graph version, so they keep the layout. A changed network is
+    laid out starting from the previous coordinates, which needs far fewer
+    iterations when only a few links have changed.
+
+    Args:
+        movement_id (int): The id of the movement to lay out.
+
+    Returns:
+        tuple: The graph version of the network and a map of node id to an
+        (x, y) tuple in the range [-1, 1]. The map must not be modified.
+    """
+    version = Versions.get_graph_version(movement_id)
+    with __layouts_lock:
+        layout = __layouts.get(movement_id)
+    if layout and layout[0] == version:
+        return layout
+
+    arrays = get_network_arrays(movement_id)
+    node_ids = arrays["node_ids"]
+    if layout:
+        previous = layout[1]
+        initial = tuple(
+            [previous.get(node_id, (0.0, 0.0))[axis] for node_id in node_ids]
+            for axis in (0, 1)
+        )
+        iterations = LAYOUT_WARM_ITERATIONS
+    else:
+        initial = None
+        iterations = LAYOUT_ITERATIONS
+
+    xs, ys = Graph.spectral_layout(
+        arrays["indptr"], arrays["indices"], initial, iterations
+    )
+    layout = (version, {
+        node_id: (x, y) for node_id, x, y in zip(node_ids, xs, ys)
+    })
+    with __layouts_lock:
+        __layouts[movement_id] = layout
+    return layout
+
+
+def get_network_data_if_modified(movement_id: int, version: str) -> tuple:
+    """
+    Get the network snapshot of a movement unless the client has it already.
+
+    Only the version is read from the database when the client is up to
+    date.
+
+    Args:
+        movement_id (int): The id of the movement to retrieve the data for.
+        version (str): The version the client has, for example the ETag.
+
+    Returns:
+        tuple: The version and data like :func:`get_network_snapshot`, or
+        None when the network has not been modified since version.
+
+    Raises:
+        GridtExceptions.MovementNotFoundError: If the movement does not
+            exist.
+    """
+    if version == Versions.get_version(movement_id):
+        return None
+    return get_network_snapshot(movement_id)
+
+
+def iter_network_data(
+    movement_id: int, chunk_size: int = NETWORK_CHUNK_SIZE
+):
+    """
+    Stream network data from a movement in batches.
+
+    Rows are fetched with server side cursors, so only one batch of the
+    network is held in memory at a time. The edges are yielded before the
+    nodes.
+
+    Args:
+        movement_id (int): The id of the movement to retrieve the data for.
+        chunk_size (int): The maximum amount of edges or nodes per batch.
+
+    Yields:
+        tuple: Either ("edges", list) or ("nodes", list) where the list holds
+        the same tuples as :func:`get_network_data` returns.
+    """
+    with session_scope() as session:
+        edges = __edges_query([movement_id], session).yield_per(chunk_size)
+        for batch in __batched(edges, chunk_size):
+            yield ("edges", [__link_to_edge(*row) for row in batch])
+
+        nodes = __nodes_query([movement_id], session).yield_per(chunk_size)
+        for batch in __batched(nodes, chunk_size):
+            yield ("nodes", [__user_to_node(*row) for row in batch])
+
+
+def get_network_arrays(movement_id: int) -> dict:
+    """
+    Get the network of a movement as contiguous typed arrays.
+
+    All arrays hold signed 64 bit integers. The nodes are sorted by id and
+    the edges by follower and leader id. Links to users who are not
+    subscribed to the movement are left out.
+
+    Args:
+        movement_id (int): The id of the movement to retrieve the data for.
+
+    Returns:
+        dict: With the arrays
+            - follower_ids, leader_ids: The edges as two id columns.
+            - node_ids: The ids of the subscribers.
+            - last_signal: Epoch of the last signal of each node, or
+              NO_SIGNAL if the node never sent one.
+            - indptr, indices: The adjacency in compressed sparse row form.
+              Row i lists the positions in node_ids of the leaders of the
+              i-th node.
+    """
+    node_ids = array("q")
+    last_signal = array("q")
+    follower_ids = array("q")
+    leader_ids = array("q")
+
+    with session_scope() as session:
+        nodes = __nodes_query([movement_id], session, Signal.time_stamp)
+        for user_id, time_stamp in nodes:
+            node_ids.append(user_id)
+            last_signal.append(
+                int(time_stamp.timestamp()) if time_stamp else NO_SIGNAL
+            )
+
+        position = {node_id: i for i, node_id in enumerate(node_ids)}
+        edges = __edges_query([movement_id], session).order_by(None).order_by(
+            UserToUserLink.follower_id, UserToUserLink.leader_id
+        )
+        for follower_id, leader_id in edges:
+            if follower_id in position and leader_id in position:
+                follower_ids.append(follower_id)
+                leader_ids.append(leader_id)
+
+    indptr = array("q", bytes(8 * (len(node_ids) + 1)))
+    for follower_id in follower_ids:
+        indptr[position[follower_id] + 1] += 1
+    for i in range(len(node_ids)):
+        indptr[i + 1] += indptr[i]
+    indices = array("q", (position[leader_id] for leader_id in leader_ids))
+
+    return dict(
+        follower_ids=follower_ids,
+        leader_ids=leader_ids,
+        node_ids=node_ids,
+        last_signal=last_signal,
+        indptr=indptr,
+        indices=indices,
+    )
+
+
+def get_network_statistics(movement_id: int) -> dict:
+    """
+    Compute structural statistics of the network of a movement.
+
+    The statistics are computed in a single pass over the arrays of
+    :func:`get_network_arrays`.
+
+    Args:
+        movement_id (int): The id of the movement to compute statistics for.
+
+    Returns:
+        dict: With the statistics
+            - nodes, edges: The amount of nodes and edges.
+            - in_degrees, out_degrees: Map of degree to the amount of nodes
+              with that many followers or leaders respectively.
+            - underled_followers: The amount of nodes with fewer than
+              MAX_LEADERS leaders.
+            - followerless_leaders: The amount of nodes without followers.
+            - components: The amount of weakly connected components.
+            - reciprocity: The fraction of edges whose reverse exists too.
+    """
+    arrays = get_network_arrays(movement_id)
+    indptr, indices = arrays["indptr"], arrays["indices"]
+
+    out_degrees, in_degrees = Graph.degrees(indptr, indices)
+    components = Graph.weakly_connected_components(indptr, indices)
+    reciprocal = Graph.count_reciprocal_edges(indptr, indices)
+
+    return dict(
+        nodes=len(arrays["node_ids"]),
+        edges=len(indices),
+        in_degrees=Graph.histogram(in_degrees),
+        out_degrees=Graph.histogram(out_degrees),
+        underled_followers=sum(
+            1 for degree in out_degrees if degree < MAX_LEADERS
+        ),
+        followerless_leaders=sum(1 for degree in in_degrees if degree == 0),
+        components=len(set(components)),
+        reciprocity=reciprocal / len(indices) if indices else 0.0,
+    )
+
+
+def save_network_arrays(movement_id: int, file) -> None:
+    """
+    Save the arrays of :func:`get_network_arrays` to an .npz file.
+
+    The file is uncompressed, so ``numpy.load`` can read it without copying
+    the data through a decompressor.
+
+    Args:
+        movement_id (int): The id of the movement to save the network of.
+        file (str or file): Path or binary file object to write to.
+    """
+    save_npz(file, get_network_arrays(movement_id))
+
+
+def __batched(rows, size: int):
+    """Group an iterable of rows into lists of at most size rows."""
+    rows = iter(rows)
+    batch = list(islice(rows, size))
+    while batch:
+        yield batch
+        batch = list(islice(rows, size))
+
+
+def __get_edges(movement_id: int, session: Session) -> list:
+    """Get the edges from a movement network."""
+    return [
+        __link_to_edge(*row)
+        for row in __edges_query([movement_id], session)
+    ]
 
 
 def __get_nodes(movement_id: int, session: Session) -> list:
     """Get the nodes from a movement network."""
-    users = session.query(User).join(Subscription).filter(
-        Subscription.movement_id == movement_id,
-        Subscription.time_removed.is_(None)
-    ).all()
+    return [
+        __user_to_node(*row)
+        for row in __nodes_query([movement_id], session)
+    ]
+
+
+def __edges_query(
+    movement_ids: list, session: Session, at: datetime = None
+) -> Query:
+    """Query the follower and leader ids of the links active now or at."""
+    if at is None:
+        active = UserToUserLink.destroyed.is_(None)
+    else:
+        active = and_(
+            UserToUserLink.created <= at,
+            or_(
+                UserToUserLink.destroyed.is_(None),
+                UserToUserLink.destroyed > at,
+            ),
+        )
+
+    return session.query(
+        UserToUserLink.follower_id,
+        UserToUserLink.leader_id,
+    ).filter(
+        UserToUserLink.movement_id.in_(movement_ids),
+        active
+    ).order_by(UserToUserLink.id)
+
+
+def __nodes_query(
+    movement_ids: list,
+    session: Session,
+    signal=Signal,
+    last_signals: Subquery = None,
+    isouter: bool = True,
+    at: datetime = None,
+) -> Query:
+    """
+    Query the subscribed user ids together with their last signal.
+
+    When isouter is False only the users with a signal in last_signals are
+    returned. When at is given the subscribers and last signals at that
+    moment are returned.
+    """
+    if at is None:
+        active = Subscription.time_removed.is_(None)
+        signal_criteria = ()
+    else:
+        active = and_(
+            Subscription.time_added <= at,
+            or_(
+                Subscription.time_removed.is_(None),
+                Subscription.time_removed > at,
+            ),
+        )
+        signal_criteria = (Signal.time_stamp <= at,)
+
+    if last_signals is None:
+        last_signals = _last_signals_subquery(
+            movement_ids, session, *signal_criteria
+        )
+
+    return session.query(Subscription.user_id, signal).join(
+        last_signals, and_(
+            last_signals.c.leader_id == Subscription.user_id,
+            last_signals.c.movement_id == Subscription.movement_id,
+            last_signals.c.rank == 1,
+        ),
+        isouter=isouter,
+    ).join(
+        Signal, Signal.id == last_signals.c.signal_id, isouter=isouter
+    ).filter(
+        Subscription.movement_id.in_(movement_ids),
+        active
+    ).order_by(Subscription.user_id)
 
-    return [__user_to_node(user, movement_id, session) for user in users]
 
+def __link_to_edge(follower_id: int, leader_id: int) -> tuple:
+    """Convert link columns to edge data NetworkX can understand."""
+    return (follower_id, leader_id)
 
-def __user_to_node(
-    user: User, movement_id: int, session: Session
-) -> tuple:
-    """Convert User to node data NetworkX can understand."""
-    user_id = user.id
-    signal = get_last_signal(user_id, movement_id, session)
 
+def __user_to_node(user_id: int, signal: Signal) -> tuple:
+    """Convert a user and its last signal to node data NetworkX understands."""
     if not signal:
         return (user_id, None)
 
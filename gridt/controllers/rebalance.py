@@ -0,0 +1,275 @@
+"""Controller for rebalancing the networks of movements offline."""
+import heapq
+from array import array
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.orm.session import Session
+
+import gridt.util.graph as Graph
+from gridt.models import Subscription, UserToUserLink
+from gridt.controllers import engine as Engine
+from gridt.controllers.follower import MAX_LEADERS
+from .helpers import movement_scope, session_scope, insert_links
+
+REBALANCE_MAX_CHANGES = 1000
+
+
+def rebalance(
+    movement_id: int,
+    max_changes: int = REBALANCE_MAX_CHANGES,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Rebalance the network of a movement.
+
+    First members with fewer than MAX_LEADERS leaders get links to the
+    members with the fewest followers. Then links are moved from the members
+    with the most followers to the members with the fewest, until their
+    amounts differ by at most one. Adding a link is one change, moving a
+    link is two. All changes are applied in one transaction, which holds
+    the lock of the movement. A dry run only reads the network, so it does
+    not take the lock.
+
+    Args:
+        movement_id (int): The id of the movement to rebalance.
+        max_changes (int): The maximum amount of links to add and destroy.
+        dry_run (bool): Only plan the changes, without applying them.
+
+    Returns:
+        dict: With the report
+            - dry_run: Whether the changes were left unapplied.
+            - edges_added: Follower and leader id pairs of the new links.
+            - edges_removed: Follower and leader id pairs of destroyed links.
+            - before, after: Balance metrics of the network, see
+              :func:`balance_metrics`.
+    """
+    scope = session_scope() if dry_run else movement_scope(movement_id)
+    with scope as session:
+        if not dry_run:
+            # Load the graph first, so the changes are recorded in it
+            Engine.get_graph(movement_id, session)
+        network = _load_network(movement_id, session)
+        before = balance_metrics(network)
+        added, removed = _plan(network, max_changes)
+        after = balance_metrics(network)
+
+        node_ids = network["node_ids"]
+        edges_added = [
+            (node_ids[follower], node_ids[leader])
+            for follower, leader in added
+        ]
+        edges_removed = [
+            (node_ids[follower], node_ids[leader])
+            for follower, leader in removed
+        ]
+
+        if not dry_run:
+            _destroy_link_ids(
+                [network["link_ids"][edge] for edge in removed], session
+            )
+            insert_links(movement_id, edges_added, session)
+            Engine.record(
+                session,
+                movement_id,
+                created=edges_added,
+                destroyed=edges_removed,
+            )
+
+        return dict(
+            dry_run=dry_run,
+            edges_added=edges_added,
+            edges_removed=edges_removed,
+            before=before,
+            after=after,
+        )
+
+
+def balance_metrics(network: dict) -> dict:
+    """
+    Compute how balanced a network loaded for rebalancing is.
+
+    Args:
+        network (dict): The network as loaded by the rebalancer.
+
+    Returns:
+        dict: With the metrics
+            - nodes, edges: The amount of members and links between them.
+            - underled_followers: The amount of members with fewer than
+              MAX_LEADERS leaders.
+            - min_followers, max_followers: The fewest and most followers of
+              a member.
+            - follower_stddev: The standard deviation of the follower counts.
+            - in_degrees: Map of follower count to the amount of members.
+    """
+    in_degrees = network["in_degrees"]
+    out_degrees = network["out_degrees"]
+    nodes = len(in_degrees)
+    edges = sum(in_degrees)
+    mean = edges / nodes if nodes else 0.0
+    variance = (
+        sum((degree - mean) ** 2 for degree in in_degrees) / nodes
+        if nodes else 0.0
+    )
+    return dict(
+        nodes=nodes,
+        edges=edges,
+        underled_followers=sum(
+            1 for degree in out_degrees if degree < MAX_LEADERS
+        ),
+        min_followers=min(in_degrees, default=0),
+        max_followers=max(in_degrees, default=0),
+        follower_stddev=variance ** 0.5,
+        in_degrees=Graph.histogram(in_degrees),
+    )
+
+
+def _load_network(movement_id: int, session: Session) -> dict:
+    """Load the members and the links between them into arrays."""
+    node_ids = array("q", sorted(
+        user_id for user_id, in session.query(Subscription.user_id).filter(
+            Subscription.movement_id == movement_id,
+            Subscription.time_removed.is_(None),
+        )
+    ))
+    index = {user_id: i for i, user_id in enumerate(node_ids)}
+
+    leaders = [set() for _ in node_ids]
+    followers = [set() for _ in node_ids]
+    link_ids = {}
+    for link_id, follower_id, leader_id in session.query(
+        UserToUserLink.id, UserToUserLink.follower_id, UserToUserLink.leader_id
+    ).filter(
+        UserToUserLink.movement_id == movement_id,
+        UserToUserLink.destroyed.is_(None),
+    ):
+        if follower_id not in index or leader_id not in index:
+            continue
+        follower, leader = index[follower_id], index[leader_id]
+        leaders[follower].add(leader)
+        followers[leader].add(follower)
+        link_ids[(follower, leader)] = link_id
+
+    return dict(
+        node_ids=node_ids,
+        leaders=leaders,
+        followers=followers,
+        link_ids=link_ids,
+        in_degrees=array("q", map(len, followers)),
+        out_degrees=array("q", map(len, leaders)),
+    )
+
+
+def _plan(network: dict, max_changes: int) -> tuple:
+    """
+    Plan the changes that balance a network, applying them to the arrays.
+
+    Returns:
+        tuple: Lists of the added and removed (follower, leader) indexes.
+    """
+    leaders = network["leaders"]
+    followers = network["followers"]
+    in_degrees = network["in_degrees"]
+    out_degrees = network["out_degrees"]
+    nodes = len(in_degrees)
+    target = min(MAX_LEADERS, nodes - 1)
+    # Dicts keep the order of the changes, a change that undoes an earlier
+    # one removes both.
+    added, removed = {}, {}
+
+    def link(follower, leader):
+        if (follower, leader) in removed:
+            del removed[(follower, leader)]
+        else:
+            added[(follower, leader)] = None
+        leaders[follower].add(leader)
+        followers[leader].add(follower)
+        in_degrees[leader] += 1
+        out_degrees[follower] += 1
+        heapq.heappush(lightest, (in_degrees[leader], leader))
+        heapq.heappush(heaviest, (-in_degrees[leader], leader))
+
+    def unlink(follower, leader):
+        if (follower, leader) in added:
+            del added[(follower, leader)]
+        else:
+            removed[(follower, leader)] = None
+        leaders[follower].discard(leader)
+        followers[leader].discard(follower)
+        in_degrees[leader] -= 1
+        out_degrees[follower] -= 1
+        heapq.heappush(lightest, (in_degrees[leader], leader))
+        heapq.heappush(heaviest, (-in_degrees[leader], leader))
+
+    def changes():
+        return len(added) + len(removed)
+
+    # Heaps of (followers, node) and (-followers, node), entries are pushed
+    # on every change and outdated ones are skipped.
+    lightest = [(degree, node) for node, degree in enumerate(in_degrees)]
+    heaviest = [(-degree, node) for node, degree in enumerate(in_degrees)]
+    heapq.heapify(lightest)
+    heapq.heapify(heaviest)
+
+    # Fill the members that have too few leaders, the neediest first.
+    for follower in sorted(range(nodes), key=lambda node: out_degrees[node]):
+        while out_degrees[follower] < target and changes() < max_changes:
+            skipped = []
+            leader = None
+            while lightest:
+                degree, node = heapq.heappop(lightest)
+                if degree != in_degrees[node]:
+                    continue
+                skipped.append((degree, node))
+                if node != follower and node not in leaders[follower]:
+                    leader = node
+                    break
+            for entry in skipped:
+                heapq.heappush(lightest, entry)
+            if leader is None:
+                break
+            link(follower, leader)
+
+    # Move links from the heaviest leaders to the lightest ones.
+    while heaviest and changes() + 2 <= max_changes:
+        degree, heavy = heapq.heappop(heaviest)
+        if -degree != in_degrees[heavy]:
+            continue
+
+        move = None
+        skipped = []
+        while lightest and move is None:
+            degree, light = heapq.heappop(lightest)
+            if degree != in_degrees[light]:
+                continue
+            skipped.append((degree, light))
+            if in_degrees[heavy] - degree <= 1:
+                break
+            for follower in followers[heavy]:
+                if follower != light and light not in leaders[follower]:
+                    move = (follower, light)
+                    break
+        for entry in skipped:
+            heapq.heappush(lightest, entry)
+        if move is None:
+            # The leader stays off the heap until its followers change.
+            continue
+
+        follower, light = move
+        unlink(follower, heavy)
+        link(follower, light)
+
+    return list(added), list(removed)
+
+
+def _destroy_link_ids(link_ids: list, session: Session) -> None:
+    """Destroy links by their ids with a single statement."""
+    if not link_ids:
+        return
+
+    session.execute(
+        update(UserToUserLink)
+        .where(UserToUserLink.id.in_(link_ids))
+        .values(destroyed=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
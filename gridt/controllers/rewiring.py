@@ -0,0 +1,582 @@
+"""Controller for rewiring the networks of movements in the background."""
+import heapq
+import random
+from collections import Counter, defaultdict
+from contextlib import closing
+from itertools import islice
+
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy.orm.session import Session
+
+from gridt.controllers import engine as Engine
+from gridt.controllers import follower as Follower
+from gridt.models import QueuedUser
+from .helpers import (
+    session_scope,
+    movement_scope,
+    insert_links,
+    destroy_links,
+)
+
+ADOPTION_BATCH_SIZE = 500
+REWIRING_BATCH_SIZE = 500
+
+# The queues and roles of the queued users, see :class:`QueuedUser`.
+ADOPTION = "adoption"
+REWIRING = "rewiring"
+FOLLOWER = "follower"
+LEADER = "leader"
+
+
+def enqueue_adoptions(
+    movement_id: int, leader_id: int, follower_ids: list, session: Session
+) -> None:
+    """
+    Queue followers to be adopted by new leaders in a session.
+
+    Args:
+        movement_id (int): The id of the movement the leader joined.
+        leader_id (int): The id of the new leader.
+        follower_ids (list): The ids of the followers the leader could adopt.
+        session (Session): The session in which the leader joined.
+    """
+    __enqueue(movement_id, ADOPTION, LEADER, [leader_id], session)
+    __enqueue(movement_id, ADOPTION, FOLLOWER, follower_ids, session)
+
+
+def get_adoption_backlog(session: Session = None) -> int:
+    """
+    Get the amount of followers waiting to be adopted.
+
+    Args:
+        session (Session): The session to count with, a new one if None.
+    """
+    return __count(ADOPTION, [FOLLOWER], session)
+
+
+def process_adoptions(
+    batch_size: int = ADOPTION_BATCH_SIZE, movement_id: int = None
+) -> int:
+    """
+    Let the new leaders adopt a batch of the queued followers.
+
+    Every follower is adopted by the new leader of its movement that adopted
+    the fewest followers so far, so the followers are spread over all
+    leaders that joined. Followers that found enough leaders in the mean
+    time are skipped. The links of a movement are inserted in one statement.
+
+    Args:
+        batch_size (int): The maximum amount of followers to process.
+        movement_id (int): Only process the followers of this movement.
+
+    Returns:
+        int: The amount of links that were created.
+    """
+    created = 0
+    while batch_size > 0:
+        next_id = __next_movement(ADOPTION, movement_id)
+        if next_id is None:
+            break
+        with movement_scope(next_id) as session:
+            follower_ids, leaders = __pop_adoptions(
+                next_id, batch_size, session
+            )
+            if not follower_ids:
+                break
+            batch_size -= len(follower_ids)
+            created += __adopt(next_id, follower_ids, leaders, session)
+    return created
+
+
+def _process_adoptions(
+    movement_id: int, session: Session, batch_size: int = ADOPTION_BATCH_SIZE
+) -> int:
+    """Process a batch of the adoptions of a movement within a session."""
+    follower_ids, leaders = __pop_adoptions(movement_id, batch_size, session)
+    if not follower_ids:
+        return 0
+    return __adopt(movement_id, follower_ids, leaders, session)
+
+
+def __pop_adoptions(
+    movement_id: int, batch_size: int, session: Session
+) -> tuple:
+    """Take up to batch_size queued followers and the new leaders."""
+    follower_ids = __pop(movement_id, ADOPTION, FOLLOWER, batch_size, session)
+    leaders = dict(session.query(
+        QueuedUser.user_id, QueuedUser.adopted
+    ).filter(
+        QueuedUser.movement_id == movement_id,
+        QueuedUser.queue == ADOPTION,
+        QueuedUser.role == LEADER,
+    ).all())
+
+    # The new leaders are done once no follower is left to adopt.
+    remaining = __count(ADOPTION, [FOLLOWER], session, [movement_id])
+    if follower_ids and not remaining:
+        session.query(QueuedUser).filter(
+            QueuedUser.movement_id == movement_id,
+            QueuedUser.queue == ADOPTION,
+        ).delete(synchronize_session=False)
+    return follower_ids, leaders
+
+
+def __adopt(
+    movement_id: int, follower_ids: list, leaders: dict, session: Session
+) -> int:
+    """Link followers to the least loaded new leaders of a movement."""
+    graph = Engine.get_graph(movement_id, session)
+
+    adopted = Counter()
+    links = []
+    with graph.lock:
+        for follower_id in follower_ids:
+            if follower_id not in graph.underled:
+                continue
+            candidates = [
+                leader_id for leader_id in leaders
+                if leader_id in graph.members
+                and leader_id != follower_id
+                and leader_id not in graph.leaders.get(follower_id, ())
+            ]
+            if not candidates:
+                continue
+            leader_id = min(
+                candidates,
+                key=lambda leader_id: leaders[leader_id] + adopted[leader_id],
+            )
+            adopted[leader_id] += 1
+            links.append((follower_id, leader_id))
+
+    insert_links(movement_id, links, session)
+    Engine.record(session, movement_id, created=links)
+    if adopted:
+        # Through the table, as the ORM only updates many rows by key.
+        queued = QueuedUser.__table__
+        session.execute(
+            update(queued)
+            .where(
+                queued.c.movement_id == movement_id,
+                queued.c.queue == ADOPTION,
+                queued.c.role == LEADER,
+                queued.c.user_id == bindparam("leader_id"),
+            )
+            .values(adopted=queued.c.adopted + bindparam("count")),
+            [
+                {"leader_id": leader_id, "count": count}
+                for leader_id, count in adopted.items()
+            ],
+        )
+    return len(links)
+
+
+def leave(user_id: int, movement_id: int, session: Session) -> None:
+    """
+    Destroy the links of a leaving user and queue the rewiring of its peers.
+
+    The links are destroyed with one statement and the peers are found in
+    the graph of the movement, so the cost does not depend on the amount of
+    links. The peers are queued in the same session.
+
+    Args:
+        user_id (int): The id of the user that leaves.
+        movement_id (int): The id of the movement the user leaves.
+        session (Session): The session in which the user leaves.
+    """
+    graph = Engine.get_graph(movement_id, session)
+    with graph.lock:
+        leader_ids = list(graph.leaders.get(user_id, ()))
+        follower_ids = list(graph.followers.get(user_id, ()))
+
+    destroy_links(movement_id, [user_id], session)
+    Engine.record(session, movement_id, left=[user_id], destroyed=[
+        (user_id, leader_id) for leader_id in leader_ids
+    ] + [
+        (follower_id, user_id) for follower_id in follower_ids
+    ])
+    enqueue_rewiring(movement_id, follower_ids, leader_ids, session)
+
+
+def enqueue_rewiring(
+    movement_id: int, follower_ids: list, leader_ids: list, session: Session
+) -> None:
+    """
+    Queue users that lost links to be rewired in a session.
+
+    Args:
+        movement_id (int): The id of the movement the links were in.
+        follower_ids (list): The ids of the followers that lost a leader.
+        leader_ids (list): The ids of the leaders that lost a follower.
+        session (Session): The session in which the links are destroyed.
+    """
+    __enqueue(movement_id, REWIRING, FOLLOWER, follower_ids, session)
+    __enqueue(movement_id, REWIRING, LEADER, leader_ids, session)
+
+
+def get_rewiring_backlog(session: Session = None) -> int:
+    """
+    Get the amount of followers and leaders waiting to be rewired.
+
+    Args:
+        session (Session): The session to count with, a new one if None.
+    """
+    return __count(REWIRING, [FOLLOWER, LEADER], session)
+
+
+def process_rewiring(
+    batch_size: int = REWIRING_BATCH_SIZE, movement_id: int = None
+) -> int:
+    """
+    Find replacement links for a batch of the queued users.
+
+    Every queued follower gets a new leader and every queued leader gets a
+    new follower, as long as the movement has a suitable member. The links
+    of a movement are found in its graph and inserted in one statement.
+
+    Args:
+        batch_size (int): The maximum amount of users to process.
+        movement_id (int): Only process the users of this movement.
+
+    Returns:
+        int: The amount of links that were created.
+    """
+    created = 0
+    while batch_size > 0:
+        next_id = __next_movement(REWIRING, movement_id)
+        if next_id is None:
+            break
+        with movement_scope(next_id) as session:
+            follower_ids, leader_ids = __pop_rewiring(
+                next_id, batch_size, session
+            )
+            if not follower_ids and not leader_ids:
+                break
+            batch_size -= len(follower_ids) + len(leader_ids)
+            created += __rewire(next_id, follower_ids, leader_ids, session)
+    return created
+
+
+def _process_rewiring(
+    movement_id: int, session: Session, batch_size: int = REWIRING_BATCH_SIZE
+) -> int:
+    """Process a batch of the rewiring of a movement within a session."""
+    follower_ids, leader_ids = __pop_rewiring(movement_id, batch_size, session)
+    if not follower_ids and not leader_ids:
+        return 0
+    return __rewire(movement_id, follower_ids, leader_ids, session)
+
+
+def assign_leaders(
+    graph: Engine.MovementGraph,
+    follower_ids: list,
+    leader_ids=None,
+    exclude=(),
+) -> list:
+    """
+    Assign one new leader to every follower in a batch, spread evenly.
+
+    The leader with the fewest followers repeatedly takes the remaining
+    follower with the fewest leaders to choose from that does not follow it
+    yet. Handling the most constrained followers first keeps leaders free
+    for them, so the followers are spread evenly over the leaders. A leader
+    that no remaining follower can take is left out.
+
+    Args:
+        graph (MovementGraph): The graph of the movement.
+        follower_ids (list): The ids of the followers that need a leader.
+        leader_ids (iterable): The ids of the users that may be chosen. If
+            None every member may be chosen, they are then taken from the
+            heap of loads of the graph, so the cost does not depend on the
+            size of the movement.
+        exclude (iterable): Ids of users that may not be chosen.
+
+    Returns:
+        list: Follower and leader id pairs of the new links. Followers for
+        which no leader is available are left out.
+    """
+    follower_ids = set(follower_ids)
+    if not follower_ids:
+        return []
+
+    with graph.lock:
+        available = graph.members if leader_ids is None else set(leader_ids)
+
+        def options(follower_id):
+            followed = graph.leaders.get(follower_id, set())
+            return (
+                len(available)
+                - len(followed & available)
+                - (follower_id in available)
+            )
+
+        followers = sorted(
+            (
+                follower_id for follower_id in follower_ids
+                if graph.leader_count(follower_id) < Follower.MAX_LEADERS
+            ),
+            key=lambda f: (options(f), random.random()),
+        )
+        if not followers:
+            return []
+
+        # Leaders come from members, the fewest followers first, and go on
+        # the heap once they got a follower.
+        if leader_ids is None:
+            members = graph.iter_least_loaded(exclude)
+        else:
+            members = (
+                (load, leader_id) for load, _, leader_id in sorted(
+                    (graph.follower_count(m), random.random(), m)
+                    for m in available - set(exclude)
+                )
+            )
+        heap = []
+        links = []
+        assigned = set()
+        # Followers before first are all assigned.
+        first = 0
+        with closing(members):
+            pending = next(members, None)
+            while first < len(followers):
+                if pending and (
+                    not heap or (pending[0], 0.0) < heap[0][:2]
+                ):
+                    load, leader_id = pending
+                    tiebreak = random.random()
+                    pending = next(members, None)
+                elif heap:
+                    load, tiebreak, leader_id = heapq.heappop(heap)
+                else:
+                    break
+
+                for follower_id in islice(followers, first, None):
+                    if (
+                        follower_id not in assigned
+                        and follower_id != leader_id
+                        and leader_id not in graph.leaders.get(follower_id, ())
+                    ):
+                        links.append((follower_id, leader_id))
+                        assigned.add(follower_id)
+                        heapq.heappush(heap, (load + 1, tiebreak, leader_id))
+                        break
+                while first < len(followers) and followers[first] in assigned:
+                    first += 1
+        return links
+
+
+def reassign_leaders(
+    movement_id: int,
+    follower_ids: list,
+    leader_ids,
+    session: Session,
+    exclude=(),
+) -> list:
+    """
+    Give followers that lost a leader a new one in a single statement.
+
+    Args:
+        movement_id (int): The id of the movement the followers are in.
+        follower_ids (list): The ids of the followers that need a leader.
+        leader_ids (iterable): The ids of the users that may be chosen, all
+            members if None.
+        session (Session): The session in which the links are added.
+        exclude (iterable): Ids of users that may not be chosen.
+
+    Returns:
+        list: Follower and leader id pairs of the new links.
+    """
+    if not follower_ids:
+        return []
+
+    graph = Engine.get_graph(movement_id, session)
+    links = assign_leaders(graph, follower_ids, leader_ids, exclude)
+    insert_links(movement_id, links, session)
+    Engine.record(session, movement_id, created=links)
+    return links
+
+
+def rewire(
+    movement_id: int, follower_ids: list, leader_ids: list, session: Session
+) -> list:
+    """
+    Replace the links of users that lost several of them in one pass.
+
+    Followers get a new leader in rounds of :func:`assign_leaders`, until
+    they have MAX_LEADERS leaders or no leader is left for them. Then every
+    leader adopts a member that still needs a leader for every follower it
+    lost. All links are inserted with a single statement.
+
+    Args:
+        movement_id (int): The id of the movement the users are in.
+        follower_ids (list): The ids of the followers that lost leaders.
+        leader_ids (list): The ids of the leaders that lost followers, once
+            for every follower lost.
+        session (Session): The session in which the links are added.
+
+    Returns:
+        list: Follower and leader id pairs of the new links.
+    """
+    graph = Engine.get_graph(movement_id, session)
+
+    links = []
+    with graph.lock:
+        follower_ids = [f for f in set(follower_ids) if f in graph.underled]
+        while follower_ids:
+            new_links = assign_leaders(graph, follower_ids)
+            Engine.record(session, movement_id, created=new_links)
+            links.extend(new_links)
+            follower_ids = [f for f, _ in new_links if f in graph.underled]
+
+        for leader_id, lost in Counter(leader_ids).items():
+            if leader_id not in graph.members:
+                continue
+            new_links = [
+                (follower_id, leader_id)
+                for follower_id in graph.neediest_followers(leader_id, lost)
+            ]
+            if new_links:
+                Engine.record(session, movement_id, created=new_links)
+                links.extend(new_links)
+
+    insert_links(movement_id, links, session)
+    return links
+
+
+def __enqueue(
+    movement_id: int, queue: str, role: str, user_ids: list, session: Session
+) -> None:
+    """Add the users that are not in a queue yet with a single statement."""
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return
+
+    queued = {
+        user_id for user_id, in session.query(QueuedUser.user_id).filter(
+            QueuedUser.movement_id == movement_id,
+            QueuedUser.queue == queue,
+            QueuedUser.role == role,
+            QueuedUser.user_id.in_(user_ids),
+        )
+    }
+    rows = [
+        {
+            "movement_id": movement_id,
+            "user_id": user_id,
+            "queue": queue,
+            "role": role,
+            "adopted": 0,
+        }
+        for user_id in user_ids if user_id not in queued
+    ]
+    if rows:
+        session.execute(insert(QueuedUser), rows)
+
+
+def __count(
+    queue: str, roles: list, session: Session, movement_ids: list = None
+) -> int:
+    """Count the users in a queue with one of the roles."""
+    if session is None:
+        with session_scope() as session:
+            return __count(queue, roles, session, movement_ids)
+
+    query = session.query(QueuedUser).filter(
+        QueuedUser.queue == queue, QueuedUser.role.in_(roles)
+    )
+    if movement_ids is not None:
+        query = query.filter(QueuedUser.movement_id.in_(movement_ids))
+    return query.count()
+
+
+def __next_movement(queue: str, movement_id: int = None) -> int:
+    """Find the movement to process the queued users of next."""
+    with session_scope() as session:
+        query = session.query(QueuedUser.movement_id).filter(
+            QueuedUser.queue == queue
+        )
+        if movement_id is not None:
+            query = query.filter(QueuedUser.movement_id == movement_id)
+        first = query.order_by(QueuedUser.id).first()
+        return first[0] if first else None
+
+
+def __pop(
+    movement_id: int, queue: str, role: str, batch_size: int, session: Session
+) -> list:
+    """
+    Take up to batch_size users of a movement from a queue, oldest first.
+
+    The users are deleted in the session, so they stay queued if it rolls
+    back and a failed or retried transaction does not lose them.
+    """
+    if batch_size <= 0:
+        return []
+
+    rows = session.query(QueuedUser.id, QueuedUser.user_id).filter(
+        QueuedUser.movement_id == movement_id,
+        QueuedUser.queue == queue,
+        QueuedUser.role == role,
+    ).order_by(QueuedUser.id).limit(batch_size).all()
+    if rows:
+        session.query(QueuedUser).filter(
+            QueuedUser.id.in_([row_id for row_id, _ in rows])
+        ).delete(synchronize_session=False)
+    return [user_id for _, user_id in rows]
+
+
+def __pop_rewiring(
+    movement_id: int, batch_size: int, session: Session
+) -> tuple:
+    """Take up to batch_size queued followers and leaders of a movement."""
+    follower_ids = __pop(movement_id, REWIRING, FOLLOWER, batch_size, session)
+    leader_ids = __pop(
+        movement_id, REWIRING, LEADER, batch_size - len(follower_ids), session
+    )
+    return follower_ids, leader_ids
+
+
+def __rewire(
+    movement_id: int, follower_ids: list, leader_ids: list, session: Session
+) -> int:
+    """Link queued followers and leaders of a movement to new peers."""
+    graph = Engine.get_graph(movement_id, session)
+
+    links = set()
+    new_leaders = defaultdict(set)
+    with graph.lock:
+        for follower_id, leader_id in assign_leaders(
+            graph, [f for f in follower_ids if f in graph.underled]
+        ):
+            links.add((follower_id, leader_id))
+            new_leaders[follower_id].add(leader_id)
+
+        # Every leader takes the member with the fewest leaders, counting
+        # the leaders it got earlier in this batch.
+        full = {
+            follower_id for follower_id, new in new_leaders.items()
+            if graph.leader_count(follower_id) + len(new)
+            >= Follower.MAX_LEADERS
+        }
+        for leader_id in leader_ids:
+            if leader_id not in graph.members:
+                continue
+            taken = {
+                follower_id for follower_id in new_leaders
+                if leader_id in new_leaders[follower_id]
+            }
+            for follower_id in graph.neediest_followers(
+                leader_id, 1, exclude=full | taken
+            ):
+                links.add((follower_id, leader_id))
+                new_leaders[follower_id].add(leader_id)
+                if (
+                    graph.leader_count(follower_id)
+                    + len(new_leaders[follower_id])
+                    >= Follower.MAX_LEADERS
+                ):
+                    full.add(follower_id)
+
+    links = sorted(links)
+    insert_links(movement_id, links, session)
+    Engine.record(session, movement_id, created=links)
+    return len(links)
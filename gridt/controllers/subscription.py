@@ -1,14 +1,22 @@
 """Controller for subscriptions."""
-from gridt.models import Subscription
+from datetime import datetime
+
+from gridt.models import Subscription, User
 from gridt.controllers import follower as Follower, leader as Leader
 from gridt.controllers import movements as Movements
+from gridt.controllers import engine as Engine
+from gridt.controllers import rewiring as Rewiring
 from .helpers import (
     session_scope,
+    movement_scope,
     load_movement,
     load_user,
+    insert_links,
+    destroy_links,
     GridtExceptions
 )
 
+from sqlalchemy import insert, update
 from sqlalchemy.orm.query import Query
 from sqlalchemy.orm.session import Session
 
@@ -78,55 +86,238 @@ def _subscription_exists(
     return True
 
 
-def new_subscription(user_id: int, movement_id: int) -> dict:
+def new_subscription(
+    user_id: int, movement_id: int, max_adoptions: int = None
+) -> dict:
     """
     Create a new subscription between a user and a movement.
 
+    The subscription, the links to the leaders of the user and the links to
+    its followers are created in one transaction. The amount of statements
+    does not depend on the size of the movement.
+
     Args:
         user_id (int): The id of the user
         movement_id (int): The id of the movement
+        max_adoptions (int): The maximum amount of followers the user adopts
+            right away, the others are queued for the rewiring controller.
+            All followers are adopted right away if None.
 
     Returns:
         dict: json of the new subscription
     """
-    with session_scope() as session:
-        user = load_user(user_id, session)
-        movement = load_movement(movement_id, session)
+    with movement_scope(movement_id) as session:
+        return _new_subscription(
+            user_id, movement_id, session, max_adoptions
+        )
+
+
+def _new_subscription(
+    user_id: int, movement_id: int, session: Session, max_adoptions=None
+) -> dict:
+    """Create a new subscription and its links within a session."""
+    user = load_user(user_id, session)
+    movement = load_movement(movement_id, session)
+    # Load the graph before it changes, so it is kept after the commit.
+    Engine.get_graph(movement_id, session)
+
+    subscription = Subscription(user, movement)
+    session.add(subscription)
+    Engine.record(session, movement_id, joined=[user_id])
+
+    Follower._add_initial_leaders(user, movement, session)
+    Leader._add_initial_followers(user, movement, session, max_adoptions)
+    return subscription.to_json()
+
+
+def bulk_subscribe(movement_id: int, user_ids: list) -> list:
+    """
+    Subscribe many users to a movement at once.
 
-        subscription = Subscription(user, movement)
-        session.add(subscription)
-        subscription_json = subscription.to_json()
+    The users join in the given order and are wired like they would be by
+    :func:`new_subscription`, but the wiring is found in the graph of the
+    movement and all subscriptions and links are inserted with one statement
+    each. Users that are subscribed already are skipped.
 
-    Follower.add_initial_leaders(user_id, movement_id)
-    Leader.add_initial_followers(user_id, movement_id)
+    Args:
+        movement_id (int): The id of the movement
+        user_ids (list): The ids of the users that join
 
-    return subscription_json
+    Raises:
+        GridtExceptions.UserNotFoundError: If one of the users does not
+            exist, nobody is subscribed.
 
+    Returns:
+        list: The ids of the users that were subscribed.
+    """
+    with movement_scope(movement_id) as session:
+        return _bulk_subscribe(movement_id, user_ids, session)
+
+
+def _bulk_subscribe(
+    movement_id: int, user_ids: list, session: Session
+) -> list:
+    """Subscribe many users and insert their links within a session."""
+    user_ids = list(dict.fromkeys(user_ids))
+    existing = {
+        user_id for user_id, in session.query(User.id).filter(
+            User.id.in_(user_ids)
+        )
+    }
+    missing = [user_id for user_id in user_ids if user_id not in existing]
+    if missing:
+        raise GridtExceptions.UserNotFoundError(
+            f"No IDs '{missing}' not found."
+        )
 
-def remove_subscription(user_id: int, movement_id: int) -> dict:
+    graph = Engine.get_graph(movement_id, session)
+    links = []
+    with graph.lock:
+        user_ids = [
+            user_id for user_id in user_ids if user_id not in graph.members
+        ]
+        for user_id in user_ids:
+            Engine.record(session, movement_id, joined=[user_id])
+            new_links = [
+                (user_id, leader_id)
+                for leader_id in graph.select_leaders(
+                    user_id,
+                    Follower.MAX_LEADERS - graph.leader_count(user_id),
+                    Follower.LEADER_SELECTION,
+                )
+            ] + [
+                (follower_id, user_id)
+                for follower_id in graph.possible_followers(user_id)
+            ]
+            Engine.record(session, movement_id, created=new_links)
+            links.extend(new_links)
+
+    if user_ids:
+        time_added = datetime.now()
+        session.execute(insert(Subscription), [
+            {
+                "user_id": user_id,
+                "movement_id": movement_id,
+                "time_added": time_added,
+            }
+            for user_id in user_ids
+        ])
+    insert_links(movement_id, links, session)
+    return user_ids
+
+
+def remove_subscription(
+    user_id: int, movement_id: int, deferred: bool = False
+) -> dict:
     """
     End a subscription relation between a user and a movement.
 
+    The subscription and the links of the user are ended in one transaction.
+
     Args:
         user_id (int): The id of the user
         movement_id (int): The id of the movement
+        deferred (bool): Only destroy the links of the user and leave finding
+            new links for its peers to the rewiring controller.
 
     Returns:
         dict: json of the removed subscription
     """
-    with session_scope() as session:
-        subscription = _get_subscription(user_id, movement_id, session)
-        subscription.end()
+    with movement_scope(movement_id) as session:
+        return _remove_subscription(user_id, movement_id, session, deferred)
+
 
-        session.add(subscription)
-        removed_json = subscription.to_json()
+def _remove_subscription(
+    user_id: int, movement_id: int, session: Session, deferred=False
+) -> dict:
+    """End a subscription and the links of its user within a session."""
+    subscription = _get_subscription(user_id, movement_id, session)
+    if deferred:
+        Rewiring.leave(user_id, movement_id, session)
+    else:
+        Engine.record(session, movement_id, left=[user_id])
+    subscription.end()
 
-    Follower.remove_all_leaders(user_id, movement_id)
-    Leader.remove_all_followers(user_id, movement_id)
+    session.add(subscription)
+    removed_json = subscription.to_json()
+
+    if not deferred:
+        Follower._remove_all_leaders(user_id, movement_id, session)
+        Leader._remove_all_followers(user_id, movement_id, session)
 
     return removed_json
 
 
+def bulk_unsubscribe(movement_id: int, user_ids: list) -> list:
+    """
+    End the subscriptions of many users to a movement at once.
+
+    The subscriptions and the links of the users are ended with one
+    statement each. The remaining members that lost links are then rewired
+    in a single pass, see :func:`rewiring.rewire`. Users that are not
+    subscribed are skipped.
+
+    Args:
+        movement_id (int): The id of the movement
+        user_ids (list): The ids of the users that leave
+
+    Returns:
+        list: The ids of the users that were unsubscribed.
+    """
+    with movement_scope(movement_id) as session:
+        return _bulk_unsubscribe(movement_id, user_ids, session)
+
+
+def _bulk_unsubscribe(
+    movement_id: int, user_ids: list, session: Session
+) -> list:
+    """End many subscriptions and rewire the remaining members."""
+    graph = Engine.get_graph(movement_id, session)
+    with graph.lock:
+        user_ids = [
+            user_id for user_id in dict.fromkeys(user_ids)
+            if user_id in graph.members
+        ]
+        destroyed = set()
+        for user_id in user_ids:
+            destroyed.update(
+                (user_id, leader_id)
+                for leader_id in graph.leaders.get(user_id, ())
+            )
+            destroyed.update(
+                (follower_id, user_id)
+                for follower_id in graph.followers.get(user_id, ())
+            )
+    if not user_ids:
+        return []
+
+    session.execute(
+        update(Subscription)
+        .where(
+            Subscription.movement_id == movement_id,
+            Subscription.user_id.in_(user_ids),
+            Subscription.time_removed.is_(None),
+        )
+        .values(time_removed=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    destroy_links(movement_id, user_ids, session)
+    destroyed = sorted(destroyed)
+    Engine.record(
+        session, movement_id, destroyed=destroyed, left=user_ids
+    )
+
+    # Only the remaining members need new links.
+    leaving = set(user_ids)
+    Rewiring.rewire(
+        movement_id,
+        [f for f, leader_id in destroyed if f not in leaving],
+        [leader_id for f, leader_id in destroyed if leader_id not in leaving],
+        session,
+    )
+    return user_ids
+
+
 def get_subscribers(movement_id: int) -> list:
     """
     Get the all subscribers of a movement.
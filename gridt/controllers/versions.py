@@ -0,0 +1,68 @@
+"""Controller for the versions of the movement networks."""
+from sqlalchemy.orm.session import Session
+
+from gridt.models import Movement, Signal
+from .helpers import session_scope, GridtExceptions
+
+
+def get_version(movement_id: int, session: Session = None) -> str:
+    """
+    Get the current version of the network of a movement.
+
+    The version combines the graph version with the id of the last signal
+    sent in the movement, so it changes every time a link, subscription or
+    signal of the movement is written, by any process. Signals do not write
+    to the movement, so they never wait for changes to the network.
+
+    Args:
+        movement_id (int): The id of the movement.
+        session (Session): The session to read the version with, a new one
+            if None.
+
+    Returns:
+        str: The version of the network.
+    """
+    if session is None:
+        with session_scope() as session:
+            return get_version(movement_id, session)
+
+    graph_version = get_graph_version(movement_id, session)
+    last_signal = session.query(Signal.id).filter(
+        Signal.movement_id == movement_id
+    ).order_by(Signal.time_stamp.desc(), Signal.id.desc()).first()
+    signal_id = last_signal[0] if last_signal else 0
+    return f"{graph_version}-{signal_id}"
+
+
+def get_graph_version(movement_id: int, session: Session = None) -> int:
+    """
+    Get the version of the links and subscribers of a movement.
+
+    The version is kept in the database and is bumped by triggers whenever a
+    link or subscription of the movement is written. Unlike
+    :func:`get_version` it does not change when a signal is sent.
+
+    Args:
+        movement_id (int): The id of the movement.
+        session (Session): The session to read the version with, a new one
+            if None.
+
+    Returns:
+        int: The version of the graph of the network.
+
+    Raises:
+        GridtExceptions.MovementNotFoundError: If the movement does not
+            exist.
+    """
+    if session is None:
+        with session_scope() as session:
+            return get_graph_version(movement_id, session)
+
+    graph_version = session.query(Movement.graph_version).filter(
+        Movement.id == movement_id
+    ).scalar()
+    if graph_version is None:
+        raise GridtExceptions.MovementNotFoundError(
+            f"No ID '{movement_id}' not found."
+        )
+    return graph_version
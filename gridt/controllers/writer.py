@@ -0,0 +1,292 @@
+"""Controller for applying the changes to every movement from one writer."""
+import threading
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+
+from gridt.db import Session
+from gridt.controllers import follower as Follower
+from gridt.controllers import subscription as Subscription
+from gridt.controllers import rewiring as Rewiring
+from .helpers import movement_scope
+
+# Move variable to config
+WRITER_THREADS = 8
+WRITER_BATCH_SIZE = 50
+
+# Per worker the queued (movement_id, call, future) items and the condition
+# the worker waits on. A movement is always handled by the same worker.
+__queues = [deque() for _ in range(WRITER_THREADS)]
+__conditions = [threading.Condition() for _ in range(WRITER_THREADS)]
+__workers = {}
+__lock = threading.Lock()
+
+
+def new_subscription(
+    user_id: int, movement_id: int, max_adoptions: int = None
+) -> Future:
+    """
+    Queue a new subscription between a user and a movement.
+
+    Args:
+        user_id (int): The id of the user
+        movement_id (int): The id of the movement
+        max_adoptions (int): See :func:`subscription.new_subscription`.
+
+    Returns:
+        Future: Resolves to the json of the new subscription.
+    """
+    return submit(movement_id, partial(
+        Subscription._new_subscription,
+        user_id,
+        movement_id,
+        max_adoptions=max_adoptions,
+    ))
+
+
+def bulk_subscribe(movement_id: int, user_ids: list) -> Future:
+    """
+    Queue subscribing many users to a movement at once.
+
+    Args:
+        movement_id (int): The id of the movement
+        user_ids (list): See :func:`subscription.bulk_subscribe`.
+
+    Returns:
+        Future: Resolves to the ids of the users that were subscribed.
+    """
+    return submit(movement_id, partial(
+        Subscription._bulk_subscribe, movement_id, list(user_ids)
+    ))
+
+
+def remove_subscription(
+    user_id: int, movement_id: int, deferred: bool = False
+) -> Future:
+    """
+    Queue the end of a subscription between a user and a movement.
+
+    Args:
+        user_id (int): The id of the user
+        movement_id (int): The id of the movement
+        deferred (bool): See :func:`subscription.remove_subscription`.
+
+    Returns:
+        Future: Resolves to the json of the removed subscription.
+    """
+    return submit(movement_id, partial(
+        Subscription._remove_subscription,
+        user_id,
+        movement_id,
+        deferred=deferred,
+    ))
+
+
+def bulk_unsubscribe(movement_id: int, user_ids: list) -> Future:
+    """
+    Queue ending the subscriptions of many users to a movement at once.
+
+    Args:
+        movement_id (int): The id of the movement
+        user_ids (list): See :func:`subscription.bulk_unsubscribe`.
+
+    Returns:
+        Future: Resolves to the ids of the users that were unsubscribed.
+    """
+    return submit(movement_id, partial(
+        Subscription._bulk_unsubscribe, movement_id, list(user_ids)
+    ))
+
+
+def swap_leader(
+    follower_id: int, movement_id: int, leader_id: int, strategy: str = None
+) -> Future:
+    """
+    Queue swapping out a leader of a follower.
+
+    Args:
+        follower_id (int): The id of the user whose leader will be swapped.
+        movement_id (int): The id of the movement of the swap.
+        leader_id (int): The id of the leader that will be swapped.
+        strategy (str): See :func:`follower.swap_leader`.
+
+    Returns:
+        Future: Resolves to the new leader dictionary or None.
+    """
+    return submit(movement_id, partial(
+        Follower._swap_leader,
+        follower_id,
+        movement_id,
+        leader_id,
+        strategy=strategy,
+    ))
+
+
+def process_adoptions(
+    movement_id: int, batch_size: int = Rewiring.ADOPTION_BATCH_SIZE
+) -> Future:
+    """
+    Queue processing a batch of the adoptions of a movement.
+
+    Returns:
+        Future: Resolves to the amount of links that were created.
+    """
+    return submit(movement_id, partial(
+        Rewiring._process_adoptions, movement_id, batch_size=batch_size
+    ))
+
+
+def process_rewiring(
+    movement_id: int, batch_size: int = Rewiring.REWIRING_BATCH_SIZE
+) -> Future:
+    """
+    Queue processing a batch of the rewiring of a movement.
+
+    Returns:
+        Future: Resolves to the amount of links that were created.
+    """
+    return submit(movement_id, partial(
+        Rewiring._process_rewiring, movement_id, batch_size=batch_size
+    ))
+
+
+def submit(movement_id: int, call) -> Future:
+    """
+    Queue a change to the network of a movement.
+
+    The changes to a movement are applied in the order they were queued, by
+    the one worker that handles the movement. Consecutive changes to the
+    same movement are applied in one transaction, up to WRITER_BATCH_SIZE at
+    a time. When that transaction fails every change in it is retried in a
+    transaction of its own, so only the failing change gets the error. A
+    change must therefore undo what it did in memory when its transaction
+    rolls back, the rewiring and adoption queues are in the database.
+
+    Args:
+        movement_id (int): The id of the movement that will be changed.
+        call (function): Function that makes the change, called with the
+            session as keyword argument ``session``.
+
+    Returns:
+        Future: Resolves to what the function returns, or raises what it
+        raised.
+    """
+    future = Future()
+    index = __worker_index(movement_id)
+    # A worker only stops while holding the lock and seeing an empty queue,
+    # so the change is applied by the running worker or a new one.
+    with __lock:
+        __start(index)
+        with __conditions[index]:
+            __queues[index].append((movement_id, call, future))
+            __conditions[index].notify()
+    return future
+
+
+def get_backlog() -> int:
+    """Get the amount of changes waiting to be applied."""
+    return sum(len(queue) for queue in __queues)
+
+
+def shutdown(wait: bool = True) -> None:
+    """
+    Stop the workers once they applied the changes queued so far.
+
+    A worker keeps running until its queue is empty, also for changes queued
+    after this call. Workers are started again by the next change that is
+    queued after they stopped.
+
+    Args:
+        wait (bool): Wait until the workers are stopped.
+    """
+    with __lock:
+        workers = dict(__workers)
+        for index in workers:
+            with __conditions[index]:
+                __queues[index].append((None, None, None))
+                __conditions[index].notify()
+
+    if wait:
+        for worker in workers.values():
+            worker.join()
+
+
+def __worker_index(movement_id: int) -> int:
+    """Find the worker that handles a movement."""
+    return hash(movement_id) % WRITER_THREADS
+
+
+def __start(index: int) -> None:
+    """Start the worker with the index unless it runs, hold the lock."""
+    if index in __workers:
+        return
+    worker = threading.Thread(
+        target=__work, args=(index,), name=f"gridt-writer-{index}"
+    )
+    worker.daemon = True
+    worker.start()
+    __workers[index] = worker
+
+
+def __work(index: int) -> None:
+    """Apply the queued changes of a worker until it is stopped."""
+    queue = __queues[index]
+    condition = __conditions[index]
+    stopping = False
+    while True:
+        if stopping and __stop(index):
+            return
+
+        with condition:
+            while not queue and not stopping:
+                condition.wait()
+            if not queue:
+                continue
+            batch = [queue.popleft()]
+            movement_id = batch[0][0]
+            if movement_id is None:
+                stopping = True
+                continue
+            while (
+                queue
+                and queue[0][0] == movement_id
+                and len(batch) < WRITER_BATCH_SIZE
+            ):
+                batch.append(queue.popleft())
+
+        try:
+            __apply(movement_id, [
+                (call, future) for _, call, future in batch
+                if future.set_running_or_notify_cancel()
+            ])
+        finally:
+            Session.remove()
+
+
+def __stop(index: int) -> bool:
+    """Unregister a stopping worker if its queue is empty."""
+    with __lock, __conditions[index]:
+        if __queues[index]:
+            return False
+        del __workers[index]
+        return True
+
+
+def __apply(movement_id: int, batch: list) -> None:
+    """Apply a batch of changes to a movement and resolve their futures."""
+    if not batch:
+        return
+
+    try:
+        with movement_scope(movement_id) as session:
+            results = [call(session=session) for call, _ in batch]
+    except Exception as error:
+        if len(batch) == 1:
+            batch[0][1].set_exception(error)
+            return
+        for item in batch:
+            __apply(movement_id, [item])
+        return
+
+    for (_, future), result in zip(batch, results):
+        future.set_result(result)
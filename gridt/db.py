@@ -27,9 +27,13 @@ def init_db_connect(url: str = "sqlite:///:memory:") -> None:
         sys.exit(1)
 
     try:
+        # Imported here, as the models need Base.
+        from gridt.models.movement import upgrade_graph_version
+
         engine = create_engine(url)
         Session.configure(bind=engine)
         Base.metadata.create_all(engine)
+        upgrade_graph_version(engine)
     except Exception as ex:
         print("Error creating session.")
         print(ex)
@@ -7,6 +7,7 @@ from .signal import Signal
 from .subscription import Subscription
 from .creation import Creation
 from .announcement import Announcement
+from .queued_user import QueuedUser
 
 __all__ = [
     "User",
@@ -15,5 +16,6 @@ __all__ = [
     "Signal",
     "Subscription",
     "Creation",
-    "Announcement"
+    "Announcement",
+    "QueuedUser",
 ]
@@ -1,8 +1,41 @@
 """Model for movements in the database."""
-from sqlalchemy import Column, Integer, String
+import time
+
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    DDL,
+    Integer,
+    String,
+    event,
+    inspect,
+    text,
+)
 
 from gridt.db import Base
 
+# Per dialect that supports the graph version triggers, the query listing
+# the triggers that exist.
+TRIGGER_DIALECTS = {
+    "sqlite": "SELECT name FROM sqlite_master WHERE type = 'trigger'",
+    "mysql": (
+        "SELECT trigger_name FROM information_schema.triggers "
+        "WHERE trigger_schema = DATABASE()"
+    ),
+}
+# Per trigger name the statement creating it for every dialect.
+TRIGGERS = {}
+
+
+def _initial_version() -> int:
+    """
+    Get the first version of a new movement.
+
+    Versions start at the current time in microseconds, so a movement never
+    gets a version that an earlier database used for the same id.
+    """
+    return int(time.time() * 1e6)
+
 
 class Movement(Base):
     """
@@ -37,6 +70,14 @@ class Movement(Base):
     interval = Column(String(20), nullable=False)
     short_description = Column(String(100))
     description = Column(String(1000))
+    # Bumped by the database whenever a subscription or link of the movement
+    # is written, see :func:`bump_graph_version_on_change`.
+    graph_version = Column(
+        BigInteger,
+        nullable=False,
+        default=_initial_version,
+        server_default="0",
+    )
 
     def __init__(self, name, interval, short_description="", description=""):
         """Construct a new movement."""
@@ -58,3 +99,80 @@ class Movement(Base):
     def __repr__(self):
         """Represent the movement as a string."""
         return f"<Movement name={self.name}>"
+
+
+def bump_graph_version_on_change(table) -> None:
+    """
+    Create triggers that bump the graph version of a movement on changes.
+
+    The graph version is changed in the same transaction as the row, however
+    it is written, so every process sees every change of a movement.
+    Triggers are created for SQLite and MySQL, along with the table or by
+    :func:`upgrade_graph_version` when the table already exists.
+
+    Args:
+        table (Table): Table with a movement_id column.
+    """
+    for operation, movement_ids in (
+        ("INSERT", "NEW.movement_id"),
+        ("UPDATE", "OLD.movement_id, NEW.movement_id"),
+        ("DELETE", "OLD.movement_id"),
+    ):
+        name = f"{table.name.lower()}_{operation.lower()}_bump_version"
+        update = (
+            "UPDATE movements SET graph_version = graph_version + 1 "
+            f"WHERE id IN ({movement_ids})"
+        )
+        statements = {
+            "sqlite": (
+                f"CREATE TRIGGER {name} AFTER {operation} ON {table.name} "
+                f"FOR EACH ROW BEGIN {update}; END"
+            ),
+            "mysql": (
+                f"CREATE TRIGGER {name} AFTER {operation} ON {table.name} "
+                f"FOR EACH ROW {update}"
+            ),
+        }
+        TRIGGERS[name] = statements
+        for dialect, statement in statements.items():
+            event.listen(table, "after_create", DDL(statement).execute_if(
+                dialect=dialect
+            ))
+
+
+def upgrade_graph_version(engine) -> None:
+    """
+    Add the graph version to a database created without it.
+
+    The graph_version column and the triggers that are missing are added,
+    so this is safe to run every time the database is connected.
+
+    Args:
+        engine (Engine): The engine of the database to upgrade.
+
+    Raises:
+        NotImplementedError: If the database does not support the triggers.
+    """
+    dialect = engine.dialect.name
+    if dialect not in TRIGGER_DIALECTS:
+        raise NotImplementedError(
+            f"Graph versions need triggers, which are not supported for "
+            f"'{dialect}' databases."
+        )
+
+    with engine.begin() as connection:
+        columns = {
+            column["name"]
+            for column in inspect(connection).get_columns("movements")
+        }
+        if "graph_version" not in columns:
+            connection.execute(text(
+                "ALTER TABLE movements "
+                "ADD COLUMN graph_version BIGINT NOT NULL DEFAULT 0"
+            ))
+
+        existing = connection.execute(text(TRIGGER_DIALECTS[dialect]))
+        existing = {name.lower() for name, in existing}
+        for name, statements in TRIGGERS.items():
+            if name not in existing:
+                connection.execute(text(statements[dialect]))
@@ -1,10 +1,11 @@
 """Model for creation in the database."""
 from datetime import datetime
-from sqlalchemy import Column, Integer, DateTime, ForeignKey, String
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, String, Index
 from sqlalchemy.orm import relationship
 
 from gridt.db import Base
 from gridt.models import User, Movement
+from gridt.models.movement import bump_graph_version_on_change
 
 
 class MovementUserRelation(Base):
@@ -17,6 +18,10 @@ class MovementUserRelation(Base):
     """
 
     __tablename__ = 'MovementUserRelation'
+    __table_args__ = (
+        Index("ix_relation_movement_added", "movement_id", "time_added"),
+        Index("ix_relation_movement_removed", "movement_id", "time_removed"),
+    )
     id = Column(Integer, primary_key=True)
 
     # Define the type of relation between the user and the movement
@@ -67,3 +72,6 @@ class MovementUserRelation(Base):
             the relation is still present in the database
         """
         self.time_removed = datetime.now()
+
+
+bump_graph_version_on_change(MovementUserRelation.__table__)
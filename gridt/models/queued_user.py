@@ -0,0 +1,46 @@
+"""Model for users waiting to be rewired in the database."""
+from sqlalchemy import (
+    Column,
+    Integer,
+    String,
+    ForeignKey,
+    Index,
+    UniqueConstraint,
+)
+
+from gridt.db import Base
+
+
+class QueuedUser(Base):
+    """
+    Representation of a user waiting for new links in a movement.
+
+    The queues are kept in the database, so every process can fill and
+    drain them and they survive restarts. Users are taken from a queue in
+    the transaction that links them, so they stay queued when it fails.
+
+    :attribute queue: The queue the user is in, "adoption" or "rewiring".
+    :attribute role: "follower" for a user that needs a leader, "leader"
+        for a user that lost a follower or, in the adoption queue, a new
+        leader that adopts the queued followers.
+    :attribute adopted: The amount of followers a new leader adopted.
+    """
+
+    __tablename__ = "queued_users"
+    __table_args__ = (
+        UniqueConstraint("movement_id", "queue", "role", "user_id"),
+        Index("ix_queued_users_queue_id", "queue", "id"),
+    )
+    id = Column(Integer, primary_key=True)
+    movement_id = Column(Integer, ForeignKey("movements.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    queue = Column(String(20), nullable=False)
+    role = Column(String(20), nullable=False)
+    adopted = Column(Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        """Represent the queued user as a string."""
+        return (
+            f"<QueuedUser queue={self.queue} role={self.role} "
+            f"user_id={self.user_id} movement_id={self.movement_id}>"
+        )
@@ -1,6 +1,6 @@
 """Model for signals in the database."""
 from datetime import datetime
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, String
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, String, Index
 from sqlalchemy.orm import relationship
 from gridt.db import Base
 
@@ -15,6 +15,15 @@ class Signal(Base):
     """
 
     __tablename__ = "signals"
+    __table_args__ = (
+        Index("ix_signals_movement_time_stamp", "movement_id", "time_stamp"),
+        Index(
+            "ix_signals_leader_movement_time_stamp",
+            "leader_id",
+            "movement_id",
+            "time_stamp",
+        ),
+    )
     id = Column(Integer, primary_key=True)
     leader_id = Column(Integer, ForeignKey("users.id"))
     movement_id = Column(Integer, ForeignKey("movements.id"))
@@ -1,10 +1,11 @@
 """Model for user to user link in the database."""
 from datetime import datetime
-from sqlalchemy import Column, Integer, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from gridt.db import Base
 from gridt.models import Movement, User
+from gridt.models.movement import bump_graph_version_on_change
 
 
 class UserToUserLink(Base):
@@ -26,6 +27,16 @@ class UserToUserLink(Base):
     """
 
     __tablename__ = "assoc"
+    __table_args__ = (
+        Index("ix_assoc_movement_created", "movement_id", "created"),
+        Index("ix_assoc_movement_destroyed", "movement_id", "destroyed"),
+        Index(
+            "ix_assoc_follower_movement_destroyed",
+            "follower_id",
+            "movement_id",
+            "destroyed",
+        ),
+    )
 
     id = Column(Integer, primary_key=True)
     leader_id = Column(Integer, ForeignKey("users.id"))
@@ -72,3 +83,6 @@ class UserToUserLink(Base):
         Note: the Association can still be found in database.
         """
         self.destroyed = datetime.now()
+
+
+bump_graph_version_on_change(UserToUserLink.__table__)
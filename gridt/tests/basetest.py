@@ -1,8 +1,11 @@
 """Base class with helper function that derives from `unittest.TestCase`."""
+from contextlib import contextmanager
 from unittest import TestCase
 import lorem
+import os
 import random
-from sqlalchemy import create_engine
+import tempfile
+from sqlalchemy import create_engine, event
 from gridt.db import Session, Base
 from gridt.models import User, Movement, Subscription
 
@@ -31,6 +34,25 @@ class BaseTest(TestCase):
         self.session.close()
         Base.metadata.create_all(self.engine)
 
+    @contextmanager
+    def count_statements(self):
+        """
+        Collect the statements sent to the database within the block.
+
+        Yields:
+            list: The statements executed so far, filled while the block runs.
+        """
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", count)
+        try:
+            yield statements
+        finally:
+            event.remove(self.engine, "before_cursor_execute", count)
+
     def create_user(self, generate_bio=False, is_admin=False):
         """Create a user in the database."""
         # Usually in tests we number the users, when outputting it is useful to
@@ -69,3 +91,34 @@ class BaseTest(TestCase):
         subscription = Subscription(user, movement)
         self.session.add(subscription)
         return subscription
+
+
+class FileDatabaseTest(BaseTest):
+    """Subclass this class for tests that use the database from threads."""
+
+    def setUp(self):
+        """
+        Set up function called before starting a test.
+
+        Creates an sqlite database in a file, as every thread has its own
+        connection.
+        """
+        super().setUp()
+        self.session.close()
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, "gridt.db")
+        self.engine = create_engine(
+            f"sqlite:///{path}",
+            connect_args={"check_same_thread": False, "timeout": 60},
+        )
+        Session.remove()
+        Session.configure(bind=self.engine)
+        Base.metadata.create_all(self.engine)
+        self.session = Session()
+
+    def tearDown(self):
+        """Close after finishing a test and remove the database file."""
+        super().tearDown()
+        Session.remove()
+        self.engine.dispose()
+        self.directory.cleanup()
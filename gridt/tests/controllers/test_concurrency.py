@@ -0,0 +1,111 @@
+"""Test for changing the networks of movements from several threads."""
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import skipUnless
+from unittest.mock import patch
+
+from gridt.tests.basetest import FileDatabaseTest
+from gridt.db import Session
+from gridt.controllers import engine as Engine
+from gridt.controllers.subscription import new_subscription
+from gridt.models import UserToUserLink
+
+BENCHMARK = os.getenv("GRIDT_BENCHMARK")
+
+
+class ConcurrentJoinTests(FileDatabaseTest):
+    """Tests for users joining movements at the same time."""
+
+    def create_joiners(self, movements, users):
+        """Create movements and users that will join them."""
+        movements = [self.create_movement() for _ in range(movements)]
+        users = [self.create_user() for _ in range(users)]
+        self.session.commit()
+        movement_ids = [movement.id for movement in movements]
+        user_ids = [user.id for user in users]
+        self.session.close()
+        return movement_ids, user_ids
+
+    def join_all(self, joins, threads):
+        """Let users join movements from threads, returns joins a second."""
+        def join(user_id, movement_id):
+            try:
+                new_subscription(user_id, movement_id)
+            finally:
+                Session.remove()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for future in [
+                executor.submit(join, user_id, movement_id)
+                for user_id, movement_id in joins
+            ]:
+                future.result()
+        return len(joins) / (time.perf_counter() - start)
+
+    def assert_network_valid(self, movement_id):
+        """Check no member has too many leaders or duplicate links."""
+        links = [
+            (link.follower_id, link.leader_id)
+            for link in self.session.query(UserToUserLink).filter(
+                UserToUserLink.movement_id == movement_id,
+                UserToUserLink.destroyed.is_(None),
+            )
+        ]
+        self.assertEqual(len(links), len(set(links)))
+        leader_counts = Counter(follower for follower, _ in links)
+        self.assertLessEqual(max(leader_counts.values(), default=0), 4)
+        for follower_id, leader_id in links:
+            self.assertNotEqual(follower_id, leader_id)
+
+    def test_concurrent_joins(self):
+        """Unittest for joins to one movement from several threads."""
+        (movement_id,), user_ids = self.create_joiners(1, 24)
+
+        self.join_all([(user_id, movement_id) for user_id in user_ids], 8)
+        self.assert_network_valid(movement_id)
+        leader_counts = Counter(
+            link.follower_id for link in self.session.query(UserToUserLink)
+        )
+        self.assertEqual(set(leader_counts.values()), {4})
+
+    def test_separate_caches(self):
+        """Unittest for joins from processes that each cache the graph."""
+        (movement_id,), user_ids = self.create_joiners(1, 9)
+        graphs = vars(Engine)["__graphs"]
+        other_graphs = {}
+
+        def join(user_ids):
+            for user_id in user_ids:
+                new_subscription(user_id, movement_id)
+
+        # Swapping the caches makes the joins run like in two processes.
+        join(user_ids[:3])
+        with patch.dict(graphs, other_graphs, clear=True):
+            join(user_ids[3:6])
+        join(user_ids[6:])
+
+        graph = Engine.get_graph(movement_id, self.session)
+        self.assertEqual(graph.members, set(user_ids))
+        self.assert_network_valid(movement_id)
+        leader_counts = Counter(
+            link.follower_id for link in self.session.query(UserToUserLink)
+            if link.destroyed is None
+        )
+        self.assertEqual(set(leader_counts.values()), {4})
+
+    @skipUnless(BENCHMARK, "Set GRIDT_BENCHMARK to run benchmarks.")
+    def test_join_throughput(self):
+        """Benchmark joins a second with a growing amount of threads."""
+        for threads in (1, 2, 4, 8):
+            movement_ids, user_ids = self.create_joiners(4, 100)
+            joins = [
+                (user_id, movement_ids[i % len(movement_ids)])
+                for i, user_id in enumerate(user_ids)
+            ]
+            throughput = self.join_all(joins, threads)
+            print(f"\n{threads} threads: {throughput:.1f} joins/s")
+            for movement_id in movement_ids:
+                self.assert_network_valid(movement_id)
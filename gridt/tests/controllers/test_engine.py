@@ -0,0 +1,299 @@
+"""Test for the engine controller."""
+import random
+import threading
+import time
+
+from gridt.tests.basetest import BaseTest, FileDatabaseTest
+from gridt.db import Session
+
+from gridt.controllers.engine import (
+    MovementGraph,
+    get_graph,
+    record,
+    invalidate,
+    ACTIVE,
+    ACTIVITY_HALF_LIFE,
+    BALANCED,
+    RANDOM,
+)
+from gridt.controllers.helpers import movement_scope, session_scope
+from gridt.controllers.leader import send_signal
+from gridt.controllers.subscription import (
+    new_subscription,
+    remove_subscription,
+)
+from gridt.controllers import versions as Versions
+from gridt.models import Movement, User, UserToUserLink
+
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, text
+
+
+class EngineControllerUnitTests(BaseTest):
+    """Unittests for engine controller."""
+
+    def create_network(self, size):
+        """Create a movement with subscribers where 1 -> 2 -> ... -> size."""
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(size)]
+        for user in users:
+            self.create_subscription(movement, user)
+        for follower, leader in zip(users, users[1:]):
+            self.session.add(UserToUserLink(movement, follower, leader))
+        self.session.commit()
+        return movement.id, [user.id for user in users]
+
+    def test_get_graph(self):
+        """Unittest for loading a graph and querying its indexes."""
+        movement_id, (u1, u2, u3) = self.create_network(3)
+
+        graph = get_graph(movement_id, self.session)
+        self.assertEqual(graph.members, {u1, u2, u3})
+        self.assertEqual(graph.leaders[u1], {u2})
+        self.assertEqual(graph.followers[u3], {u2})
+        self.assertEqual(graph.leader_count(u3), 0)
+        self.assertEqual(graph.follower_count(u2), 1)
+        self.assertEqual(sorted(graph.possible_leaders(u1)), [u3])
+        self.assertEqual(sorted(graph.possible_followers(u1)), [u2, u3])
+        self.assertEqual(graph.possible_followers(u1, exclude=[u2]), [u3])
+        self.assertIs(get_graph(movement_id, self.session), graph)
+
+        self.assertEqual(graph.sample_leaders(u1, 5), [u3])
+        self.assertEqual(graph.sample_leaders(u1, 5, exclude=[u3]), [])
+        graph.remove_member(u3)
+        graph.add_member(u3)
+        graph.remove_member(u1)
+        self.assertEqual(sorted(graph.sample_leaders(u3, 5)), [u2])
+
+    def test_buckets(self):
+        """Unittest for the members bucketed by their amount of leaders."""
+        movement_id, (u1, u2, u3) = self.create_network(3)
+        graph = get_graph(movement_id, self.session)
+
+        self.assertEqual(graph.buckets, [{u3}, {u1, u2}, set(), set()])
+        self.assertEqual(graph.neediest_followers(u1, 1), [u3])
+        self.assertEqual(graph.neediest_followers(u3, 5), [u1])
+        self.assertEqual(graph.neediest_followers(u1, 5, exclude=[u3]), [u2])
+
+        graph.add_link(u3, u1)
+        graph.add_link(u1, u3)
+        self.assertEqual(graph.buckets, [set(), {u2, u3}, {u1}, set()])
+        graph.remove_member(u2)
+        self.assertEqual(graph.buckets, [set(), {u3}, {u1}, set()])
+        self.assertEqual(graph.underled, {u1, u3})
+
+    def test_least_loaded_leaders(self):
+        """Unittest for selecting the leaders with the fewest followers."""
+        graph = MovementGraph(0)
+        for user_id in range(1, 6):
+            graph.add_member(user_id)
+        graph.add_link(1, 2)
+        graph.add_link(3, 2)
+        graph.add_link(1, 3)
+
+        self.assertEqual(graph.least_loaded_leaders(1, 2), [4, 5])
+        self.assertEqual(graph.least_loaded_leaders(4, 3), [1, 5, 3])
+        graph.add_link(2, 5)
+        graph.add_link(3, 5)
+        graph.remove_link(1, 2)
+        graph.remove_link(3, 2)
+        self.assertEqual(graph.least_loaded_leaders(1, 2), [2, 4])
+        self.assertEqual(graph.select_leaders(1, 2, BALANCED), [2, 4])
+        graph.remove_member(4)
+        self.assertEqual(graph.least_loaded_leaders(1, 5), [2, 5])
+        self.assertEqual(len(graph.select_leaders(1, 5, RANDOM)), 2)
+        with self.assertRaises(ValueError):
+            graph.select_leaders(1, 1, "unknown")
+
+    def test_active_leaders(self):
+        """Unittest for selecting leaders weighted by their activity."""
+        graph = MovementGraph(0)
+        for user_id in range(1, 5):
+            graph.add_member(user_id)
+        now = datetime.fromtimestamp(graph.epoch)
+        for _ in range(50):
+            graph.add_signal(2, now)
+        graph.add_signal(3, now - timedelta(seconds=ACTIVITY_HALF_LIFE))
+
+        self.assertAlmostEqual(graph.activity_of(2, graph.epoch), 50)
+        self.assertAlmostEqual(graph.activity_of(3, graph.epoch), 0.5)
+        self.assertAlmostEqual(
+            graph.activity_of(2, graph.epoch + ACTIVITY_HALF_LIFE), 25
+        )
+
+        picks = [graph.active_leaders(1, 1)[0] for _ in range(200)]
+        self.assertGreater(picks.count(2), 150)
+        self.assertEqual(sorted(graph.active_leaders(1, 5)), [2, 3, 4])
+        self.assertEqual(
+            graph.select_leaders(1, 1, ACTIVE, exclude=[3, 4]), [2]
+        )
+
+        graph.add_link(1, 2)
+        self.assertNotIn(2, graph.select_leaders(1, 3, ACTIVE))
+
+    def test_active_leaders_old_epoch(self):
+        """Unittest for activity weights not growing with the graph age."""
+        random.seed(0)
+        graph = MovementGraph(0)
+        graph.epoch = time.time() - 10 * ACTIVITY_HALF_LIFE
+        for user_id in range(1, 6):
+            graph.add_member(user_id)
+        graph.add_signal(2, datetime.now())
+
+        # One signal sent now doubles the weight of 2 over 3, 4 and 5.
+        picks = [graph.active_leaders(1, 1)[0] for _ in range(1000)]
+        self.assertAlmostEqual(picks.count(2) / 1000, 0.4, delta=0.05)
+
+    def test_send_signal(self):
+        """Unittest for send_signal feeding the activity of a graph."""
+        movement_id, (u1, u2, u3) = self.create_network(3)
+        graph = get_graph(movement_id, self.session)
+        self.assertEqual(graph.activity_of(u2), 0)
+
+        send_signal(u2, movement_id)
+        self.assertIs(get_graph(movement_id, self.session), graph)
+        self.assertAlmostEqual(graph.activity_of(u2), 1, places=3)
+
+        invalidate(movement_id)
+        graph = get_graph(movement_id, self.session)
+        self.assertAlmostEqual(graph.activity_of(u2), 1, places=3)
+
+    def test_record(self):
+        """Unittest for keeping a graph valid across commits."""
+        movement_id, (u1, u2, u3) = self.create_network(3)
+        graph = get_graph(movement_id, self.session)
+        version = Versions.get_graph_version(movement_id, self.session)
+
+        link = UserToUserLink(
+            self.session.get(Movement, movement_id),
+            self.session.get(User, u3),
+            self.session.get(User, u1),
+        )
+        self.session.add(link)
+        record(self.session, movement_id, created=[(u3, u1)])
+        self.assertIn(u1, graph.leaders[u3])
+        self.session.commit()
+        self.assertNotEqual(
+            Versions.get_graph_version(movement_id, self.session), version
+        )
+        self.assertIs(get_graph(movement_id, self.session), graph)
+
+        link.destroyed = datetime.now()
+        self.session.flush()
+        record(self.session, movement_id, destroyed=[(u3, u1)])
+        self.assertEqual(graph.leaders[u3], set())
+        self.session.rollback()
+        graph = get_graph(movement_id, self.session)
+        self.assertEqual(graph.leaders[u3], {u1})
+
+    def test_controllers(self):
+        """Unittest for graphs following subscriptions and direct writes."""
+        movement_id, (u1, u2, u3) = self.create_network(3)
+        user = self.create_user()
+        self.session.commit()
+        user_id = user.id
+
+        graph = get_graph(movement_id, self.session)
+        new_subscription(user_id, movement_id)
+        graph = get_graph(movement_id, self.session)
+        self.assertIn(user_id, graph.members)
+        self.assertEqual(graph.leader_count(user_id), 3)
+
+        remove_subscription(user_id, movement_id)
+        graph = get_graph(movement_id, self.session)
+        self.assertNotIn(user_id, graph.members)
+        self.assertEqual(graph.followers[user_id], set())
+
+        # Links flushed without record are picked up after the commit.
+        self.session.add(UserToUserLink(
+            self.session.get(Movement, movement_id),
+            self.session.get(User, u3),
+            self.session.get(User, u1),
+        ))
+        self.session.commit()
+        graph = get_graph(movement_id, self.session)
+        self.assertIn(u1, graph.leaders[u3])
+
+    def test_outside_writes(self):
+        """Unittest for graphs following writes made outside the library."""
+        movement_id, (u1, u2, u3) = self.create_network(3)
+        outsider = self.create_user()
+        newcomer = self.create_user()
+        self.session.commit()
+        outsider_id, newcomer_id = outsider.id, newcomer.id
+        graph = get_graph(movement_id, self.session)
+        self.session.commit()
+
+        # Like another process, plain SQL bypasses record and the session.
+        self.session.execute(text(
+            "INSERT INTO MovementUserRelation "
+            "(type, time_added, user_id, movement_id) "
+            "VALUES ('subscription', :now, :user_id, :movement_id)"
+        ), {"now": datetime.now(), "user_id": outsider_id,
+            "movement_id": movement_id})
+        self.session.execute(text(
+            "UPDATE MovementUserRelation SET time_removed = :now "
+            "WHERE user_id = :user_id AND movement_id = :movement_id"
+        ), {"now": datetime.now(), "user_id": u3, "movement_id": movement_id})
+        self.session.commit()
+
+        new_subscription(newcomer_id, movement_id)
+        graph = get_graph(movement_id, self.session)
+        self.assertEqual(graph.leaders[newcomer_id], {u1, u2, outsider_id})
+
+
+class EngineThreadTests(FileDatabaseTest):
+    """Unittests for graphs used from several threads."""
+
+    def test_uncommitted_changes(self):
+        """Unittest for readers waiting for changes to be committed."""
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(2)]
+        for user in users:
+            self.create_subscription(movement, user)
+        self.session.commit()
+        movement_id = movement.id
+        u1, u2 = [user.id for user in users]
+        self.session.close()
+
+        changed = threading.Event()
+        release = threading.Event()
+        seen = []
+
+        def write():
+            try:
+                with movement_scope(movement_id) as session:
+                    get_graph(movement_id, session)
+                    session.execute(insert(UserToUserLink), [{
+                        "movement_id": movement_id,
+                        "follower_id": u1,
+                        "leader_id": u2,
+                        "created": datetime.now(),
+                    }])
+                    record(session, movement_id, created=[(u1, u2)])
+                    changed.set()
+                    release.wait(10)
+            finally:
+                Session.remove()
+
+        def read():
+            try:
+                with session_scope() as session:
+                    graph = get_graph(movement_id, session)
+                    seen.append(set(graph.leaders[u1]))
+            finally:
+                Session.remove()
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        changed.wait(10)
+        reader = threading.Thread(target=read)
+        reader.start()
+        reader.join(0.5)
+        self.assertEqual(seen, [])
+
+        release.set()
+        writer.join(10)
+        reader.join(10)
+        self.assertEqual(seen, [{u2}])
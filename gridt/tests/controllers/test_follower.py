@@ -1,6 +1,10 @@
 """Test for follower controller."""
+import os
+import time
 from freezegun import freeze_time
+from unittest import skipUnless
 from unittest.mock import patch
+from sqlalchemy import insert
 from gridt.tests.basetest import BaseTest
 from gridt.models import User, Movement, UserToUserLink
 from gridt.models import Subscription as SUB
@@ -14,8 +18,11 @@ from gridt.controllers.follower import (
     get_leaders
 )
 from gridt.controllers.leader import send_signal
+from gridt.controllers.subscription import bulk_subscribe
 from datetime import datetime
 
+BENCHMARK = os.getenv("GRIDT_BENCHMARK")
+
 
 class TestLeaderlessFollowers(BaseTest):
     """Test for adding a follower to a movement."""
@@ -226,6 +233,35 @@ class OnSubscriptionEventsFollowerTests(BaseTest):
             UserToUserLink.destroyed.is_(None),
         ).count(), 4)
 
+    def test_add_initial_leaders_balanced(self):
+        """
+        Unittest for add_initial_leaders preferring unpopular leaders.
+
+        movement:
+            1 -> 2   3 -> 2   4 -> 2   1 -> 3   6 -> 4   f
+        """
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(6)]
+        follower = self.create_user()
+        for user in users + [follower]:
+            self.create_subscription(movement, user)
+        for f, l in [(0, 1), (2, 1), (3, 1), (0, 2), (5, 3)]:
+            self.session.add(UserToUserLink(movement, users[f], users[l]))
+        self.session.commit()
+        movement_id = movement.id
+        follower_id = follower.id
+        user_ids = [user.id for user in users]
+
+        add_initial_leaders(follower_id, movement_id, strategy="balanced")
+        leader_ids = {
+            link.leader_id for link in self.session.query(UserToUserLink)
+            .filter_by(follower_id=follower_id, movement_id=movement_id)
+        }
+        # 2 has three followers, 3 and 4 have one, the others have none.
+        self.assertEqual(
+            leader_ids, {user_ids[0], user_ids[2], user_ids[4], user_ids[5]}
+        )
+
     def test_remove_all_leaders(self):
         """Unittest for remove_all_leaders."""
         follower = self.create_user()
@@ -616,6 +652,97 @@ class SwapTest(BaseTest):
         self.assertIsNone(swap_leader(user1.id, movement2.id, user5.id))
 
 
+class SwapScalingTest(BaseTest):
+    """Test for the cost of swapping leaders in large movements."""
+
+    def create_wired_movement(self, size):
+        """Create a movement with size members that are wired already."""
+        movement = self.create_movement()
+        self.session.commit()
+        movement_id = movement.id
+        offset = self.session.query(User).count()
+        self.session.execute(insert(User), [
+            {
+                "username": f"user{offset + i}",
+                "email": f"user{offset + i}@test.com",
+                "password_hash": "",
+                "is_admin": False,
+                "bio": "",
+            }
+            for i in range(size)
+        ])
+        user_ids = [
+            user_id for user_id, in self.session.query(User.id).filter(
+                User.id > offset
+            ).order_by(User.id)
+        ]
+        self.session.commit()
+        self.session.close()
+        bulk_subscribe(movement_id, user_ids)
+        for user_id in user_ids[:size // 2]:
+            send_signal(user_id, movement_id, "Hello")
+        return movement_id, user_ids
+
+    def some_leader(self, follower_id, movement_id):
+        """Find a leader of a follower."""
+        leader_id = self.session.query(UserToUserLink.leader_id).filter(
+            UserToUserLink.movement_id == movement_id,
+            UserToUserLink.follower_id == follower_id,
+            UserToUserLink.destroyed.is_(None),
+        ).first()[0]
+        self.session.close()
+        return leader_id
+
+    def test_swap_statement_count(self):
+        """Unittest for swap_leader not querying per member."""
+        small_id, small_users = self.create_wired_movement(6)
+        large_id, large_users = self.create_wired_movement(200)
+
+        counts = []
+        for movement_id, user_ids in (
+            (small_id, small_users), (large_id, large_users)
+        ):
+            follower_id = user_ids[0]
+            leader_id = self.some_leader(follower_id, movement_id)
+            with self.count_statements() as statements:
+                new_leader = swap_leader(follower_id, movement_id, leader_id)
+            counts.append(len(statements))
+
+            self.assertNotIn(new_leader["id"], (follower_id, leader_id))
+            leaders = {
+                leader_id for leader_id, in self.session.query(
+                    UserToUserLink.leader_id
+                ).filter(
+                    UserToUserLink.movement_id == movement_id,
+                    UserToUserLink.follower_id == follower_id,
+                    UserToUserLink.destroyed.is_(None),
+                )
+            }
+            self.session.close()
+            self.assertEqual(len(leaders), 4)
+            self.assertIn(new_leader["id"], leaders)
+            self.assertNotIn(leader_id, leaders)
+
+        self.assertEqual(counts[0], counts[1])
+
+    @skipUnless(BENCHMARK, "Set GRIDT_BENCHMARK to run benchmarks.")
+    def test_swap_latency(self):
+        """Benchmark the latency of swap_leader with growing movements."""
+        for size in (100, 1000, 10000):
+            movement_id, user_ids = self.create_wired_movement(size)
+            follower_ids = user_ids[:100]
+            leader_ids = [
+                self.some_leader(follower_id, movement_id)
+                for follower_id in follower_ids
+            ]
+
+            start = time.perf_counter()
+            for follower_id, leader_id in zip(follower_ids, leader_ids):
+                swap_leader(follower_id, movement_id, leader_id)
+            latency = (time.perf_counter() - start) / len(follower_ids)
+            print(f"\n{size} members: {latency * 1000:.2f} ms/swap")
+
+
 class TestGetLeaders(BaseTest):
     """Test get_leaders."""
 
@@ -7,6 +7,7 @@ from gridt.controllers.leader import (
     add_initial_followers,
     remove_all_followers,
     possible_leaders,
+    sample_possible_leaders,
     get_last_signal
 )
 from freezegun import freeze_time
@@ -250,6 +251,36 @@ class TestPossibleLeaders(BaseTest):
             {user2, user4},
         )
 
+    def test_sample_possible_leaders(self):
+        """
+        Unittest for sample_possible_leaders.
+
+        movement1:
+            1 -> 2   3   4   5   6
+        """
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(6)]
+        for user in users:
+            self.create_subscription(movement, user)
+        self.session.add(UserToUserLink(movement, users[0], users[1]))
+        self.session.commit()
+
+        candidates = set(users[2:])
+        for _ in range(10):
+            sample = sample_possible_leaders(
+                users[0], movement, 2, self.session
+            )
+            self.assertEqual(len(sample), 2)
+            self.assertLessEqual(set(sample), candidates)
+
+        self.assertEqual(
+            set(sample_possible_leaders(users[0], movement, 10, self.session)),
+            candidates,
+        )
+        self.assertEqual(
+            sample_possible_leaders(users[0], movement, 0, self.session), []
+        )
+
 
 class LeaderControllersTest(BaseTest):
     """Unittest for leader signals."""
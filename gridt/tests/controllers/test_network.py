@@ -5,15 +5,35 @@ from gridt.controllers.user import (
     register,
     verify_password_for_email,
 )
-from gridt.controllers.network import get_network_data
+from gridt.controllers.network import (
+    get_network_data,
+    iter_network_data,
+    get_network_arrays,
+    save_network_arrays,
+    get_network_version,
+    get_network_snapshot,
+    get_network_data_if_modified,
+    get_network_changes,
+    get_network_data_at,
+    iter_network_data_between,
+    get_network_statistics,
+    get_ego_network,
+    get_network_data_many,
+    get_network_layout,
+    NO_SIGNAL,
+)
 from gridt.controllers.creation import new_movement_by_user
 from gridt.controllers.subscription import new_subscription
 from gridt.controllers.leader import send_signal
-from gridt.models import UserToUserLink
+from gridt.controllers import versions as Versions
+from gridt.models import UserToUserLink, Signal
+from gridt.util.npy import load_npz
 
 from freezegun import freeze_time
-from datetime import datetime
+from datetime import datetime, timedelta
 from itertools import combinations
+from sqlalchemy import text
+from io import BytesIO
 
 
 class NetworkControllerUnitTests(BaseTest):
@@ -63,6 +83,463 @@ class NetworkControllerUnitTests(BaseTest):
         }
         self.assertEqual(get_network_data(movement_id), expected)
 
+    def test_iter_network_data(self):
+        """Unittest for iter_network_data streaming in batches."""
+        movement = self.create_movement()
+        users = []
+        for _ in range(5):
+            user = self.create_user()
+            self.create_subscription(movement, user)
+            users.append(user)
+        for i in range(5):
+            link = UserToUserLink(movement, users[i], users[(i + 1) % 5])
+            self.session.add(link)
+        self.session.commit()
+        movement_id = movement.id
+
+        streamed = {'edges': [], 'nodes': []}
+        for kind, batch in iter_network_data(movement_id, chunk_size=2):
+            self.assertLessEqual(len(batch), 2)
+            self.assertGreater(len(batch), 0)
+            streamed[kind].extend(batch)
+
+        self.assertEqual(streamed, get_network_data(movement_id))
+
+    def test_get_network_arrays(self):
+        """
+        Unittest for get_network_arrays.
+
+        1 -> 2, 1 -> 3, 3 -> 1, 3 -> 4 where 4 is not subscribed.
+        """
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(4)]
+        for user in users[:3]:
+            self.create_subscription(movement, user)
+        self.session.add_all([
+            UserToUserLink(movement, users[2], users[0]),
+            UserToUserLink(movement, users[0], users[2]),
+            UserToUserLink(movement, users[0], users[1]),
+            UserToUserLink(movement, users[2], users[3]),
+        ])
+        self.session.commit()
+        movement_id = movement.id
+        user_ids = [user.id for user in users]
+
+        signal_time = datetime(2023, 4, 7, 17, 0)
+        with freeze_time(signal_time):
+            send_signal(user_ids[1], movement_id)
+
+        arrays = get_network_arrays(movement_id)
+        expected = {
+            'follower_ids': [user_ids[0], user_ids[0], user_ids[2]],
+            'leader_ids': [user_ids[1], user_ids[2], user_ids[0]],
+            'node_ids': user_ids[:3],
+            'last_signal': [
+                NO_SIGNAL, int(signal_time.timestamp()), NO_SIGNAL
+            ],
+            'indptr': [0, 2, 2, 3],
+            'indices': [1, 2, 0],
+        }
+        self.assertEqual(
+            {name: list(values) for name, values in arrays.items()},
+            expected
+        )
+
+        file = BytesIO()
+        save_network_arrays(movement_id, file)
+        file.seek(0)
+        self.assertEqual(load_npz(file), arrays)
+
+    def test_get_network_snapshot(self):
+        """Unittest for get_network_snapshot invalidated by controllers."""
+        movement = self.create_movement()
+        u1 = self.create_user()
+        u2 = self.create_user()
+        self.create_subscription(movement, u1)
+        self.session.commit()
+        movement_id = movement.id
+        u1_id = u1.id
+        u2_id = u2.id
+
+        version, data = get_network_snapshot(movement_id)
+        self.assertEqual(version, get_network_version(movement_id))
+        self.assertEqual(data, {'edges': [], 'nodes': [(u1_id, None)]})
+        self.assertIsNone(get_network_data_if_modified(movement_id, version))
+
+        # Subscriptions and links flushed through any session are seen.
+        self.create_subscription(movement, u2)
+        self.session.commit()
+        version, data = get_network_snapshot(movement_id)
+        self.assertEqual([node for node, _ in data['nodes']], [u1_id, u2_id])
+
+        # Signals do not write to the movement, but do change the version.
+        graph_version = Versions.get_graph_version(movement_id)
+        send_signal(u2_id, movement_id)
+        self.assertEqual(
+            Versions.get_graph_version(movement_id), graph_version
+        )
+        new_version, new_data = get_network_data_if_modified(
+            movement_id, version
+        )
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(new_data, get_network_data(movement_id))
+
+        # Writes by other processes or plain SQL change the version as well.
+        self.session.execute(text(
+            "INSERT INTO signals (leader_id, movement_id, time_stamp) "
+            "VALUES (:user_id, :movement_id, :now)"
+        ), {"user_id": u1_id, "movement_id": movement_id,
+            "now": datetime.now()})
+        self.session.commit()
+        self.assertIsNotNone(
+            get_network_data_if_modified(movement_id, new_version)
+        )
+
+    def test_get_network_changes(self):
+        """
+        Unittest for get_network_changes.
+
+        before: 1 -> 2 -> 3, 3 has signaled
+        after:  1 -> 3, 4 joined and signaled, 3 left, 2 signaled
+        """
+        before = datetime(2023, 4, 7, 17, 0)
+        since = datetime(2023, 4, 7, 17, 30)
+        after = datetime(2023, 4, 7, 18, 0)
+
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(4)]
+        with freeze_time(before):
+            subscriptions = [
+                self.create_subscription(movement, user)
+                for user in users[:3]
+            ]
+            link_1_2 = UserToUserLink(movement, users[0], users[1])
+            self.session.add_all([
+                link_1_2,
+                UserToUserLink(movement, users[1], users[2]),
+                Signal(users[2], movement),
+            ])
+        with freeze_time(after):
+            link_1_2.destroy()
+            subscriptions[2].end()
+            self.create_subscription(movement, users[3])
+            short_link = UserToUserLink(movement, users[3], users[0])
+            short_link.destroy()
+            self.session.add_all([
+                short_link,
+                UserToUserLink(movement, users[0], users[2]),
+                Signal(users[1], movement, "Hello"),
+                Signal(users[3], movement),
+            ])
+        self.session.commit()
+        movement_id = movement.id
+        u1, u2, u3, u4 = [user.id for user in users]
+
+        self.assertEqual(get_network_changes(movement_id, since), {
+            'edges_added': [(u1, u3)],
+            'edges_removed': [(u1, u2)],
+            'nodes_added': [(u4, {'time_stamp': str(after.astimezone())})],
+            'nodes_removed': [u3],
+            'nodes_changed': [(u2, {
+                'time_stamp': str(after.astimezone()), 'message': "Hello"
+            })],
+        })
+        self.assertEqual(get_network_changes(movement_id, after), {
+            'edges_added': [],
+            'edges_removed': [],
+            'nodes_added': [],
+            'nodes_removed': [],
+            'nodes_changed': [],
+        })
+
+    def test_get_network_data_at(self):
+        """
+        Unittest for get_network_data_at and iter_network_data_between.
+
+        09:00 1 and 2 join, 1 -> 2
+        10:00 2 signals, 3 joins, 3 -> 1
+        11:00 1 leaves, links to 1 are destroyed
+        """
+        nine = datetime(2023, 4, 7, 9, 0)
+        ten = datetime(2023, 4, 7, 10, 0)
+        eleven = datetime(2023, 4, 7, 11, 0)
+
+        movement = self.create_movement()
+        u1, u2, u3 = [self.create_user() for _ in range(3)]
+        with freeze_time(nine):
+            sub1 = self.create_subscription(movement, u1)
+            self.create_subscription(movement, u2)
+            link_1_2 = UserToUserLink(movement, u1, u2)
+        with freeze_time(ten):
+            self.create_subscription(movement, u3)
+            link_3_1 = UserToUserLink(movement, u3, u1)
+            signal = Signal(u2, movement)
+        with freeze_time(eleven):
+            sub1.end()
+            link_1_2.destroy()
+            link_3_1.destroy()
+        self.session.add_all([link_1_2, link_3_1, signal])
+        self.session.commit()
+        movement_id = movement.id
+        u1_id, u2_id, u3_id = u1.id, u2.id, u3.id
+        signal_json = {'time_stamp': str(ten.astimezone())}
+
+        expected = {
+            nine - timedelta(minutes=30): {'edges': [], 'nodes': []},
+            nine: {
+                'edges': [(u1_id, u2_id)],
+                'nodes': [(u1_id, None), (u2_id, None)],
+            },
+            ten: {
+                'edges': [(u1_id, u2_id), (u3_id, u1_id)],
+                'nodes': [
+                    (u1_id, None), (u2_id, signal_json), (u3_id, None)
+                ],
+            },
+            eleven: {
+                'edges': [],
+                'nodes': [(u2_id, signal_json), (u3_id, None)],
+            },
+        }
+        for moment, data in expected.items():
+            self.assertEqual(get_network_data_at(movement_id, moment), data)
+
+        start = nine - timedelta(minutes=30)
+        replayed = list(iter_network_data_between(
+            movement_id, start, eleven, timedelta(minutes=30)
+        ))
+        self.assertEqual(
+            [moment for moment, _ in replayed],
+            [start + timedelta(minutes=30) * i for i in range(6)],
+        )
+        for moment, data in replayed:
+            self.assertEqual(
+                data, get_network_data_at(movement_id, moment), moment
+            )
+
+    def test_get_network_statistics(self):
+        """
+        Unittest for get_network_statistics.
+
+        1 <-> 2, 1 -> 3, 4 -> 5
+        """
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(5)]
+        for user in users:
+            self.create_subscription(movement, user)
+        for follower, leader in [(0, 1), (1, 0), (0, 2), (3, 4)]:
+            self.session.add(
+                UserToUserLink(movement, users[follower], users[leader])
+            )
+        self.session.commit()
+
+        self.assertEqual(get_network_statistics(movement.id), {
+            'nodes': 5,
+            'edges': 4,
+            'in_degrees': {0: 1, 1: 4},
+            'out_degrees': {0: 2, 1: 2, 2: 1},
+            'underled_followers': 5,
+            'followerless_leaders': 1,
+            'components': 2,
+            'reciprocity': 0.5,
+        })
+
+    def test_get_network_statistics_empty(self):
+        """Unittest for get_network_statistics case empty."""
+        movement = self.create_movement()
+        self.session.commit()
+
+        self.assertEqual(get_network_statistics(movement.id), {
+            'nodes': 0,
+            'edges': 0,
+            'in_degrees': {},
+            'out_degrees': {},
+            'underled_followers': 0,
+            'followerless_leaders': 0,
+            'components': 0,
+            'reciprocity': 0.0,
+        })
+
+    def test_get_ego_network(self):
+        """
+        Unittest for get_ego_network around user 2.
+
+        movement A: 1 -> 2 <-> 3 -> 4 -> 5, 1 -> 3
+        movement B: 2
+        movement C: 1 -> 2, but 2 is not subscribed
+        """
+        mA, mB, mC = [self.create_movement() for _ in range(3)]
+        users = [self.create_user() for _ in range(5)]
+        for user in users:
+            self.create_subscription(mA, user)
+        self.create_subscription(mB, users[1])
+        self.create_subscription(mC, users[0])
+        for follower, leader in [(0, 1), (1, 2), (2, 1), (2, 3), (3, 4),
+                                 (0, 2)]:
+            self.session.add(
+                UserToUserLink(mA, users[follower], users[leader])
+            )
+        self.session.add(UserToUserLink(mC, users[0], users[1]))
+        self.session.commit()
+        u1, u2, u3, u4, _ = [user.id for user in users]
+        mA_id, mB_id = mA.id, mB.id
+
+        signal_time = datetime(2023, 4, 7, 17, 0)
+        with freeze_time(signal_time):
+            send_signal(u1, mA_id)
+            send_signal(u2, mB_id)
+        signal_json = {'time_stamp': str(signal_time.astimezone())}
+
+        self.assertEqual(get_ego_network(u2), {
+            mA_id: {
+                'edges': [(u1, u2), (u2, u3), (u3, u2), (u1, u3)],
+                'nodes': [(u1, signal_json), (u2, None), (u3, None)],
+            },
+            mB_id: {'edges': [], 'nodes': [(u2, signal_json)]},
+        })
+        self.assertEqual(get_ego_network(u2, depth=2)[mA_id], {
+            'edges': [(u1, u2), (u2, u3), (u3, u2), (u3, u4), (u1, u3)],
+            'nodes': [(u1, signal_json), (u2, None), (u3, None), (u4, None)],
+        })
+
+    def test_get_network_data_many(self):
+        """Unittest for get_network_data_many."""
+        movements = [self.create_movement() for _ in range(3)]
+        users = [self.create_user() for _ in range(4)]
+        for i, user in enumerate(users):
+            self.create_subscription(movements[0], user)
+            self.session.add(
+                UserToUserLink(movements[0], user, users[(i + 1) % 4])
+            )
+        for user in users[2:]:
+            self.create_subscription(movements[1], user)
+        self.session.add(UserToUserLink(movements[1], users[2], users[3]))
+        self.session.commit()
+        movement_ids = [movement.id for movement in movements]
+        user_id = users[3].id
+        send_signal(user_id, movement_ids[1], "Hello")
+
+        self.assertEqual(
+            get_network_data_many(movement_ids),
+            {
+                movement_id: get_network_data(movement_id)
+                for movement_id in movement_ids
+            }
+        )
+        self.assertEqual(get_network_data_many([]), {})
+
+    def test_get_network_layout(self):
+        """
+        Unittest for get_network_layout.
+
+        Two fully connected groups 1, 2, 3 and 4, 5, 6 with the link 3 -> 4.
+        """
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(6)]
+        for user in users:
+            self.create_subscription(movement, user)
+        for group in (users[:3], users[3:]):
+            for follower, leader in combinations(group, 2):
+                self.session.add_all([
+                    UserToUserLink(movement, follower, leader),
+                    UserToUserLink(movement, leader, follower),
+                ])
+        self.session.add(UserToUserLink(movement, users[2], users[3]))
+        self.session.commit()
+        movement_id = movement.id
+        user_ids = [user.id for user in users]
+
+        version, layout = get_network_layout(movement_id)
+        self.assertEqual(version, Versions.get_graph_version(movement_id))
+        self.assertEqual(sorted(layout), user_ids)
+        for x, y in layout.values():
+            self.assertLessEqual(abs(x), 1)
+            self.assertLessEqual(abs(y), 1)
+
+        # The groups end up on opposite sides of the drawing.
+        first = {layout[user_id][0] > 0 for user_id in user_ids[:3]}
+        second = {layout[user_id][0] > 0 for user_id in user_ids[3:]}
+        self.assertEqual(len(first), 1)
+        self.assertEqual(first, {not side for side in second})
+
+        self.assertIs(get_network_layout(movement_id)[1], layout)
+
+        # Signals do not move the nodes, so the layout is kept.
+        send_signal(user_ids[0], movement_id)
+        self.assertIs(get_network_layout(movement_id)[1], layout)
+
+        # Replacing the link 3 -> 4 starts from the previous coordinates.
+        bridge = self.session.query(UserToUserLink).filter(
+            UserToUserLink.follower_id == user_ids[2],
+            UserToUserLink.leader_id == user_ids[3],
+        ).one()
+        bridge.destroyed = datetime.now()
+        self.session.add(UserToUserLink(
+            bridge.movement, bridge.follower, bridge.leader
+        ))
+        self.session.commit()
+        new_version, new_layout = get_network_layout(movement_id)
+        self.assertNotEqual(new_version, version)
+        for user_id in user_ids:
+            for old, new in zip(layout[user_id], new_layout[user_id]):
+                self.assertAlmostEqual(old, new, places=3)
+
+    def test_get_network_data_last_signal(self):
+        """Unittest for get_network data picking the last signal."""
+        movement = self.create_movement()
+        other_movement = self.create_movement()
+        user = self.create_user()
+        self.create_subscription(movement, user)
+        self.create_subscription(other_movement, user)
+        self.session.commit()
+
+        movement_id = movement.id
+        other_movement_id = other_movement.id
+        user_id = user.id
+
+        earlier = datetime(2023, 4, 7, 17, 0)
+        later = datetime(2023, 4, 7, 17, 30)
+        latest = datetime(2023, 4, 7, 18, 0)
+        with freeze_time(earlier):
+            send_signal(user_id, movement_id, message="first")
+        with freeze_time(later):
+            send_signal(user_id, movement_id, message="second")
+        with freeze_time(latest):
+            send_signal(user_id, other_movement_id, message="elsewhere")
+
+        node_data = {
+            'message': "second", 'time_stamp': str(later.astimezone())
+        }
+        expected = {'edges': [], 'nodes': [(user_id, node_data)]}
+        self.assertEqual(get_network_data(movement_id), expected)
+
+    def test_get_network_data_query_count(self):
+        """Unittest for get_network data not querying per user."""
+        def count_network_queries(movement_id):
+            with self.count_statements() as statements:
+                get_network_data(movement_id)
+            return len(statements)
+
+        small = self.create_movement()
+        large = self.create_movement()
+        users = [self.create_user() for _ in range(6)]
+        self.create_subscription(small, users[0])
+        for i, user in enumerate(users):
+            self.create_subscription(large, user)
+            leader = users[(i + 1) % len(users)]
+            self.session.add(UserToUserLink(large, user, leader))
+        self.session.commit()
+
+        small_id = small.id
+        large_id = large.id
+        user_ids = [user.id for user in users]
+        for user_id in user_ids:
+            send_signal(user_id, large_id)
+
+        self.assertEqual(
+            count_network_queries(small_id), count_network_queries(large_id)
+        )
+
 
 class TestUserStoriesNetworkController(BaseTest):
     """Network data related user stories."""
@@ -0,0 +1,103 @@
+"""Test for the rebalance controller."""
+from unittest.mock import patch
+
+from gridt.tests.basetest import BaseTest
+
+from gridt.controllers.engine import get_graph
+from gridt.controllers.rebalance import rebalance
+from gridt.models import UserToUserLink
+
+
+class RebalanceControllerUnitTests(BaseTest):
+    """Unittests for rebalance controller."""
+
+    def create_star(self, size):
+        """Create a movement where every member follows the first one."""
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(size)]
+        for user in users:
+            self.create_subscription(movement, user)
+        for user in users[1:]:
+            self.session.add(UserToUserLink(movement, user, users[0]))
+        self.session.commit()
+        return movement.id, [user.id for user in users]
+
+    def links(self, movement_id):
+        """Get the active links of a movement."""
+        return {
+            (link.follower_id, link.leader_id)
+            for link in self.session.query(UserToUserLink).filter(
+                UserToUserLink.movement_id == movement_id,
+                UserToUserLink.destroyed.is_(None),
+            )
+        }
+
+    def test_dry_run(self):
+        """Unittest for rebalance only reporting the planned changes."""
+        movement_id, user_ids = self.create_star(8)
+        before = self.links(movement_id)
+
+        with patch(
+            "gridt.controllers.rebalance.movement_scope"
+        ) as movement_scope:
+            report = rebalance(movement_id, dry_run=True)
+        movement_scope.assert_not_called()
+        self.assertTrue(report["dry_run"])
+        self.assertEqual(self.links(movement_id), before)
+
+        self.assertEqual(report["before"]["edges"], 7)
+        self.assertEqual(report["before"]["underled_followers"], 8)
+        self.assertEqual(report["before"]["max_followers"], 7)
+        self.assertEqual(report["after"]["edges"], 32)
+        self.assertEqual(report["after"]["underled_followers"], 0)
+        self.assertEqual(report["after"]["in_degrees"], {4: 8})
+        self.assertEqual(report["after"]["follower_stddev"], 0)
+
+        planned = (
+            before - set(report["edges_removed"]) | set(report["edges_added"])
+        )
+        self.assertEqual(len(planned), 32)
+        for follower_id, leader_id in planned:
+            self.assertNotEqual(follower_id, leader_id)
+
+    def test_rebalance(self):
+        """Unittest for rebalance applying at most max_changes changes."""
+        movement_id, user_ids = self.create_star(8)
+        before = self.links(movement_id)
+
+        report = rebalance(movement_id, max_changes=5)
+        self.assertFalse(report["dry_run"])
+        changes = len(report["edges_added"]) + len(report["edges_removed"])
+        self.assertLessEqual(changes, 5)
+        self.assertEqual(
+            self.links(movement_id),
+            before - set(report["edges_removed"]) | set(report["edges_added"])
+        )
+
+        report = rebalance(movement_id)
+        self.assertEqual(report["after"]["in_degrees"], {4: 8})
+        after = self.links(movement_id)
+        self.assertEqual(len(after), 32)
+
+        report = rebalance(movement_id)
+        self.assertEqual(report["edges_added"], [])
+        self.assertEqual(report["edges_removed"], [])
+        self.assertEqual(self.links(movement_id), after)
+
+    def test_rebalance_graph(self):
+        """Unittest for rebalance keeping the graph in memory up to date."""
+        movement_id, user_ids = self.create_star(8)
+        graph = get_graph(movement_id, self.session)
+        self.session.commit()
+
+        report = rebalance(movement_id, max_changes=5)
+        self.assertIs(get_graph(movement_id, self.session), graph)
+        self.assertEqual(
+            {
+                (follower_id, leader_id)
+                for follower_id, leader_ids in graph.leaders.items()
+                for leader_id in leader_ids
+            },
+            self.links(movement_id),
+        )
+        self.assertTrue(report["edges_added"])
@@ -0,0 +1,256 @@
+"""Test for the rewiring controller."""
+import random
+from unittest.mock import patch
+
+from gridt.tests.basetest import BaseTest
+
+from gridt.controllers.engine import MovementGraph
+from gridt.controllers.helpers import movement_scope
+from gridt.controllers.rewiring import (
+    assign_leaders,
+    get_adoption_backlog,
+    process_adoptions,
+    _process_adoptions,
+    get_rewiring_backlog,
+    process_rewiring,
+    _process_rewiring,
+)
+from gridt.controllers.subscription import (
+    new_subscription,
+    remove_subscription,
+)
+from gridt.models import QueuedUser, UserToUserLink
+
+
+class AdoptionTests(BaseTest):
+    """Unittests for the adoption queue."""
+
+    def test_bounded_adoption(self):
+        """
+        Unittest for adopting followers in the background.
+
+        Ten members without leaders, then a and b join adopting two
+        followers each right away.
+        """
+        movement = self.create_movement()
+        members = [self.create_user() for _ in range(10)]
+        for member in members:
+            self.create_subscription(movement, member)
+        a = self.create_user()
+        b = self.create_user()
+        self.session.commit()
+        movement_id = movement.id
+        member_ids = {member.id for member in members}
+        a_id = a.id
+        b_id = b.id
+
+        def followers(leader_id):
+            return {
+                link.follower_id
+                for link in self.session.query(UserToUserLink).filter(
+                    UserToUserLink.movement_id == movement_id,
+                    UserToUserLink.leader_id == leader_id,
+                    UserToUserLink.destroyed.is_(None),
+                )
+            }
+
+        new_subscription(a_id, movement_id, max_adoptions=2)
+        self.assertEqual(len(followers(a_id)), 2)
+        self.assertEqual(get_adoption_backlog(), 8)
+
+        new_subscription(b_id, movement_id, max_adoptions=2)
+        self.assertEqual(len(followers(b_id)), 2)
+        # Members adopted by both right away are not queued.
+        backlog = 10 - len(followers(a_id) & followers(b_id) & member_ids)
+        self.assertEqual(get_adoption_backlog(), backlog)
+
+        self.assertEqual(process_adoptions(batch_size=4), 4)
+        self.assertEqual(get_adoption_backlog(), backlog - 4)
+        process_adoptions()
+        self.assertEqual(get_adoption_backlog(), 0)
+
+        a_followers = followers(a_id) & member_ids
+        b_followers = followers(b_id) & member_ids
+        self.assertEqual(a_followers | b_followers, member_ids)
+        self.assertLessEqual(abs(len(a_followers) - len(b_followers)), 2)
+        self.assertEqual(process_adoptions(), 0)
+
+    def test_adoption_rollback(self):
+        """Unittest for keeping the followers of a failed adoption."""
+        movement = self.create_movement()
+        members = [self.create_user() for _ in range(6)]
+        for member in members:
+            self.create_subscription(movement, member)
+        leader = self.create_user()
+        self.session.commit()
+        movement_id = movement.id
+        leader_id = leader.id
+
+        new_subscription(leader_id, movement_id, max_adoptions=2)
+        self.assertEqual(get_adoption_backlog(), 4)
+
+        with self.assertRaises(RuntimeError):
+            with movement_scope(movement_id) as session:
+                self.assertEqual(_process_adoptions(movement_id, session), 4)
+                self.assertEqual(get_adoption_backlog(session), 0)
+                raise RuntimeError("Fail after popping the queue.")
+        self.assertEqual(get_adoption_backlog(), 4)
+        leader_row = self.session.query(QueuedUser).filter(
+            QueuedUser.role == "leader"
+        ).one()
+        self.assertEqual(
+            (leader_row.user_id, leader_row.adopted), (leader_id, 0)
+        )
+
+        self.assertEqual(process_adoptions(), 4)
+        self.assertEqual(get_adoption_backlog(), 0)
+        followers = self.session.query(UserToUserLink).filter(
+            UserToUserLink.leader_id == leader_id,
+            UserToUserLink.destroyed.is_(None),
+        ).count()
+        self.assertEqual(followers, 6)
+
+
+class RewiringTests(BaseTest):
+    """Unittests for the rewiring queue."""
+
+    def test_deferred_leave(self):
+        """
+        Unittest for rewiring after a deferred leave.
+
+        movement:
+            1 -> 3 -> 2   4 -> 3   5
+        3 leaves.
+        """
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(5)]
+        for user in users:
+            self.create_subscription(movement, user)
+        u1, u2, u3, u4, u5 = users
+        for follower, leader in [(u1, u3), (u3, u2), (u4, u3)]:
+            self.session.add(UserToUserLink(movement, follower, leader))
+        self.session.commit()
+        movement_id = movement.id
+        ids = [user.id for user in users]
+        id1, id2, id3, id4, id5 = ids
+
+        def links():
+            return {
+                (link.follower_id, link.leader_id)
+                for link in self.session.query(UserToUserLink).filter(
+                    UserToUserLink.movement_id == movement_id,
+                    UserToUserLink.destroyed.is_(None),
+                )
+            }
+
+        remove_subscription(id3, movement_id, deferred=True)
+        self.assertEqual(links(), set())
+        self.assertEqual(get_rewiring_backlog(), 3)
+
+        self.assertEqual(process_rewiring(), 3)
+        self.assertEqual(get_rewiring_backlog(), 0)
+
+        new_links = links()
+        self.assertEqual(len(new_links), 3)
+        followers = [follower for follower, _ in new_links]
+        self.assertIn(id1, followers)
+        self.assertIn(id4, followers)
+        self.assertIn(id2, {leader for _, leader in new_links})
+        for follower, leader in new_links:
+            self.assertNotIn(id3, (follower, leader))
+            self.assertNotEqual(follower, leader)
+
+    def test_rollback(self):
+        """Unittest for keeping the queued users of a failed transaction."""
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(4)]
+        for user in users:
+            self.create_subscription(movement, user)
+        for follower, leader in zip(users, users[1:]):
+            self.session.add(UserToUserLink(movement, follower, leader))
+        self.session.commit()
+        movement_id = movement.id
+        ids = [user.id for user in users]
+
+        remove_subscription(ids[1], movement_id, deferred=True)
+        self.assertEqual(get_rewiring_backlog(), 2)
+
+        with self.assertRaises(RuntimeError):
+            with movement_scope(movement_id) as session:
+                self.assertGreater(_process_rewiring(movement_id, session), 0)
+                self.assertEqual(get_rewiring_backlog(session), 0)
+                raise RuntimeError("Fail after popping the queue.")
+
+        # The queue is in the database, so any process can drain it.
+        queued = {
+            (queued.role, queued.user_id)
+            for queued in self.session.query(QueuedUser)
+        }
+        self.assertEqual(queued, {("follower", ids[0]), ("leader", ids[2])})
+        self.assertGreater(process_rewiring(movement_id=movement_id), 0)
+        self.assertEqual(get_rewiring_backlog(), 0)
+
+
+class AssignmentTests(BaseTest):
+    """Unittests for the batch assignment of leaders."""
+
+    def test_assign_leaders(self):
+        """
+        Unittest for assign_leaders.
+
+        Leaders 1, 2 and 3 have 0, 1 and 2 followers, 4 to 9 need a leader
+        and 4 already follows 1.
+        """
+        random.seed(0)
+        graph = MovementGraph(0)
+        for user_id in range(1, 10):
+            graph.add_member(user_id)
+        graph.add_link(4, 1)
+        graph.add_link(5, 2)
+        graph.add_link(6, 3)
+        graph.add_link(7, 3)
+
+        links = assign_leaders(graph, range(4, 10), [1, 2, 3])
+        self.assertEqual(len(links), 6)
+        self.assertEqual({f for f, _ in links}, set(range(4, 10)))
+        self.assertNotIn((4, 1), links)
+        self.assertNotIn((5, 2), links)
+
+        for follower_id, leader_id in links:
+            graph.add_link(follower_id, leader_id)
+        counts = [graph.follower_count(leader) for leader in (1, 2, 3)]
+        self.assertLessEqual(max(counts) - min(counts), 1)
+
+        graph = MovementGraph(0)
+        graph.add_member(1)
+        self.assertEqual(assign_leaders(graph, [1], [1]), [])
+
+    def test_assign_leaders_from_loads(self):
+        """
+        Unittest for assign_leaders drawing the leaders from the graph.
+
+        Leaders 1 and 2 have 1 and 0 followers, 3 to 12 have 2 followers
+        each, 11 and 12 need a leader and 2 may not be chosen.
+        """
+        random.seed(0)
+        graph = MovementGraph(0)
+        for user_id in range(1, 13):
+            graph.add_member(user_id)
+        graph.add_link(3, 1)
+        for leader_id in range(3, 11):
+            graph.add_link(leader_id % 8 + 3, leader_id)
+            graph.add_link((leader_id + 1) % 8 + 3, leader_id)
+        for follower_id in range(3, 7):
+            graph.add_link(follower_id, 11 + follower_id % 2)
+        least_loaded = graph.least_loaded_leaders(11, 12)
+
+        with patch("heapq.heapify") as heapify:
+            self.assertEqual(assign_leaders(graph, [], exclude=[2]), [])
+            links = assign_leaders(graph, [11, 12], exclude=[2])
+        heapify.assert_not_called()
+        self.assertEqual(graph.least_loaded_leaders(11, 12), least_loaded)
+
+        self.assertEqual({f for f, _ in links}, {11, 12})
+        leader_ids = {leader_id for _, leader_id in links}
+        self.assertIn(1, leader_ids)
+        self.assertNotIn(2, leader_ids)
@@ -3,6 +3,8 @@ from ..basetest import BaseTest
 
 from gridt.controllers.subscription import (
     _get_subscription,
+    bulk_subscribe,
+    bulk_unsubscribe,
     _subscription_exists,
     is_subscribed,
     get_subscribers,
@@ -19,6 +21,7 @@ import gridt.exc as E
 from gridt.models import Subscription, UserToUserLink
 
 from freezegun import freeze_time
+from collections import Counter
 from datetime import datetime
 
 
@@ -98,6 +101,147 @@ class SubscriptionControllerUnitTest(BaseTest):
         )
         self.assertTrue(json_subscription['subscribed'])
 
+    def test_new_subscription_query_count(self):
+        """Unittest for new_subscription not querying per subscriber."""
+        small = self.create_movement()
+        large = self.create_movement()
+        users = [self.create_user() for _ in range(22)]
+        for user in users[:2]:
+            self.create_subscription(small, user)
+        for user in users[:20]:
+            self.create_subscription(large, user)
+        self.session.commit()
+        small_id = small.id
+        large_id = large.id
+        user_ids = [user.id for user in users]
+        self.session.close()
+
+        with self.count_statements() as small:
+            new_subscription(user_ids[20], small_id)
+        with self.count_statements() as large:
+            new_subscription(user_ids[21], large_id)
+        self.assertEqual(len(large), len(small))
+
+        links = self.session.query(UserToUserLink).filter(
+            UserToUserLink.movement_id == large_id,
+            UserToUserLink.destroyed.is_(None),
+        )
+        self.assertEqual(
+            links.filter(UserToUserLink.follower_id == user_ids[21]).count(),
+            4
+        )
+        self.assertEqual(
+            links.filter(UserToUserLink.leader_id == user_ids[21]).count(),
+            20
+        )
+
+    def test_bulk_subscribe(self):
+        """Unittest for subscribing many users at once."""
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(30)]
+        for user in users[:3]:
+            self.create_subscription(movement, user)
+        self.session.commit()
+        movement_id = movement.id
+        user_ids = [user.id for user in users]
+        self.session.close()
+
+        with self.assertRaises(E.UserNotFoundError):
+            bulk_subscribe(movement_id, user_ids[3:] + [1000])
+        self.assertEqual(len(get_subscribers(movement_id)), 3)
+
+        # Subscribed and repeated users are skipped.
+        subscribed = bulk_subscribe(
+            movement_id, user_ids[2:] + user_ids[10:12]
+        )
+        self.assertEqual(subscribed, user_ids[3:])
+        self.assertEqual(
+            sorted(user["id"] for user in get_subscribers(movement_id)),
+            user_ids,
+        )
+
+        links = [
+            (link.follower_id, link.leader_id)
+            for link in self.session.query(UserToUserLink).filter(
+                UserToUserLink.movement_id == movement_id,
+                UserToUserLink.destroyed.is_(None),
+            )
+        ]
+        self.assertEqual(len(links), len(set(links)))
+        for follower_id, leader_id in links:
+            self.assertNotEqual(follower_id, leader_id)
+        leader_counts = Counter(follower_id for follower_id, _ in links)
+        self.assertEqual(set(leader_counts), set(user_ids))
+        self.assertEqual(set(leader_counts.values()), {4})
+
+    def test_bulk_subscribe_query_count(self):
+        """Unittest for bulk_subscribe not querying per user."""
+        small = self.create_movement()
+        large = self.create_movement()
+        users = [self.create_user() for _ in range(22)]
+        self.session.commit()
+        small_id = small.id
+        large_id = large.id
+        user_ids = [user.id for user in users]
+        self.session.close()
+
+        with self.count_statements() as small:
+            bulk_subscribe(small_id, user_ids[:2])
+        with self.count_statements() as large:
+            bulk_subscribe(large_id, user_ids[2:])
+        self.assertEqual(len(large), len(small))
+
+    def test_bulk_unsubscribe(self):
+        """Unittest for unsubscribing many users at once."""
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(30)]
+        self.session.commit()
+        movement_id = movement.id
+        user_ids = [user.id for user in users]
+        self.session.close()
+        bulk_subscribe(movement_id, user_ids[:25])
+
+        # Users that are not subscribed or repeated are skipped.
+        unsubscribed = bulk_unsubscribe(
+            movement_id, user_ids[15:] + user_ids[:10] + user_ids[:2]
+        )
+        self.assertEqual(unsubscribed, user_ids[15:25] + user_ids[:10])
+        remaining = set(user_ids[10:15])
+        self.assertEqual(
+            {user["id"] for user in get_subscribers(movement_id)}, remaining
+        )
+
+        links = [
+            (link.follower_id, link.leader_id)
+            for link in self.session.query(UserToUserLink).filter(
+                UserToUserLink.movement_id == movement_id,
+                UserToUserLink.destroyed.is_(None),
+            )
+        ]
+        self.assertEqual(len(links), len(set(links)))
+        for follower_id, leader_id in links:
+            self.assertIn(follower_id, remaining)
+            self.assertIn(leader_id, remaining)
+        leader_counts = Counter(follower_id for follower_id, _ in links)
+        self.assertEqual(set(leader_counts), remaining)
+        self.assertEqual(set(leader_counts.values()), {4})
+
+    def test_bulk_unsubscribe_query_count(self):
+        """Unittest for bulk_unsubscribe not querying per user."""
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(24)]
+        self.session.commit()
+        movement_id = movement.id
+        user_ids = [user.id for user in users]
+        self.session.close()
+        bulk_subscribe(movement_id, user_ids)
+
+        with self.count_statements() as small:
+            bulk_unsubscribe(movement_id, user_ids[:2])
+        with self.count_statements() as large:
+            bulk_unsubscribe(movement_id, user_ids[2:14])
+        self.assertEqual(len(large), len(small))
+
     def test_remove_subscription(self):
         """Unittest for remove_subscription."""
         movement = self.create_movement()
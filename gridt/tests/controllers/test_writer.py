@@ -0,0 +1,200 @@
+"""Test for the single writer of the networks of movements."""
+import threading
+import uuid
+from collections import Counter
+
+from sqlalchemy.orm.exc import NoResultFound
+
+from gridt.tests.basetest import FileDatabaseTest
+from gridt.controllers import writer as Writer
+from gridt.controllers.rewiring import get_rewiring_backlog
+from gridt.models import Subscription, UserToUserLink
+
+
+class WriterTests(FileDatabaseTest):
+    """Unittests for queueing changes to the single writer."""
+
+    def tearDown(self):
+        """Stop the workers before the database file is removed."""
+        Writer.shutdown()
+        super().tearDown()
+
+    def create_members(self, size):
+        """Create a movement with users that did not join it yet."""
+        movement = self.create_movement()
+        users = [self.create_user() for _ in range(size)]
+        self.session.commit()
+        movement_id = movement.id
+        user_ids = [user.id for user in users]
+        self.session.close()
+        return movement_id, user_ids
+
+    def links(self, movement_id):
+        """Get the follower and leader ids of the links in a movement."""
+        links = [
+            (link.follower_id, link.leader_id)
+            for link in self.session.query(UserToUserLink).filter(
+                UserToUserLink.movement_id == movement_id,
+                UserToUserLink.destroyed.is_(None),
+            )
+        ]
+        self.session.close()
+        return links
+
+    def block(self, movement_id):
+        """Keep the worker of a movement busy until the event is set."""
+        event = threading.Event()
+        Writer.submit(movement_id, lambda session: event.wait(10))
+        return event
+
+    def test_new_subscription(self):
+        """Unittest for joins applied by the writer in queued order."""
+        movement_id, user_ids = self.create_members(8)
+
+        futures = [
+            Writer.new_subscription(user_id, movement_id)
+            for user_id in user_ids
+        ]
+        results = [future.result(timeout=60) for future in futures]
+
+        self.assertEqual(
+            [result["user"]["id"] for result in results], user_ids
+        )
+        self.assertEqual(
+            [result["movement"]["id"] for result in results],
+            [movement_id] * 8,
+        )
+        subscriptions = self.session.query(Subscription).order_by(
+            Subscription.id
+        )
+        self.assertEqual(
+            [subscription.user_id for subscription in subscriptions],
+            user_ids,
+        )
+        self.session.close()
+
+        links = self.links(movement_id)
+        self.assertEqual(len(links), len(set(links)))
+        leader_counts = Counter(follower for follower, _ in links)
+        self.assertEqual(set(leader_counts.values()), {4})
+
+    def test_batching(self):
+        """Unittest for consecutive changes sharing one transaction."""
+        movement_id, user_ids = self.create_members(6)
+        other_movement_id, _ = self.create_members(0)
+
+        def transaction(session):
+            return session.info.setdefault("transaction", uuid.uuid4())
+
+        event = self.block(movement_id)
+        first = [Writer.submit(movement_id, transaction) for _ in range(3)]
+        joins = [
+            Writer.new_subscription(user_id, movement_id)
+            for user_id in user_ids
+        ]
+        # Changes to another movement are never part of the batch.
+        other = Writer.submit(other_movement_id, transaction)
+        last = Writer.submit(movement_id, transaction)
+        event.set()
+
+        transactions = {future.result(timeout=60) for future in first}
+        self.assertEqual(len(transactions), 1)
+        for future in joins:
+            future.result(timeout=60)
+        self.assertNotEqual(other.result(timeout=60), last.result(timeout=60))
+        self.assertEqual(Writer.get_backlog(), 0)
+
+    def test_errors(self):
+        """Unittest for a failing change only failing its own future."""
+        movement_id, user_ids = self.create_members(6)
+        for future in [
+            Writer.new_subscription(user_id, movement_id)
+            for user_id in user_ids
+        ]:
+            future.result(timeout=60)
+        links = self.links(movement_id)
+        follower_id, leader_id = links[0]
+        not_leader_id = next(
+            user_id for user_id in user_ids
+            if user_id != follower_id
+            and (follower_id, user_id) not in links
+        )
+
+        event = self.block(movement_id)
+        failing = Writer.swap_leader(follower_id, movement_id, not_leader_id)
+        swapped = Writer.swap_leader(follower_id, movement_id, leader_id)
+        event.set()
+
+        with self.assertRaises(NoResultFound):
+            failing.result(timeout=60)
+        new_leader = swapped.result(timeout=60)
+        self.assertNotIn(new_leader["id"], (follower_id, leader_id))
+
+        links = self.links(movement_id)
+        self.assertIn((follower_id, new_leader["id"]), links)
+        self.assertNotIn((follower_id, leader_id), links)
+
+    def test_rewiring(self):
+        """Unittest for leaving and rewiring through the writer."""
+        movement_id, user_ids = self.create_members(7)
+        for future in [
+            Writer.new_subscription(user_id, movement_id)
+            for user_id in user_ids
+        ]:
+            future.result(timeout=60)
+
+        Writer.remove_subscription(
+            user_ids[0], movement_id, deferred=True
+        ).result(timeout=60)
+        self.assertGreater(get_rewiring_backlog(), 0)
+
+        # The rewiring is retried on its own when its batch fails.
+        def fail(session):
+            raise RuntimeError("Fail the batch.")
+
+        event = self.block(movement_id)
+        rewiring = Writer.process_rewiring(movement_id)
+        failing = Writer.submit(movement_id, fail)
+        event.set()
+
+        with self.assertRaises(RuntimeError):
+            failing.result(timeout=60)
+        self.assertGreater(rewiring.result(timeout=60), 0)
+        self.assertEqual(get_rewiring_backlog(), 0)
+
+        links = self.links(movement_id)
+        leader_counts = Counter(follower for follower, _ in links)
+        self.assertEqual(set(leader_counts), set(user_ids[1:]))
+        self.assertEqual(set(leader_counts.values()), {4})
+
+    def test_shutdown(self):
+        """Unittest for changes queued while the workers are stopping."""
+        movement_id, _ = self.create_members(0)
+        order = []
+
+        def workers():
+            return [
+                thread for thread in threading.enumerate()
+                if thread.name.startswith("gridt-writer-")
+            ]
+
+        def change(number):
+            return Writer.submit(
+                movement_id, lambda session: order.append(number)
+            )
+
+        event = self.block(movement_id)
+        futures = [change(number) for number in range(5)]
+        Writer.shutdown(wait=False)
+        futures += [change(number) for number in range(5, 10)]
+        # The stopping worker applies the new changes, no second one starts.
+        self.assertEqual(len(workers()), 1)
+        event.set()
+
+        for future in futures:
+            future.result(timeout=60)
+        self.assertEqual(order, list(range(10)))
+        Writer.shutdown()
+        self.assertEqual(workers(), [])
+        self.assertEqual(change(10).result(timeout=60), None)
+        self.assertEqual(order[-1], 10)
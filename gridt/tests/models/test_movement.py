@@ -1,6 +1,11 @@
 """Tests for Movement Model."""
+from unittest.mock import Mock
+
+from sqlalchemy import text
+
 from gridt.tests.basetest import BaseTest
-from gridt.models import Movement
+from gridt.models import Movement, User
+from gridt.models.movement import TRIGGERS, upgrade_graph_version
 
 
 class UnitTestMovement(BaseTest):
@@ -44,3 +49,35 @@ class UnitTestMovement(BaseTest):
             "interval": "daily",
         }
         self.assertEqual(movement.to_json(), expected)
+
+    def test_upgrade_graph_version(self):
+        """Unittest for upgrade_graph_version on an older database."""
+        movement = self.create_movement()
+        user = self.create_user()
+        self.session.commit()
+        movement_id, user_id = movement.id, user.id
+        self.session.close()
+
+        # A database created before the graph version existed.
+        with self.engine.begin() as connection:
+            for name in TRIGGERS:
+                connection.execute(text(f"DROP TRIGGER {name}"))
+            connection.execute(
+                text("ALTER TABLE movements DROP COLUMN graph_version")
+            )
+
+        upgrade_graph_version(self.engine)
+        upgrade_graph_version(self.engine)
+
+        movement = self.session.get(Movement, movement_id)
+        self.assertEqual(movement.graph_version, 0)
+        self.create_subscription(movement, self.session.get(User, user_id))
+        self.session.commit()
+        self.assertEqual(movement.graph_version, 1)
+
+    def test_upgrade_graph_version_unsupported(self):
+        """Unittest for upgrade_graph_version without trigger support."""
+        engine = Mock()
+        engine.dialect.name = "postgresql"
+        with self.assertRaises(NotImplementedError):
+            upgrade_graph_version(engine)
@@ -0,0 +1,172 @@
+"""Algorithms on graphs stored in compressed sparse row (CSR) form."""
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+
+def degrees(indptr: array, indices: array) -> tuple:
+    """
+    Compute the out and in degree of every node of a CSR graph.
+
+    Args:
+        indptr (array): Row offsets, one more than the amount of nodes.
+        indices (array): Column of every edge, grouped per row.
+
+    Returns:
+        tuple: Arrays with the out degree and the in degree of every node.
+    """
+    node_count = len(indptr) - 1
+    out_degrees = array("q", (
+        indptr[i + 1] - indptr[i] for i in range(node_count)
+    ))
+    in_degrees = array("q", bytes(8 * node_count))
+    for column in indices:
+        in_degrees[column] += 1
+    return out_degrees, in_degrees
+
+
+def histogram(values) -> dict:
+    """Count how often every value occurs, sorted by value."""
+    return dict(sorted(Counter(values).items()))
+
+
+def weakly_connected_components(indptr: array, indices: array) -> array:
+    """
+    Label the weakly connected components of a CSR graph.
+
+    Uses union-find with path halving, so the graph is only traversed once.
+
+    Args:
+        indptr (array): Row offsets, one more than the amount of nodes.
+        indices (array): Column of every edge, grouped per row.
+
+    Returns:
+        array: The smallest node in the component of every node.
+    """
+    parent = array("q", range(len(indptr) - 1))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for row in range(len(indptr) - 1):
+        for k in range(indptr[row], indptr[row + 1]):
+            a, b = find(row), find(indices[k])
+            if a != b:
+                parent[max(a, b)] = min(a, b)
+
+    return array("q", (find(node) for node in range(len(parent))))
+
+
+def count_reciprocal_edges(indptr: array, indices: array) -> int:
+    """
+    Count the edges whose reverse edge is also in a CSR graph.
+
+    The columns within every row must be sorted.
+
+    Args:
+        indptr (array): Row offsets, one more than the amount of nodes.
+        indices (array): Column of every edge, sorted within every row.
+
+    Returns:
+        int: The amount of edges i -> j for which j -> i exists too.
+    """
+    count = 0
+    for row in range(len(indptr) - 1):
+        for k in range(indptr[row], indptr[row + 1]):
+            column = indices[k]
+            start, end = indptr[column], indptr[column + 1]
+            position = bisect_left(indices, row, start, end)
+            if position < end and indices[position] == row:
+                count += 1
+    return count
+
+
+def spectral_layout(
+    indptr: array, indices: array, initial: tuple = None, iterations: int = 50
+) -> tuple:
+    """
+    Compute two dimensional coordinates for the nodes of a CSR graph.
+
+    The coordinates are the two most significant non trivial eigenvectors of
+    the random walk matrix of the undirected graph, found with orthogonal
+    power iteration. Every iteration costs one pass over the edges. Starting
+    from the coordinates of a similar graph converges in a few iterations.
+
+    Args:
+        indptr (array): Row offsets, one more than the amount of nodes.
+        indices (array): Column of every edge, grouped per row.
+        initial (tuple): Optional arrays of x and y to start iterating from.
+        iterations (int): The amount of power iterations.
+
+    Returns:
+        tuple: Arrays with the x and y coordinate of every node, scaled to
+        the range [-1, 1].
+    """
+    node_count = len(indptr) - 1
+    # Every node gets a self loop, so isolated nodes have a weight as well.
+    weights = array("d", [1.0] * node_count)
+    for row in range(node_count):
+        for k in range(indptr[row], indptr[row + 1]):
+            weights[row] += 1
+            weights[indices[k]] += 1
+
+    def step(values):
+        totals = array("d", values)
+        for row in range(node_count):
+            for k in range(indptr[row], indptr[row + 1]):
+                column = indices[k]
+                totals[row] += values[column]
+                totals[column] += values[row]
+        return array("d", (
+            (values[i] + totals[i] / weights[i]) / 2
+            for i in range(node_count)
+        ))
+
+    def dot(a, b):
+        return sum(w * x * y for w, x, y in zip(weights, a, b))
+
+    def orthogonalize(values, others):
+        # The constant vector is the trivial eigenvector.
+        mean = dot(values, [1.0] * node_count) / sum(weights)
+        values = array("d", (value - mean for value in values))
+        for other in others:
+            norm = dot(other, other)
+            if norm:
+                factor = dot(values, other) / norm
+                values = array("d", (
+                    value - factor * o for value, o in zip(values, other)
+                ))
+        norm = dot(values, values) ** 0.5
+        if norm:
+            values = array("d", (value / norm for value in values))
+        return values
+
+    if initial is None:
+        xs = array("d", (_noise(i, 0) for i in range(node_count)))
+        ys = array("d", (_noise(i, 1) for i in range(node_count)))
+    else:
+        xs, ys = (array("d", values) for values in initial)
+
+    xs = orthogonalize(xs, [])
+    ys = orthogonalize(ys, [xs])
+    for _ in range(iterations):
+        xs = orthogonalize(step(xs), [])
+        ys = orthogonalize(step(ys), [xs])
+
+    return _scale(xs), _scale(ys)
+
+
+def _noise(node: int, axis: int) -> float:
+    """Deterministic pseudo random number in [-1, 1] for a node and axis."""
+    return ((node * 2654435761 + axis * 40503) % 65536) / 32768 - 1
+
+
+def _scale(values: array) -> array:
+    """Scale values to the range [-1, 1]."""
+    largest = max((abs(value) for value in values), default=0)
+    if not largest:
+        return values
+    return array("d", (value / largest for value in values))
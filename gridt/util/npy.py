@@ -0,0 +1,91 @@
+"""Read and write NumPy compatible .npz files without depending on NumPy."""
+import ast
+import struct
+import sys
+import zipfile
+from array import array
+
+MAGIC = b"\x93NUMPY"
+VERSION = b"\x01\x00"
+ALIGNMENT = 64
+
+_ENDIAN = "<" if sys.byteorder == "little" else ">"
+_DESCRS = {
+    "b": "i1", "B": "u1",
+    "h": "i2", "H": "u2",
+    "i": "i4", "I": "u4",
+    "q": "i8", "Q": "u8",
+    "f": "f4", "d": "f8",
+}
+_TYPECODES = {descr: code for code, descr in _DESCRS.items()}
+
+
+def save_npz(file, arrays: dict) -> None:
+    """
+    Save typed arrays to an uncompressed .npz file.
+
+    The arrays are stored uncompressed, so ``numpy.load`` can read them
+    without decompressing and the data of every member is contiguous.
+
+    Args:
+        file (str or file): Path or binary file object to write to.
+        arrays (dict): Mapping of names to :class:`array.array` objects.
+    """
+    with zipfile.ZipFile(file, "w", zipfile.ZIP_STORED) as archive:
+        for name, values in arrays.items():
+            archive.writestr(f"{name}.npy", _to_npy(values))
+
+
+def load_npz(file) -> dict:
+    """
+    Load the typed arrays in an .npz file written by :func:`save_npz`.
+
+    Args:
+        file (str or file): Path or binary file object to read from.
+
+    Returns:
+        dict: Mapping of names to :class:`array.array` objects.
+    """
+    with zipfile.ZipFile(file, "r") as archive:
+        return {
+            name[:-len(".npy")]: _from_npy(archive.read(name))
+            for name in archive.namelist()
+        }
+
+
+def _to_npy(values: array) -> bytes:
+    """Serialize a one dimensional array in the .npy format."""
+    descr = _ENDIAN + _DESCRS[values.typecode]
+    header = (
+        f"{{'descr': '{descr}', 'fortran_order': False, "
+        f"'shape': ({len(values)},), }}"
+    )
+    # Pad the header with spaces so the data starts on an aligned offset.
+    preamble_length = len(MAGIC) + len(VERSION) + 2
+    padding = -(preamble_length + len(header) + 1) % ALIGNMENT
+    header = (header + " " * padding + "\n").encode("latin1")
+    return (
+        MAGIC + VERSION + struct.pack("<H", len(header)) + header
+        + values.tobytes()
+    )
+
+
+def _from_npy(data: bytes) -> array:
+    """Deserialize a one dimensional array from the .npy format."""
+    if not data.startswith(MAGIC + VERSION):
+        raise ValueError("Unsupported .npy format.")
+
+    offset = len(MAGIC) + len(VERSION)
+    (header_length,) = struct.unpack_from("<H", data, offset)
+    offset += 2
+    header = ast.literal_eval(
+        data[offset:offset + header_length].decode("latin1")
+    )
+    offset += header_length
+
+    byteorder, descr = header["descr"][0], header["descr"][1:]
+    values = array(_TYPECODES[descr])
+    values.frombytes(data[offset:])
+    if byteorder not in (_ENDIAN, "|"):
+        values.byteswap()
+    return values